@@ -5,6 +5,7 @@ Various decorator functions
     - Make a parallel version of a function (@make_parallel)
     - Retry with exponential backoff (@retry(3,2))
     - Retry accessing website with exponential backoff (@retry(3,2))
+    - Retry on selected exceptions with exponential backoff (@retry_backoff(3,1,2))
     - Counting function calls (@countcalls)
     - Timing function calls
     - Redirecting print statements to logger
@@ -199,6 +200,59 @@ def retry_http(tries, backoff=2, on_failure='error'):
     socket.setdefaulttimeout(o_delay)
     return deco_retry  # @retry(arg[, ...]) -> true decorator
 
+def retry_backoff(tries, delay=1., backoff=2., exceptions=(IOError,socket.error), reraise=()):
+    """
+    Retry a function or method until it does not raise one of C{exceptions}.
+    
+    This generalises L{retry}: instead of retrying until the function returns
+    True, the function is retried whenever it raises one of the given
+    exceptions, and its return value is passed on. When all tries are
+    exhausted, the last exception is reraised.
+    
+    Delay sets the initial delay, and backoff sets how much the delay should
+    lengthen after each failure. backoff must be greater than 1, or else it
+    isn't really a backoff. tries must be at least 0, and delay greater than 0.
+    
+    @param tries: number of retries after the first attempt
+    @type tries: int
+    @param delay: initial delay between attempts (s)
+    @type delay: float
+    @param backoff: factor to lengthen the delay with after each failure
+    @type backoff: float
+    @param exceptions: exceptions that trigger a retry
+    @type exceptions: tuple of exception classes
+    @param reraise: exceptions that are raised immediately, also when they are
+    a subclass of one of C{exceptions}
+    @type reraise: tuple of exception classes
+    """
+    if backoff <= 1:
+      raise ValueError("backoff must be greater than 1")
+    
+    tries = int(math.floor(tries))
+    if tries < 0:
+      raise ValueError("tries must be 0 or greater")
+    
+    if delay <= 0:
+      raise ValueError("delay must be greater than 0")
+    
+    def deco_retry(f):
+      @functools.wraps(f)
+      def f_retry(*args, **kwargs):
+        mtries, mdelay = tries, delay # make mutable
+        while True:
+          try:
+            return f(*args, **kwargs)
+          except exceptions,msg:
+            if mtries <= 0 or isinstance(msg,reraise):
+              raise
+            logger.warning("%s failed (%s): %d attempts remaining (delay=%.1fs)"%(f.__name__,msg,mtries,mdelay))
+          mtries -= 1      # consume an attempt
+          time.sleep(mdelay) # wait...
+          mdelay *= backoff  # make future wait longer
+      
+      return f_retry # true decorator -> decorated function
+    return deco_retry  # @retry_backoff(arg[, ...]) -> true decorator
+
 class countcalls(object):
    """
    Keeps track of the number of times a function is called.
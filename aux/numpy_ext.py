@@ -356,10 +356,8 @@ def recarr_addcols(x,cols,dtypes_ext):
     names = list(x.dtype.names)
     dtypes = [(name,x.dtype[names.index(name)].str) for name in names]
     dtypes += dtypes_ext
-    rows = []
-    for i in range(len(x)):
-        rows.append(tuple(list(x[i]) + [col[i] for col in cols]))
-    x = np.core.records.fromrecords(rows,dtype=dtypes)
+    arrays = [x[name] for name in names] + [np.asarray(col) for col in cols]
+    x = np.core.records.fromarrays(arrays,dtype=dtypes)
     return x
 
 def recarr_join(arr1,arr2):
@@ -28,6 +28,7 @@ from ivs.aux import argkwargparser
 from ivs.io import ascii
 
 from scipy.spatial import KDTree
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger("CAT.XMATCH")
 
@@ -107,30 +108,33 @@ def get_photometry(ID=None,to_units='erg/s/cm2/AA',extra_fields=[],include=None,
     if exclude is not None:
         searchables = list( set(searchables)- set(exclude))
     
-    #-- and search photometry
-    if 'mast' in searchables:
-        kwargs['master'] = mast.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
-    if 'gator' in searchables:
-        kwargs['master'] = gator.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
-    if 'vizier' in searchables:
-        #-- first query catalogs that can only be queried via HD number
-        info = sesame.search(ID=ID,fix=True)
-        if 'alias' in info:
-            HDnumber = [name for name in info['alias'] if name[:2]=='HD']
-            if HDnumber:
-                kwargs['master'] = vizier.get_photometry(extra_fields=extra_fields,constraints=['HD=%s'%(HDnumber[0][3:])],sources=['II/83/catalog','V/33/phot'],sort=None,**kwargs)
-        #-- then query catalogs that can only be queried via another catalog
-        results,units,comms = vizier.search('J/A+A/380/609/table1',ID=ID)
-        if results is not None:
-            catname = results[0]['Name'].strip()
-            kwargs['master'] = vizier.get_photometry(take_mean=True,extra_fields=extra_fields,constraints=['Name={0}'.format(catname)],sources=['J/A+A/380/609/table{0}'.format(tnr) for tnr in range(2,5)],sort=None,**kwargs)
-        #-- then query normal catalogs
-        kwargs['master'] = vizier.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
-        
-        
-    if 'gcpd' in searchables:
-        kwargs['master'] = gcpd.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
-    master = kwargs['master']
+    #-- and search photometry: the sources are queried concurrently, each
+    #   collecting its own measurements, which are afterwards combined in
+    #   a fixed order
+    master = kwargs.pop('master',None)
+    def search_source(source):
+        if source=='mast':
+            return mast.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
+        if source=='gator':
+            return gator.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
+        if source=='vizier':
+            return _get_vizier_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
+        if source=='gcpd':
+            return gcpd.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
+    sources = [source for source in ['mast','gator','vizier','gcpd'] if source in searchables]
+    workers = ThreadPool(max(1,len(sources)))
+    try:
+        masters = workers.map(search_source,sources)
+    finally:
+        workers.close()
+        workers.join()
+    for master_ in masters:
+        if master_ is None:
+            continue
+        elif master is None:
+            master = master_
+        else:
+            master = numpy_ext.recarr_addrows(master,master_.tolist())
     
     #-- now make a summary of the contents:
     photbands = [phot.split('.')[0]  for phot in master['photband']]
@@ -139,6 +143,28 @@ def get_photometry(ID=None,to_units='erg/s/cm2/AA',extra_fields=[],include=None,
         logger.info('%10s: found %d measurements'%phot)
     return master
 
+def _get_vizier_photometry(ID=None,to_units='erg/s/cm2/AA',extra_fields=[],**kwargs):
+    """
+    Collect photometry from VizieR, including catalogs that can only be
+    queried via the HD number or via another catalog.
+    
+    @return: record array where eacht entry is a photometric measurement
+    @rtype: record array
+    """
+    #-- first query catalogs that can only be queried via HD number
+    info = sesame.search(ID=ID,fix=True)
+    if 'alias' in info:
+        HDnumber = [name for name in info['alias'] if name[:2]=='HD']
+        if HDnumber:
+            kwargs['master'] = vizier.get_photometry(extra_fields=extra_fields,constraints=['HD=%s'%(HDnumber[0][3:])],sources=['II/83/catalog','V/33/phot'],sort=None,**kwargs)
+    #-- then query catalogs that can only be queried via another catalog
+    results,units,comms = vizier.search('J/A+A/380/609/table1',ID=ID)
+    if results is not None:
+        catname = results[0]['Name'].strip()
+        kwargs['master'] = vizier.get_photometry(take_mean=True,extra_fields=extra_fields,constraints=['Name={0}'.format(catname)],sources=['J/A+A/380/609/table{0}'.format(tnr) for tnr in range(2,5)],sort=None,**kwargs)
+    #-- then query normal catalogs
+    return vizier.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
+
 def add_bibcodes(master):
     """
     Add bibcodes to a master record.
@@ -11,6 +11,9 @@ import numpy as np
 from ivs.aux import loggers
 from ivs.aux import numpy_ext
 from ivs.io import ascii
+from ivs.io import http
+from ivs.catalogs import sesame
+from ivs.catalogs import vizier
 from ivs.sed import filters
 from ivs.units import conversions
 
@@ -73,28 +76,101 @@ def search(catalog,**kwargs):
     
     #-- gradually build URI
     base_url = _get_URI(catalog,**kwargs)
-    #-- prepare to open URI
-    url = urllib.URLopener()
-    filen,msg = url.retrieve(base_url,filename=filename)
+    #-- open URI (or take it from the query cache), without filename the
+    #   results go to a temporary file
+    filen = http.fetch(base_url,filename=filename or True)
     #   maybe we are just interest in the file, not immediately in the content
     if filename is not None:
         logger.info('Querying GATOR source %s and downloading to %s'%(catalog,filen))
-        url.close()
         return filen
     
     #   otherwise, we read everything into a dictionary
-    if filetype=='1':
-        try:
-            results,units,comms = txt2recarray(filen)
-        #-- raise an exception when multiple catalogs were specified
-        except ValueError:
-            raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(catalog)
-        url.close()
-        logger.info('Querying GATOR source %s (%d)'%(catalog,(results is not None and len(results) or 0)))
-        return results,units,comms
+    try:
+        if filetype=='1':
+            try:
+                results,units,comms = txt2recarray(filen)
+            #-- raise an exception when multiple catalogs were specified
+            except ValueError:
+                raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(catalog)
+            logger.info('Querying GATOR source %s (%d)'%(catalog,(results is not None and len(results) or 0)))
+            return results,units,comms
+    finally:
+        os.unlink(filen)
+
 
 
 
+def search_bulk(catalog,ra=None,dec=None,ID=None,radius=1.,batchsize=1000,threads=8,**kwargs):
+    """
+    Cone search in a GATOR catalog around many targets at once.
+    
+    Instead of one query per target, the targets are uploaded in batches of
+    C{batchsize} as an IPAC table to GATOR's multi-object search. The batches
+    are queried concurrently (at most C{threads} at a time). The response is
+    split back per target via the C{cntr_u} column (the row number in the
+    uploaded table), and sorted on the distance to the target (C{dist_x},
+    renamed to C{dist} as in a single cone search).
+    
+    Give either the coordinates (C{ra} and C{dec} in degrees) or the names of
+    the targets (C{ID}), which are first resolved with Sesame.
+    
+    @param catalog: name of a GATOR catalog (e.g. 'wise_prelim_p3as_psd')
+    @type catalog: str
+    @param ra: targets' right ascensions (degrees)
+    @type ra: array
+    @param dec: targets' declinations (degrees)
+    @type dec: array
+    @param ID: targets' names
+    @type ID: list of str
+    @param radius: search radius (arcseconds)
+    @type radius: float
+    @param batchsize: maximum number of targets in one query
+    @type batchsize: int
+    @param threads: maximum number of simultaneous queries
+    @type threads: int
+    @return: list of (catalog data columns, units, comments), one for each
+    target (data columns are None if nothing was found)
+    @rtype: list of (record array, dict, list of str)
+    """
+    if ID is not None:
+        ra,dec = sesame.resolve(ID,threads=threads)
+    ra,dec = np.atleast_1d(np.asarray(ra,float)),np.atleast_1d(np.asarray(dec,float))
+    resolved = np.flatnonzero(~np.isnan(ra) & ~np.isnan(dec))
+    
+    base_url = _get_URI(catalog).split('?')[0]
+    fields = [('catalog',catalog),('spatial','Upload'),('uplradius',radius),('outfmt','1')]
+    batches = [resolved[i:i+batchsize] for i in range(0,len(resolved),batchsize)]
+    queries = []
+    for batch in batches:
+        table = ['|%12s|%14s|%14s|'%('cntr','ra','dec'),'|%12s|%14s|%14s|'%('int','double','double')]
+        table += [' %12d %14.8f %14.8f '%(j+1,ra[i],dec[i]) for j,i in enumerate(batch)]
+        data,headers = http.encode_multipart(fields,[('filename','targets.tbl','\n'.join(table)+'\n')])
+        queries.append((base_url,data,headers))
+    filens = http.fetch_all(queries,threads=threads,filename=True)
+    
+    output = [(None,{},[]) for i in range(len(ra))]
+    try:
+        for batch,filen in zip(batches,filens):
+            results,units,comms = txt2recarray(filen)
+            if results is None:
+                continue
+            #-- name the distance column as in a single cone search
+            if not 'dist' in results.dtype.names:
+                results.dtype.names = [name=='dist_x' and 'dist' or name for name in results.dtype.names]
+                units['dist'] = units.get('dist_x','arcsec')
+            #-- split per target, nearest match first
+            index = results['cntr_u'].astype(int)-1
+            order = np.lexsort([results['dist'],index])
+            edges = np.searchsorted(index[order],np.arange(len(batch)+1))
+            for j,i in enumerate(batch):
+                if edges[j]<edges[j+1]:
+                    output[i] = results[order[edges[j]:edges[j+1]]],units,comms
+    finally:
+        for filen in filens:
+            os.unlink(filen)
+    found = sum([results is not None for results,units,comms in output])
+    logger.info('Querying GATOR source %s for %d targets (%d found)'%(catalog,len(ra),found))
+    return output
 
 def list_catalogs():
     """
@@ -154,33 +230,7 @@ def get_photometry(ID=None,extra_fields=['dist','ra','dec'],**kwargs):
     
     #-- convert the measurement to a common unit.
     if to_units and master is not None:
-        #-- prepare columns to extend to basic master
-        dtypes = [('cwave','f8'),('cmeas','f8'),('e_cmeas','f8'),('cunit','a50')]
-        cols = [[],[],[],[]]
-        #-- forget about 'nan' errors for the moment
-        no_errors = np.isnan(master['e_meas'])
-        master['e_meas'][no_errors] = 0.
-        #-- extend basic master
-        zp = filters.get_info(master['photband'])
-        for i in range(len(master)):
-            try:
-                value,e_value = conversions.convert(master['unit'][i],to_units,master['meas'][i],master['e_meas'][i],photband=master['photband'][i])
-            except ValueError: # calibrations not available
-                value,e_value = np.nan,np.nan
-            except AssertionError: # the error or flux must be positive number
-                value,e_value = np.nan,np.nan
-            try:
-                eff_wave = filters.eff_wave(master['photband'][i])
-            except IOError:
-                eff_wave = np.nan
-            cols[0].append(eff_wave)
-            cols[1].append(value)
-            cols[2].append(e_value)
-            cols[3].append(to_units)
-        master = numpy_ext.recarr_addcols(master,cols,dtypes)
-        #-- reset errors
-        master['e_meas'][no_errors] = np.nan
-        master['e_cmeas'][no_errors] = np.nan
+        master = vizier._convert_photometry(master,to_units,colors=False)
     
     if master_ is not None and master is not None:
         master = numpy_ext.recarr_addrows(master_,master.tolist())
@@ -190,6 +240,35 @@ def get_photometry(ID=None,extra_fields=['dist','ra','dec'],**kwargs):
     #-- and return the results
     return master
 
+def get_photometry_bulk(ID=None,ra=None,dec=None,extra_fields=['_r','_RAJ2000','_DEJ2000'],**kwargs):
+    """
+    Download all available photometry from many stars, one record array per
+    star.
+    
+    Every catalog is queried with L{search_bulk}, so that the number of
+    queries does not scale with the number of targets. Give either the
+    targets' coordinates (C{ra} and C{dec} in degrees) or their names (C{ID}).
+    
+    For extra kwargs, see L{search_bulk} and L{gator2phot}.
+    
+    @return: record arrays where eacht entry is a photometric measurement
+    (None if nothing was found), one for each target
+    @rtype: list of record arrays
+    """
+    to_units = kwargs.pop('to_units','erg/s/cm2/AA')
+    if ID is not None:
+        ra,dec = sesame.resolve(ID,threads=kwargs.get('threads',8))
+    masters = [None for i in range(len(np.atleast_1d(ra)))]
+    #-- retrieve all measurements
+    for source in cat_info.sections():
+        for i,(results,units,comms) in enumerate(search_bulk(source,ra=ra,dec=dec,**kwargs)):
+            if results is not None:
+                masters[i] = gator2phot(source,results,units,masters[i],extra_fields=extra_fields)
+    #-- convert the measurement to a common unit.
+    if to_units:
+        masters = [vizier._convert_photometry(master,to_units,colors=False) if master is not None else None for master in masters]
+    return masters
+
 
 #}
 
@@ -206,42 +285,27 @@ def txt2recarray(filename):
     @rtype: record array, dict, list of str
     """
     ff = open(filename,'r')
+    lines = ff.read().splitlines()
+    ff.close()
     data = []
     comms = []
     indices = None
-    while 1:  # might call read several times for a file
-        line = ff.readline()
-        if not line: break  # end of file
-        
-        #-- strip return character from line
-        if line.isspace():
-            continue # empty line
-        
-        #-- remove return characters
-        line = line.replace('\n','')
-        #-- when reading a comment line
-        if line[0] =='\\':
-            continue # treat next line
+    for i,line in enumerate(lines):
+        if line.isspace() or not line or line[0]=='\\':
+            continue
         if line[0] == '|':
             comms.append(line)
-            indices = []
-            for i in range(len(line)):
-                if line[i]=='|': indices.append(i)
+            indices = [j for j,char in enumerate(line) if char=='|']
             continue
         if indices is None: break
-        data.append([])
-        for i in range(len(indices)-1):
-            data[-1].append(line[indices[i]:indices[i+1]].strip())
+        data = [line for line in lines[i:] if line and not line.isspace()]
+        break
     results = None
     units = {}
     #-- retrieve the data and put it into a record array
     if comms:
-        #-- now convert this thing into a nice dictionary
-        data = np.array(data)
-        #-- retrieve the format of the columns. They are given in the
-        #   Fortran format. In rare cases, columns contain multiple values
-        #   themselves (so called vectors). In those cases, we interpret
-        #   the contents as a long string
+        #-- the first three header lines contain the names, types and units
+        #   of the columns
         names = [head.strip() for head in comms[0].split('|')[1:-1]]
         formats = comms[1]
         formats = formats.replace('double','f8')
@@ -250,25 +314,11 @@ def txt2recarray(filename):
         formats = formats.replace('long','f8')
         formats = [head.strip() for head in formats.split('|')[1:-1]]
         units_ = [head.strip() for head in comms[2].split('|')[1:-1]]
-        #-- define dtypes for record array
-        dtypes = np.dtype([(i,j) for i,j in zip(names,formats)])
-        #-- remove spaces or empty values
-        cols = []
-        for i,key in enumerate(names):
-            units[key] = units_[i]
-            if len(data)==0: break
-            col = data[:,i]
-            #-- fill empty or null values with nan
-            col = [(row.isspace() or not row or row=='null') and 'nan' or row for row in col]
-            cols.append(col)
-            
-        #-- define columns for record array and construct record array
-        if len(data)==0:
-            results = None
-        else:
-            cols = np.array(cols)
-            cols = [np.cast[dtypes[i]](cols[i]) for i in range(len(cols))]
-            results = np.rec.array(cols, dtype=dtypes)
+        units = dict(zip(names,units_))
+        #-- convert all columns at once, empty or null values become nan
+        if data:
+            cells = ascii.lines2cells(data,positions=indices)
+            results = ascii.cells2recarray(cells,names,formats)
     return results,units,comms
 
 
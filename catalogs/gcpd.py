@@ -220,45 +220,7 @@ def get_photometry(ID=None,extra_fields=[],**kwargs):
     
     #-- convert the measurement to a common unit.
     if to_units and master is not None:
-        #-- prepare columns to extend to basic master
-        dtypes = [('cwave','f8'),('cmeas','f8'),('e_cmeas','f8'),('cunit','a50')]
-        cols = [[],[],[],[]]
-        #-- forget about 'nan' errors for the moment
-        no_errors = np.isnan(master['e_meas'])
-        master['e_meas'][no_errors] = 0.
-        #-- extend basic master
-        try:
-            zp = filters.get_info(master['photband'])
-        except:
-            print master['photband']
-            raise
-        for i in range(len(master)):
-            to_units_ = to_units+''
-            try:
-                value,e_value = conversions.convert(master['unit'][i],to_units,master['meas'][i],master['e_meas'][i],photband=master['photband'][i])
-            except ValueError: # calibrations not available
-                # if it is a magnitude color, try converting it to a flux ratio
-                if 'mag' in master['unit'][i]:
-                    try:
-                        value,e_value = conversions.convert('mag_color','flux_ratio',master['meas'][i],master['e_meas'][i],photband=master['photband'][i])
-                        to_units_ = 'flux_ratio'
-                    except ValueError:
-                        value,e_value = np.nan,np.nan
-                # else, we are powerless...
-                else:
-                    value,e_value = np.nan,np.nan
-            try:
-                eff_wave = filters.eff_wave(master['photband'][i])
-            except IOError:
-                eff_wave = np.nan
-            cols[0].append(eff_wave)
-            cols[1].append(value)
-            cols[2].append(e_value)
-            cols[3].append(to_units_)
-        master = numpy_ext.recarr_addcols(master,cols,dtypes)
-        #-- reset errors
-        master['e_meas'][no_errors] = np.nan
-        master['e_cmeas'][no_errors] = np.nan
+        master = vizier._convert_photometry(master,to_units,colors=True)
     
     #-- if a master is given as a keyword, and data is found in this module,
     #   append the two
@@ -197,31 +197,29 @@ def search(catalog,**kwargs):
     
     #-- gradually build URI
     base_url = _get_URI(catalog,**kwargs)
-    #-- prepare to open URI
-    
-    url = urllib.URLopener()
-    filen,msg = url.retrieve(base_url,filename=filename)
+    #-- open URI (or take it from the query cache), without filename the
+    #   results go to a temporary file
+    filen = http.fetch(base_url,filename=filename or True)
     #   maybe we are just interest in the file, not immediately in the content
     if filename is not None:
         logger.info('Querying MAST source %s and downloading to %s'%(catalog,filename))
-        url.close()
         return filen
     
     #   otherwise, we read everything into a dictionary
-    
-    if filetype=='CSV' and not filename:
-        try:
-            results,units,comms = csv2recarray(filen)
-        #-- raise an exception when multiple catalogs were specified
-        except ValueError:
-            url.close()
-            #raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(catalog)
-            results,units,comms = None,None,None
-        url.close()
-        logger.info('Querying MAST source %s (%d)'%(catalog,(results is not None and len(results) or 0)))
-        return results,units,comms
-    else:
-        return filename
+    try:
+        if filetype=='CSV' and not filename:
+            try:
+                results,units,comms = csv2recarray(filen)
+            #-- raise an exception when multiple catalogs were specified
+            except ValueError:
+                #raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(catalog)
+                results,units,comms = None,None,None
+            logger.info('Querying MAST source %s (%d)'%(catalog,(results is not None and len(results) or 0)))
+            return results,units,comms
+        else:
+            return filename
+    finally:
+        os.unlink(filen)
 
 
 def mast2phot(source,results,units,master=None,extra_fields=None):
@@ -344,45 +342,35 @@ def csv2recarray(filename):
     @return: catalog data columns, units, comments
     @rtype: record array, dict, list of str
     """
-    data,comms = ascii.read2array(filename,dtype=np.str,splitchar=',',return_comments=True)
+    ff = open(filename,'r')
+    lines = ff.read().splitlines()
+    ff.close()
+    comms = [line[1:] for line in lines if line[:1]=='#']
+    data = [line for line in lines if line[:1]!='#' and line.strip()]
     results = None
     units = {}
     #-- retrieve the data and put it into a record array
     if len(data)>1:
-        #-- now convert this thing into a nice dictionary
-        data = np.array(data)
-        #-- retrieve the format of the columns. They are given in the
-        #   Fortran format. In rare cases, columns contain multiple values
-        #   themselves (so called vectors). In those cases, we interpret
-        #   the contents as a long string
-        formats = np.zeros_like(data[0])
-        for i,fmt in enumerate(data[1]):
-            if 'string' in fmt or fmt=='datetime': formats[i] = 'a100'
-            if fmt=='integer': formats[i] = 'f8'
-            if fmt=='ra': formats[i] = 'f8'
-            if fmt=='dec': formats[i] = 'f8'
-            if fmt=='float': formats[i] = 'f8'
-        #-- define dtypes for record array
-        dtypes = np.dtype([(i,j) for i,j in zip(data[0],formats)])
-        #-- remove spaces or empty values
-        cols = []
-        for i,key in enumerate(data[0]):
-             col = data[2:,i]
-             #-- fill empty values with nan
-             cols.append([(row.isspace() or not row) and np.nan or row for row in col])
-             #-- fix unit name
-             for source in cat_info.sections():
-                if cat_info.has_option(source,data[0,i]+'_unit'):
-                    units[key] = cat_info.get(source,data[0,i]+'_unit')
+        names = data[0].split(',')
+        #-- retrieve the format of the columns from the second header line
+        formats = []
+        for fmt in data[1].split(','):
+            if fmt in ['integer','ra','dec','float']: formats.append('f8')
+            else: formats.append('a100')
+        #-- fix unit name
+        for key in names:
+            for source in cat_info.sections():
+                if cat_info.has_option(source,key+'_unit'):
+                    units[key] = cat_info.get(source,key+'_unit')
                     break
-             else:  
+            else:
                 units[key] = 'nan'
-        #-- define columns for record array and construct record array
-        cols = [np.cast[dtypes[i]](cols[i]) for i in range(len(cols))]
-        results = np.rec.array(cols, dtype=dtypes)
-    else:
-        results = None
-        units = {}
+        #-- convert all columns at once, empty values become nan
+        if len(data)>2:
+            cells = ascii.lines2cells(data[2:],splitchar=',')
+        else:
+            cells = np.zeros((0,len(names)),str)
+        results = ascii.cells2recarray(cells,names,formats)
     return results,units,comms
 
 
@@ -408,33 +396,7 @@ def get_photometry(ID=None,extra_fields=['_r','_RAJ2000','_DEJ2000'],**kwargs):
     
     #-- convert the measurement to a common unit.
     if to_units and master is not None:
-        #-- prepare columns to extend to basic master
-        dtypes = [('cwave','f8'),('cmeas','f8'),('e_cmeas','f8'),('cunit','a50')]
-        cols = [[],[],[],[]]
-        #-- forget about 'nan' errors for the moment
-        no_errors = np.isnan(master['e_meas'])
-        master['e_meas'][no_errors] = 0.
-        #-- extend basic master
-        zp = filters.get_info(master['photband'])
-        for i in range(len(master)):
-            try:
-                value,e_value = conversions.convert(master['unit'][i],to_units,master['meas'][i],master['e_meas'][i],photband=master['photband'][i])
-            except ValueError: # calibrations not available
-                value,e_value = np.nan,np.nan
-            except AssertionError: # postive flux and errors!
-                value,e_value = np.nan,np.nan
-            try:
-                eff_wave = filters.eff_wave(master['photband'][i])
-            except IOError:
-                eff_wave = np.nan
-            cols[0].append(eff_wave)
-            cols[1].append(value)
-            cols[2].append(e_value)
-            cols[3].append(to_units)
-        master = numpy_ext.recarr_addcols(master,cols,dtypes)
-        #-- reset errors
-        master['e_meas'][no_errors] = np.nan
-        master['e_cmeas'][no_errors] = np.nan
+        master = vizier._convert_photometry(master,to_units,colors=False)
     
     if master_ is not None and master is not None:
         master = numpy_ext.recarr_addrows(master_,master.tolist())
@@ -4,10 +4,12 @@ Interface to Sesame for general information on a star (SIMBAD)
 """
 import urllib
 import logging
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 from ivs.units import conversions
 from ivs.aux import xmlparser
+from ivs.io import http
 from ivs.catalogs import vizier
 
 logger = logging.getLogger("CAT.SESAME")
@@ -145,9 +147,8 @@ def search(ID,db='S',fix=False):
     @rtype: dictionary
     """
     base_url = get_URI(ID,db=db)
-    ff = urllib.urlopen(base_url)
     xmlpage = ""
-    for line in ff.readlines():
+    for line in http.fetch(base_url).splitlines(True):
         line_ = line[::-1].strip(' ')[::-1]
         if line_[0]=='<':
             line = line_
@@ -159,7 +160,6 @@ def search(ID,db='S',fix=False):
     except KeyError,IndexError:
         #-- we found nothing!
         database = {}
-    ff.close()
     
     if fix:
         #-- fix the parallax: make sure we have the Van Leeuwen 2007 value.
@@ -194,6 +194,42 @@ def search(ID,db='S',fix=False):
             database['pm']['epmDE'] = data['e_pmDE'][0]
             database['pm']['r'] = 'I/317/sample'
     return database
+
+def resolve(IDs,db='S',threads=8):
+    """
+    Resolve the equatorial coordinates (J2000, degrees) of many targets.
+    
+    The targets are queried concurrently. Targets that cannot be resolved get
+    C{nan} coordinates.
+    
+    >>> ra,dec = resolve(['vega','sirius'])
+    
+    @param IDs: names of the sources
+    @type IDs: list of str
+    @param db: database to use
+    @type db: str ('N','S','V','A')
+    @param threads: maximum number of simultaneous queries
+    @type threads: int
+    @return: right ascensions, declinations
+    @rtype: array, array
+    """
+    def resolve_one(ID):
+        try:
+            info = search(ID,db=db)
+        except IOError:
+            info = {}
+        return float(info.get('jradeg',np.nan)),float(info.get('jdedeg',np.nan))
+    IDs = list(IDs)
+    workers = ThreadPool(max(1,min(int(threads),len(IDs))))
+    try:
+        coordinates = workers.map(resolve_one,IDs)
+    finally:
+        workers.close()
+        workers.join()
+    coordinates = np.array(coordinates,float).reshape((-1,2))
+    for ID in np.array(IDs)[np.isnan(coordinates[:,0])]:
+        logger.warning('Could not resolve %s'%(ID))
+    return coordinates[:,0],coordinates[:,1]
     
 if __name__=="__main__":
     import doctest
@@ -0,0 +1,207 @@
+import os
+import cgi
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+import numpy as np
+from ivs.catalogs import vizier
+from ivs.catalogs import gator
+from ivs.catalogs import mast
+from ivs.io import http
+from ivs.units import conversions
+from ivs.units.uncertainties import unumpy
+
+import unittest
+
+class MockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers VizieR target list queries and GATOR multi-object uploads """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        if self.path.startswith('/viz-bin/asu-tsv'):
+            options = dict(cgi.parse_qsl(self.rfile.read(length),keep_blank_values=True))
+            self.server.options.append(options)
+            targets = [target.replace('+',' +').replace('-',' -').split() for target in options['-c'][3:].split(';')]
+            body = self.vizier_response(targets)
+        else:
+            form = cgi.FieldStorage(fp=self.rfile,headers=self.headers,
+                                    environ={'REQUEST_METHOD':'POST'})
+            table = form['filename'].value.strip().split('\n')[2:]
+            body = self.gator_response([line.split()[1:] for line in table])
+        self.server.queries.append(self.path)
+        self.send_response(200)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def vizier_response(self, targets):
+        """ two matches for every target in the north, sorted on distance """
+        names = ['_r','_RAJ2000','_DEJ2000','Jmag','Hmag','Kmag','_q']
+        formats = ['F6.2','F10.6','F10.6','F6.3','F6.3','F6.3','I4']
+        lines = ['#Column\t%s\t(%s)\t '%(name,fmt) for name,fmt in zip(names,formats)]
+        lines += ['\t'.join(names), 'arcsec\tdeg\tdeg\tmag\tmag\tmag\t ', '\t'.join(['----']*7)]
+        rows = []
+        for q,(ra,dec) in enumerate(targets):
+            if float(dec)<0: continue
+            rows += [(0.5*(q+1),float(ra),float(dec),10.+q,9.,8.,q+1),(9.,float(ra),float(dec),99.,99.,99.,q+1)]
+        rows.sort()
+        lines += ['%.2f\t%.6f\t%.6f\t%.3f\t%.3f\t%.3f\t%d'%row for row in rows]
+        return '\n'.join(lines)+'\n'
+
+    def gator_response(self, targets):
+        """ two matches for every target in the north, farthest first """
+        lines = ['\\fixlen = T', '|  cntr_u|  dist_x|        ra|       dec|  flux24|',
+                 '|     int|  double|    double|    double|  double|',
+                 '|        |  arcsec|       deg|       deg|     mJy|']
+        for q,(ra,dec) in enumerate(targets):
+            if float(dec)<0: continue
+            lines.append('  %7d %8.3f %10.6f %10.6f %8.2f '%(q+1,2.,float(ra),float(dec),99.))
+            lines.append('  %7d %8.3f %10.6f %10.6f %8.2f '%(q+1,0.1,float(ra),float(dec),10.+q))
+        return '\n'.join(lines)+'\n'
+
+    def log_message(self, *args):
+        pass
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class ParserTestCase(unittest.TestCase):
+    
+    def parse(self, func, text):
+        fd,filename = tempfile.mkstemp()
+        os.write(fd,text)
+        os.close(fd)
+        try:
+            return func(filename)
+        finally:
+            os.unlink(filename)
+    
+    def testTSV(self):
+        """ catalogs.vizier.tsv2recarray() """
+        text = '#Column\tJmag\t(F6.3)\tJ\n#Column\tq_Jmag\t(A1)\tflag\n\n'\
+               'Jmag\tq_Jmag\nmag\t \n------\t-\n10.500\t \n      \tA\n'
+        results,units,comms = self.parse(vizier.tsv2recarray,text)
+        self.assertEqual(units['Jmag'], 'mag')
+        self.assertEqual(len(comms), 2)
+        self.assertAlmostEqual(results['Jmag'][0], 10.5)
+        self.assertTrue(np.isnan(results['Jmag'][1]))
+        self.assertEqual(list(results['q_Jmag']), ['nan','A'])
+        
+        #-- a short and a long row should not be merged into full rows
+        text = '#Column\ta\t(I1)\t \n#Column\tb\t(I1)\t \n#Column\tc\t(I1)\t \n'\
+               'a\tb\tc\nmag\tmag\tmag\n-\t-\t-\n1\t2\t3\n4\t5\n6\t7\t8\t9\n'
+        results,units,comms = self.parse(vizier.tsv2recarray,text)
+        self.assertEqual(results['a'].tolist(), [1,4,6])
+        self.assertTrue(np.isnan(results['c'][1]))
+    
+    def testIPAC(self):
+        """ catalogs.gator.txt2recarray() """
+        text = '\\fixlen = T\n|  cntr|   flux| name|\n|   int| double| char|\n'\
+               '|      |    mJy|     |\n      1    12.5  abc  \n      2    null       \n'
+        results,units,comms = self.parse(gator.txt2recarray,text)
+        self.assertEqual(units['flux'], 'mJy')
+        self.assertEqual(list(results['cntr']), [1.,2.])
+        self.assertAlmostEqual(results['flux'][0], 12.5)
+        self.assertTrue(np.isnan(results['flux'][1]))
+        self.assertEqual(list(results['name']), ['abc','nan'])
+    
+    def testCSV(self):
+        """ catalogs.mast.csv2recarray() """
+        text = 'ra,name\nra,string\n10.5,abc\n,\n'
+        results,units,comms = self.parse(mast.csv2recarray,text)
+        self.assertAlmostEqual(results['ra'][0], 10.5)
+        self.assertTrue(np.isnan(results['ra'][1]))
+        self.assertEqual(list(results['name']), ['abc','nan'])
+
+class ConversionTestCase(unittest.TestCase):
+    
+    def testConvertPhotometry(self):
+        """ catalogs.vizier._convert_photometry() """
+        rows = [(10.,0.02,'mag','2MASS.J'),(11.,np.nan,'mag','2MASS.J'),
+                (0.3,0.01,'mag','GENEVA.U-B'),(9.,0.1,'mag','2MASS.H')]
+        master = np.rec.fromrecords(rows,dtype=[('meas','f8'),('e_meas','f8'),
+                                                ('unit','a30'),('photband','a30')])
+        master = vizier._convert_photometry(master,'erg/s/cm2/AA')
+        for i in [0,3]:
+            value,e_value = conversions.convert('mag','erg/s/cm2/AA',master['meas'][i],
+                                           master['e_meas'][i],photband=master['photband'][i])
+            self.assertAlmostEqual(master['cmeas'][i]/value, 1., places=12)
+            self.assertAlmostEqual(master['e_cmeas'][i]/e_value, 1., places=12)
+        self.assertTrue(np.isnan(master['e_meas'][1]) and np.isnan(master['e_cmeas'][1]))
+        self.assertEqual(list(master['cunit']), ['erg/s/cm2/AA','erg/s/cm2/AA','flux_ratio','erg/s/cm2/AA'])
+        self.assertEqual(master['cwave'][0], master['cwave'][1])
+        self.assertTrue(master['cwave'][0]<master['cwave'][3])
+    
+    def testConvertOutsideDomain(self):
+        """ units.conversions.convert() of arrays with invalid values """
+        with np.errstate(invalid='ignore'):
+            mag,e_mag = conversions.convert('erg/s/cm2/AA','mag',np.array([1e-10,-1e-10]),
+                                            np.array([1e-12,1e-12]),photband='GENEVA.V')
+        self.assertTrue(np.isfinite(mag[0]) and np.isfinite(e_mag[0]))
+        self.assertTrue(np.isnan(mag[1]) and np.isnan(e_mag[1]))
+    
+    def testConvertNoUnpack(self):
+        """ units.conversions.convert() of arrays to uncertainty objects """
+        values = conversions.convert('K','kK',np.array([5000.,6000.]),np.array([100.,200.]),unpack=False)
+        self.assertEqual(values.dtype, object)
+        self.assertEqual(list(unumpy.std_devs(values)), [0.1,0.2])
+
+class BulkSearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockServer(('127.0.0.1',0),MockHandler)
+        self.server.queries = []
+        self.server.options = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        host = '127.0.0.1:%d'%(self.server.server_address[1])
+        self.mirror = vizier.mirrors['current']
+        vizier.mirrors['current'] = host
+        self.get_URI = gator._get_URI
+        gator._get_URI = lambda name,**kwargs: 'http://%s/gator?catalog=%s'%(host,name)
+        self.ra = np.array([10.,20.,30.,40.,50.])
+        self.dec = np.array([10.,-20.,30.,40.,50.])
+
+    def tearDown(self):
+        vizier.mirrors['current'] = self.mirror
+        gator._get_URI = self.get_URI
+        http.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testVizierBulk(self):
+        """ catalogs.vizier.search_bulk() """
+        output = vizier.search_bulk('II/246/out',ra=self.ra,dec=self.dec,batchsize=2)
+        self.assertEqual(len(self.server.queries), 3)
+        self.assertEqual(self.server.options[0]['-source'], 'II/246/out')
+        self.assertEqual(self.server.options[0]['-out.add'], '_q')
+        self.assertEqual(len(output), 5)
+        self.assertEqual(output[1][0], None)
+        for i in [0,2,3,4]:
+            results,units,comms = output[i]
+            self.assertEqual(len(results), 2)
+            self.assertAlmostEqual(results['_RAJ2000'][0], self.ra[i])
+            self.assertEqual(results['_r'][0]<results['_r'][1], True)
+
+        masters = vizier.get_photometry_bulk(ra=self.ra,dec=self.dec,sources=['II/246/out'],
+                                             to_units=None,batchsize=2)
+        self.assertEqual(masters[1], None)
+        self.assertEqual(masters[2]['photband'][0], '2MASS.J')
+        self.assertAlmostEqual(masters[2]['meas'][0], 10.)
+        self.assertAlmostEqual(masters[3]['meas'][0], 11.)
+
+    def testGatorBulk(self):
+        """ catalogs.gator.search_bulk() """
+        output = gator.search_bulk('sage_full_m24',ra=self.ra,dec=self.dec,batchsize=3)
+        self.assertEqual(len(self.server.queries), 2)
+        self.assertEqual(output[1][0], None)
+        for i in [0,2,3,4]:
+            results,units,comms = output[i]
+            self.assertEqual(len(results), 2)
+            self.assertAlmostEqual(results['dist'][0], 0.1)
+            self.assertAlmostEqual(results['ra'][0], self.ra[i])
+        self.assertAlmostEqual(output[2][0]['flux24'][0], 12.)
+        self.assertAlmostEqual(output[3][0]['flux24'][0], 10.)
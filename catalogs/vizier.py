@@ -220,26 +220,149 @@ def search(name,filetype='tsv',filename=None,**kwargs):
     #-- gradually build URI
     base_url = _get_URI(name=name,**kwargs)
     
-    #-- prepare to open URI
-    url = urllib.URLopener()
-    filen,msg = url.retrieve(base_url,filename=filename)
+    #-- open URI (or take it from the query cache), without filename the
+    #   results go to a temporary file
+    filen = http.fetch(base_url,filename=filename or True)
     #   maybe we are just interest in the file, not immediately in the content
     if filename is not None:
         logger.info('Querying ViZieR source %s and downloading to %s'%(name,filen))
-        url.close()
         return filen
     
     #   otherwise, we read everything into a dictionary
-    if filetype=='tsv':
-        try:
-            results,units,comms = tsv2recarray(filen)
-        #-- raise an exception when multiple catalogs were specified
-        except ValueError:
-            raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(name)
-        url.close()
-        logger.info('Querying ViZieR source %s (%d)'%(name,(results is not None and len(results) or 0)))
-        return results,units,comms
+    try:
+        if filetype=='tsv':
+            try:
+                results,units,comms = tsv2recarray(filen)
+            #-- raise an exception when multiple catalogs were specified
+            except ValueError:
+                raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(name)
+            logger.info('Querying ViZieR source %s (%d)'%(name,(results is not None and len(results) or 0)))
+            return results,units,comms
+    finally:
+        os.unlink(filen)
+    
+
+def search_many(names,threads=8,**kwargs):
+    """
+    Search and retrieve information from several VizieR catalogs at once.
+    
+    The catalogs are queried concurrently (at most C{threads} at a time) via
+    L{ivs.io.http.fetch_all}, reusing connections to the mirror. Failed
+    queries are retried with exponential backoff.
+    
+    Extra kwargs are the same as for L{search} (see L{_get_URI}), but the
+    results are always read in as TSV.
+    
+    Example usage:
+    
+    >>> output = search_many(['II/169/main','I/239/hip_main'],ID='vega',radius=60.)
+    >>> results,units,comms = output[0]
+    
+    @param names: names of ViZieR catalogs (e.g. ['II/246/out','II/169/main'])
+    @type names: list of str
+    @param threads: maximum number of simultaneous queries
+    @type threads: int
+    @return: list of (catalog data columns, units, comments), one for each catalog
+    @rtype: list of (record array, dict, list of str)
+    """
+    kwargs['filetype'] = 'tsv'
+    urls = [_get_URI(name=name,**kwargs) for name in names]
+    filens = http.fetch_all(urls,threads=threads,filename=True)
     
+    output = []
+    try:
+        for name,filen in zip(names,filens):
+            try:
+                results,units,comms = tsv2recarray(filen)
+            #-- raise an exception when multiple catalogs were specified
+            except ValueError:
+                raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(name)
+            logger.info('Querying ViZieR source %s (%d)'%(name,(results is not None and len(results) or 0)))
+            output.append((results,units,comms))
+    finally:
+        for filen in filens:
+            os.unlink(filen)
+    return output
+
+def search_bulk(name,ra=None,dec=None,ID=None,batchsize=1000,threads=8,**kwargs):
+    """
+    Cone search in a VizieR catalog around many targets at once.
+    
+    Instead of one query per target, the targets are sent in batches of
+    C{batchsize} as a target list in a POST request. The batches are queried
+    concurrently (at most C{threads} at a time). The response is split back
+    per target via the C{_q} column (the number of the target in the list)
+    that VizieR adds to the output.
+    
+    Give either the coordinates (C{ra} and C{dec} in degrees) or the names of
+    the targets (C{ID}), which are first resolved with Sesame. Extra kwargs are
+    the same as for L{search} (see L{_get_URI}), e.g. the search C{radius}.
+    
+    Example usage:
+    
+    >>> output = search_bulk('II/169/main',ID=['vega','sirius'],radius=60.)
+    >>> results,units,comms = output[0]
+    
+    @param name: name of a ViZieR catalog (e.g. 'II/246/out')
+    @type name: str
+    @param ra: targets' right ascensions (degrees)
+    @type ra: array
+    @param dec: targets' declinations (degrees)
+    @type dec: array
+    @param ID: targets' names
+    @type ID: list of str
+    @param batchsize: maximum number of targets in one query
+    @type batchsize: int
+    @param threads: maximum number of simultaneous queries
+    @type threads: int
+    @return: list of (catalog data columns, units, comments), one for each
+    target (data columns are None if nothing was found)
+    @rtype: list of (record array, dict, list of str)
+    """
+    if ID is not None:
+        from ivs.catalogs import sesame
+        ra,dec = sesame.resolve(ID,threads=threads)
+    ra,dec = np.atleast_1d(np.asarray(ra,float)),np.atleast_1d(np.asarray(dec,float))
+    resolved = np.flatnonzero(~np.isnan(ra) & ~np.isnan(dec))
+    
+    #-- the catalog query options go url-encoded in the body of the POST
+    #   request, with the list of targets in the '-c' option
+    kwargs['filetype'] = 'tsv'
+    base_url,options = _get_URI(name=name,**kwargs).split('?',1)
+    options = [option.partition('=') for option in options.split('&') if option]
+    options = [(urllib.unquote(key),sep,urllib.unquote(value)) for key,sep,value in options]
+    options.append(('-out.add','=','_q'))
+    batches = [resolved[i:i+batchsize] for i in range(0,len(resolved),batchsize)]
+    queries = []
+    for batch in batches:
+        targets = ';'.join(['%.7f%+.7f'%(ra[i],dec[i]) for i in batch])
+        body = options + [('-c','=','<<;'+targets)]
+        body = '&'.join([urllib.quote_plus(key)+sep+urllib.quote_plus(value) for key,sep,value in body])
+        queries.append((base_url,body,None))
+    filens = http.fetch_all(queries,threads=threads,filename=True)
+    
+    output = [(None,{},[]) for i in range(len(ra))]
+    try:
+        for batch,filen in zip(batches,filens):
+            try:
+                results,units,comms = tsv2recarray(filen)
+            except ValueError:
+                raise ValueError, "failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(name)
+            if results is None:
+                continue
+            #-- split per target, keeping the order within every target
+            index = results['_q'].astype(int)-1
+            order = np.argsort(index,kind='mergesort')
+            edges = np.searchsorted(index[order],np.arange(len(batch)+1))
+            for j,i in enumerate(batch):
+                if edges[j]<edges[j+1]:
+                    output[i] = results[order[edges[j]:edges[j+1]]],units,comms
+    finally:
+        for filen in filens:
+            os.unlink(filen)
+    found = sum([results is not None for results,units,comms in output])
+    logger.info('Querying ViZieR source %s for %d targets (%d found)'%(name,len(ra),found))
+    return output
 
 def list_catalogs(ID,filename=None,filetype='tsv',**kwargs):
     """
@@ -538,47 +661,12 @@ def get_photometry(ID=None,extra_fields=['_r','_RAJ2000','_DEJ2000'],take_mean=F
     master_ = kwargs.get('master',None)
     master = None
     #-- retrieve all measurements
-    for source in sources:
-        results,units,comms = search(source,**kwargs)
+    for source,(results,units,comms) in zip(sources,search_many(sources,**kwargs)):
         if results is None: continue
         master = vizier2phot(source,results,units,master,extra_fields=extra_fields,take_mean=take_mean)
     #-- convert the measurement to a common unit.
     if to_units and master is not None:
-        #-- prepare columns to extend to basic master
-        dtypes = [('cwave','f8'),('cmeas','f8'),('e_cmeas','f8'),('cunit','a50')]
-        cols = [[],[],[],[]]
-        #-- forget about 'nan' errors for the moment
-        no_errors = np.isnan(master['e_meas'])
-        master['e_meas'][no_errors] = 0.
-        #-- extend basic master
-        zp = filters.get_info(master['photband'])
-        for i in range(len(master)):
-            to_units_ = to_units+''
-            try:
-                value,e_value = conversions.convert(master['unit'][i],to_units,master['meas'][i],master['e_meas'][i],photband=master['photband'][i])
-            except ValueError: # calibrations not available, or its a color
-                # if it is a magnitude color, try converting it to a flux ratio
-                if 'mag' in master['unit'][i]:
-                    try:
-                        value,e_value = conversions.convert('mag_color','flux_ratio',master['meas'][i],master['e_meas'][i],photband=master['photband'][i])
-                        to_units_ = 'flux_ratio'
-                    except ValueError:
-                        value,e_value = np.nan,np.nan
-                # else, we are powerless...
-                else:
-                    value,e_value = np.nan,np.nan
-            try:
-                eff_wave = filters.eff_wave(master['photband'][i])
-            except IOError:
-                eff_wave = np.nan
-            cols[0].append(eff_wave)
-            cols[1].append(value)
-            cols[2].append(e_value)
-            cols[3].append(to_units_)
-        master = numpy_ext.recarr_addcols(master,cols,dtypes)
-        #-- reset errors
-        master['e_meas'][no_errors] = np.nan
-        master['e_cmeas'][no_errors] = np.nan
+        master = _convert_photometry(master,to_units)
     
     if master_ is not None and master is not None:
         master = numpy_ext.recarr_addrows(master_,master.tolist())
@@ -589,6 +677,40 @@ def get_photometry(ID=None,extra_fields=['_r','_RAJ2000','_DEJ2000'],take_mean=F
     return master
 
 
+def get_photometry_bulk(ID=None,ra=None,dec=None,extra_fields=['_r','_RAJ2000','_DEJ2000'],take_mean=False,**kwargs):
+    """
+    Download all available photometry from many stars, one record array per
+    star.
+    
+    Every catalog is queried with L{search_bulk}, so that the number of
+    queries does not scale with the number of targets. Give either the
+    targets' coordinates (C{ra} and C{dec} in degrees) or their names (C{ID}).
+    
+    For extra kwargs, see L{search_bulk}, L{_get_URI} and L{vizier2phot}.
+    
+    >>> masters = get_photometry_bulk(ID=['vega','sirius'],radius=5.)
+    
+    @return: record arrays where eacht entry is a photometric measurement
+    (None if nothing was found), one for each target
+    @rtype: list of record arrays
+    """
+    to_units = kwargs.pop('to_units','erg/s/cm2/AA')
+    sources = kwargs.pop('sources',cat_info.sections())
+    if ID is not None:
+        from ivs.catalogs import sesame
+        ra,dec = sesame.resolve(ID,threads=kwargs.get('threads',8))
+    masters = [None for i in range(len(np.atleast_1d(ra)))]
+    #-- retrieve all measurements
+    for source in sources:
+        for i,(results,units,comms) in enumerate(search_bulk(source,ra=ra,dec=dec,**kwargs)):
+            if results is None: continue
+            masters[i] = vizier2phot(source,results,units,masters[i],extra_fields=extra_fields,take_mean=take_mean)
+    #-- convert the measurement to a common unit.
+    if to_units:
+        masters = [_convert_photometry(master,to_units) if master is not None else None for master in masters]
+    return masters
+
+
 def quality_check(master,ID=None,return_master=True,**kwargs):
     """
     Perform quality checks on downloaded data.
@@ -758,50 +880,40 @@ def tsv2recarray(filename):
     @return: catalog data columns, units, comments
     @rtype: record array, dict, list of str
     """
-    data,comms = ascii.read2array(filename,dtype=np.str,splitchar='\t',return_comments=True)
+    ff = open(filename,'r')
+    lines = ff.read().splitlines()
+    ff.close()
+    comms = [line[1:] for line in lines if line[:1]=='#']
+    data = [line for line in lines if line[:1]!='#' and line.strip()]
     results = None
     units = {}
     #-- retrieve the data and put it into a record array
     if len(data)>0:
-        #-- now convert this thing into a nice dictionary
-        data = np.array(data)
+        names = data[0].split('\t')
+        units = dict(zip(names,data[1].split('\t')))
         #-- retrieve the format of the columns. They are given in the
         #   Fortran format. In rare cases, columns contain multiple values
         #   themselves (so called vectors). In those cases, we interpret
         #   the contents as a long string
-        formats = np.zeros_like(data[0])
-        for line in comms:                  
+        fortran = {}
+        for line in comms:
             line = line.split('\t')
-            if len(line)<3: continue
-            for i,key in enumerate(data[0]):
-                if key == line[1] and line[0]=='Column': # this is the line with information
-                    formats[i] = line[2].replace('(','').replace(')','').lower()
-                    if formats[i][0].isdigit(): formats[i] = 'a100'
-                    elif 'f' in formats[i]: formats[i] = 'f8' # floating point
-                    elif 'i' in formats[i]: formats[i] = 'f8' # integer, but make it float to contain nans
-                    elif 'e' in formats[i]: formats[i] = 'f8' # exponential
-                    #-- see remark about the nans a few lines down
-                    if formats[i][0]=='a':
-                        formats[i] = 'a'+str(int(formats[i][1:])+3)
-        #-- define dtypes for record array
-        dtypes = np.dtype([(i,j) for i,j in zip(data[0],formats)])
-        #-- remove spaces or empty values
-        cols = []
-        for i,key in enumerate(data[0]):
-             col = data[3:,i]
-             #-- fill empty values with nan, and make sure each string in the
-             #   array is at least three spaces long (otherwise we cannot fit
-             #   'nan' in the row and the casting will not work properly in a
-             #   few lines
-             cols.append([(row.isspace() or not row) and np.nan or 3*' '+row for row in col])
-             #-- fix unit name
-             #if source in cat_info.sections() and cat_info.has_option(source,data[1,i]):
-             #   units[key] = cat_info.get(source,data[1,i])
-             #else:  
-             units[key] = data[1,i]
-        #-- define columns for record array and construct record array
-        cols = [np.cast[dtypes[i]](cols[i]) for i in range(len(cols))]
-        results = np.rec.array(cols, dtype=dtypes)
+            if len(line)>=3 and line[0]=='Column':
+                fortran[line[1]] = line[2].replace('(','').replace(')','').lower()
+        formats = []
+        for key in names:
+            fmt = fortran.get(key,'a100')
+            if fmt[0].isdigit(): fmt = 'a100'
+            elif 'f' in fmt: fmt = 'f8' # floating point
+            elif 'i' in fmt: fmt = 'f8' # integer, but make it float to contain nans
+            elif 'e' in fmt: fmt = 'f8' # exponential
+            formats.append(fmt)
+        #-- convert all columns at once, empty values become nan
+        if len(data)>3:
+            cells = ascii.lines2cells(data[3:],splitchar='\t')
+        else:
+            cells = np.zeros((0,len(names)),str)
+        results = ascii.cells2recarray(cells,names,formats)
     return results,units,comms
 
 def vizier2phot(source,results,units,master=None,e_flag='e_',q_flag='q_',extra_fields=None,take_mean=False):
@@ -1179,6 +1291,84 @@ def catalog2bibtex(catalog):
 
 #{ Internal helper functions
 
+def _convert_photometry(master,to_units,colors=True):
+    """
+    Convert the measurements in a master record to a common unit.
+    
+    Adds the columns C{cwave}, C{cmeas}, C{e_cmeas} and C{cunit}. If
+    C{colors=True}, magnitude colours are converted to flux ratios.
+    
+    Rows are grouped on their unit and photometric passband, so that every
+    conversion is resolved only once and applied to all measurements of the
+    group at the same time. If the conversion fails for a group, its rows are
+    converted one by one, which sets the failing measurements to C{nan}.
+    
+    @param master: master record of photometry
+    @type master: numpy record array
+    @param to_units: units to convert everything to
+    @type to_units: str
+    @param colors: convert magnitude colours to flux ratios
+    @type colors: bool
+    @return: master record of photometry with converted measurements
+    @rtype: numpy record array
+    """
+    #-- prepare columns to extend to basic master
+    dtypes = [('cwave','f8'),('cmeas','f8'),('e_cmeas','f8'),('cunit','a50')]
+    cwave = np.zeros(len(master))
+    cmeas = np.zeros(len(master))
+    e_cmeas = np.zeros(len(master))
+    cunit = np.zeros(len(master),'a50')
+    #-- forget about 'nan' errors for the moment
+    no_errors = np.isnan(master['e_meas'])
+    master['e_meas'][no_errors] = 0.
+    #-- group the rows on unit and passband
+    groups = {}
+    for i,key in enumerate(zip(master['unit'],master['photband'])):
+        groups.setdefault(key,[]).append(i)
+    #-- extend basic master
+    for (unit,photband),rows in groups.items():
+        rows = np.array(rows)
+        try:
+            cmeas[rows],e_cmeas[rows],cunit[rows] = _convert_measurements(unit,to_units,
+                        master['meas'][rows],master['e_meas'][rows],photband,colors=colors)
+        except (ValueError,AssertionError):
+            for i in rows:
+                try:
+                    cmeas[i],e_cmeas[i],cunit[i] = _convert_measurements(unit,to_units,
+                                 master['meas'][i],master['e_meas'][i],photband,colors=colors)
+                except (ValueError,AssertionError):
+                    cmeas[i],e_cmeas[i],cunit[i] = np.nan,np.nan,to_units
+    for photband in set(master['photband']):
+        try:
+            eff_wave = filters.eff_wave(photband)
+        except IOError:
+            eff_wave = np.nan
+        cwave[master['photband']==photband] = eff_wave
+    master = numpy_ext.recarr_addcols(master,[cwave,cmeas,e_cmeas,cunit],dtypes)
+    #-- reset errors
+    master['e_meas'][no_errors] = np.nan
+    master['e_cmeas'][no_errors] = np.nan
+    return master
+
+def _convert_measurements(unit,to_units,meas,e_meas,photband,colors=True):
+    """
+    Convert measurements in one unit and passband to C{to_units}.
+    
+    If the calibration is not available and C{colors=True}, magnitudes are
+    interpreted as colours and converted to flux ratios.
+    
+    @return: converted measurements, errors and the converted unit
+    @rtype: array/float, array/float, str
+    """
+    try:
+        value,e_value = conversions.convert(unit,to_units,meas,e_meas,photband=photband)
+        return value,e_value,to_units
+    except ValueError: # calibrations not available, or its a color
+        if not colors or not 'mag' in unit:
+            raise
+        value,e_value = conversions.convert('mag_color','flux_ratio',meas,e_meas,photband=photband)
+        return value,e_value,'flux_ratio'
+
 def _get_URI(name=None,ID=None,ra=None,dec=None,radius=20.,
                      oc='deg',oc_eq='J2000',
                      out_all=True,out_max=1000000,
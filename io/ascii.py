@@ -86,6 +86,72 @@ def read2list(filename,**kwargs):
     #-- and return the contents
     return data,comm
 
+def read2chunks(filename,chunksize=100000,**kwargs):
+    """
+    Load an ASCII file in blocks of rows.
+    
+    This is a generator: every block of (at most) C{chunksize} data rows is
+    converted to a numpy array at once, so that the whole file never has to be
+    held in memory as Python strings. Comment, skip and fixed-width semantics
+    are the same as in L{read2list}, and gzipped files are also accepted::
+    
+        for block in read2chunks(myfile,chunksize=1000):
+            process(block)
+    
+    @param filename: name of file with the data
+    @type filename: string
+    @param chunksize: maximum number of rows per block
+    @type chunksize: int
+    @keyword dtype: type of numpy array (default: float)
+    @type dtype: numpy dtype
+    @keyword comments: list to which the comment lines are appended while
+    reading
+    @type comments: list
+    @return: generator of data arrays (rows x columns)
+    @rtype: generator
+    """
+    commentchar = kwargs.get('commentchar',['#'])
+    splitchar = kwargs.get('splitchar',None)
+    skip_empty = kwargs.get('skip_empty',True)
+    skip_lines = kwargs.get('skip_lines',0)
+    dtype = kwargs.get('dtype',np.float)
+    comm = kwargs.get('comments',[])
+    
+    if os.path.splitext(filename)[1] == '.gz':
+        ff = gzip.open(filename)
+    else:
+        ff = open(filename)
+    
+    try:
+        lines = []
+        for line_nr,line in enumerate(ff):
+            if line_nr<skip_lines:
+                continue
+            
+            #-- strip return character from line
+            if skip_empty and line.isspace():
+                continue # empty line
+            
+            #-- remove return characters
+            line = line.replace('\n','')
+            #-- when reading a comment line
+            if line[0] in commentchar:
+                comm.append(line[1:])
+                continue # treat next line
+            
+            #-- convert a block of data lines at once
+            lines.append(line)
+            if len(lines)==chunksize:
+                yield _lines2array(lines,splitchar,dtype)
+                lines = []
+        if lines:
+            yield _lines2array(lines,splitchar,dtype)
+    finally:
+        ff.close()
+    
+    #-- report that the file has been read
+    logger.debug('Data file %s read'%(filename))
+
 def read2array(filename,**kwargs):
     """
     Load ASCII file to a numpy array.
@@ -96,19 +162,49 @@ def read2array(filename,**kwargs):
     
     C{>>> col1,col2,col3 = ascii.read2array(myfile).T}
     
+    The file is read in blocks (see L{read2chunks}) that are copied into one
+    preallocated array.
+    
     @param filename: name of file with the data
     @type filename: string
     @keyword dtype: type of numpy array (default: float)
     @type dtype: numpy dtype
     @keyword return_comments: flag to return comments (default: False)
     @type return_comments: bool
+    @keyword chunksize: number of rows that are converted at once
+    @type chunksize: int
     @return: data array (, list of comments)
     @rtype: ndarray (, list)
     """
     dtype = kwargs.get('dtype',np.float)
-    return_comments = kwargs.get('return_comments',False)
-    data,comm = read2list(filename,**kwargs)
-    data = np.array(data,dtype=dtype)
+    return_comments = kwargs.pop('return_comments',False)
+    chunksize = kwargs.pop('chunksize',100000)
+    comm = kwargs['comments'] = []
+    
+    data = None
+    nrows = 0
+    for chunk in read2chunks(filename,chunksize=chunksize,**kwargs):
+        #-- grow the buffer by doubling its size when it is full, and only
+        #   reallocate otherwise when a chunk needs a wider type (e.g. longer
+        #   strings)
+        if data is None:
+            data = np.empty((chunksize,)+chunk.shape[1:],chunk.dtype)
+        else:
+            dtype_ = np.promote_types(data.dtype,chunk.dtype)
+            size = len(data)
+            if nrows+len(chunk)>size:
+                size = max(2*size,nrows+len(chunk))
+            if size>len(data) or dtype_!=data.dtype:
+                data_ = np.empty((size,)+data.shape[1:],dtype_)
+                data_[:nrows] = data[:nrows]
+                data = data_
+        data[nrows:nrows+len(chunk)] = chunk
+        nrows += len(chunk)
+    
+    if data is None:
+        data = np.array([],dtype=dtype)
+    else:
+        data.resize((nrows,)+data.shape[1:],refcheck=False)
     return return_comments and (data,comm) or data
 
 def read2recarray(filename,**kwargs):
@@ -137,32 +233,33 @@ def read2recarray(filename,**kwargs):
     return_comments = kwargs.get('return_comments',False)
     splitchar = kwargs.get('splitchar',None)
     
-    #-- first read in as a normal array
-    data,comm = read2list(filename,**kwargs)
+    #-- first read in as a string array, with the columns as rows
+    kwargs.update(dict(dtype=str,return_comments=True))
+    data,comm = read2array(filename,**kwargs)
+    data = data.T
     
+    #-- if splitchar is a list, it is a list of fixed width formats that
+    #   define the dtypes (unless they are given explicitly)
+    if dtype is None and isinstance(splitchar,list):
+        types,lengths = fws2info(splitchar)
+        dtype = []
+        names = range(300)
+        for i,fmt in enumerate(types):
+            if fmt.__name__=='str':
+                dtype.append((str(names[i]),(fmt,lengths[i+1]-lengths[i])))
+            else:
+                dtype.append((str(names[i]),fmt))
+        dtype = np.dtype(dtype)
     #-- if dtypes is None, we have some room to automatically detect the contents
     #   of the columns. This is not fully implemented yet, and works only
     #   if the second-to-last and last columns of the comments denote the
     #   name and dtype, respectively
-    if dtype is None:
-        data = np.array(data,dtype=str).T
+    elif dtype is None:
         header = comm[-2].replace('|',' ').split()
         types = comm[-1].replace('|','').split()
         dtype = [(head,typ) for head,typ in zip(header,types)]
         dtype = np.dtype(dtype)
     elif isinstance(dtype,list):
-        data = np.array(data,dtype=str).T
-        dtype = np.dtype(dtype)
-    #-- if dtype is a list, assume it is a list of fixed width stuff.
-    elif isinstance(splitchar,list):
-        types,lengths = fws2info(splitchar)
-        dtype = []
-        names = range(300)
-        for i,(fmt,lng) in enumerate(zip(types,lengths)):
-            if fmt.__name__=='str':
-                dtype.append((str(names[i]),(fmt,lng)))
-            else:
-                dtype.append((str(names[i]),fmt))
         dtype = np.dtype(dtype)
     
     #-- cast all columns to the specified type
@@ -335,6 +432,133 @@ def fw2python(line,fixwidths,missing_value=0):
         else:
             processed_line.append(itype(line[length[i]:length[i+1]]))
     return processed_line
+
+def _lines2array(lines,splitchar=None,dtype=np.float):
+    """
+    Convert a block of data lines to a 2D array.
+    
+    All cells are split in one go. Fixed width lines (C{splitchar} is a list of
+    Fortran formats) are cut from a character buffer, and empty fields become
+    zero (see L{fw2python}).
+    
+    @param lines: data lines (without newline characters)
+    @type lines: list of str
+    @param splitchar: character seperating entries, or fixed width formats
+    @type splitchar: str, None or list
+    @param dtype: type of the array
+    @type dtype: numpy dtype
+    @return: data (rows x columns)
+    @rtype: 2D array
+    """
+    if isinstance(splitchar,list):
+        types,lengths = fws2info(splitchar)
+        width = max(lengths[-1],max([len(line) for line in lines]))
+        buf = np.array(lines,dtype='S%d'%(width)).view('S1').reshape(len(lines),width)
+        cols = []
+        for itype,start,end in zip(types,lengths[:-1],lengths[1:]):
+            col = np.ascontiguousarray(buf[:,start:end]).view('S%d'%(end-start)).ravel()
+            if itype is str:
+                col[np.char.isspace(col)] = '0'
+            else:
+                col = np.char.strip(col)
+                col[col==''] = '0'
+            cols.append(col)
+        return np.column_stack(cols).astype(dtype)
+    ncols = len(lines[0].split(splitchar))
+    if splitchar is None:
+        #-- mark the end of every line with a NULL cell, and check that they
+        #   all end up after the same number of columns
+        cells = ' \x00 '.join(lines).split()
+        regular = len(cells)==(ncols+1)*len(lines)-1 and \
+                  cells[ncols::ncols+1].count('\x00')==len(lines)-1
+        del cells[ncols::ncols+1]
+    else:
+        regular = all([line.count(splitchar)==ncols-1 for line in lines])
+        if regular:
+            cells = splitchar.join(lines).split(splitchar)
+    #-- rows with a deviating number of columns are left to numpy to complain
+    if not regular:
+        return np.array([line.split(splitchar) for line in lines],dtype=dtype)
+    return np.array(cells,dtype=dtype).reshape(len(lines),ncols)
+
+def lines2cells(lines,splitchar='\t',positions=None):
+    """
+    Split a list of data lines into a 2D string array of cells.
+    
+    Character separated lines are joined and split in one go, fixed width
+    lines (C{positions} gives the column boundaries) are cut from a
+    character buffer. Cells are stripped from surrounding whitespace.
+    
+    >>> lines2cells(['a,1.5','b,'],splitchar=',').tolist()
+    [['a', '1.5'], ['b', '']]
+    >>> lines2cells(['|a | 1.5|','|bc|    |'],positions=[0,3,8]).tolist()
+    [['a', '1.5'], ['bc', '']]
+    
+    @param lines: data lines (without newline characters)
+    @type lines: list of str
+    @param splitchar: character seperating the cells
+    @type splitchar: str
+    @param positions: column boundaries of fixed width lines
+    @type positions: list of int
+    @return: cells (rows x columns)
+    @rtype: 2D string array
+    """
+    if positions is not None:
+        width = max(positions[-1],max([len(line) for line in lines]))
+        buf = np.array(lines,dtype='S%d'%(width)).view('S1').reshape(len(lines),width)
+        cols = [np.ascontiguousarray(buf[:,start+1:end]).view('S%d'%(end-start-1)).ravel()\
+                         for start,end in zip(positions[:-1],positions[1:])]
+        cells = np.column_stack(cols)
+    else:
+        ncols = lines[0].count(splitchar)+1
+        #-- rows with a deviating number of cells need to be split one by one
+        if all([line.count(splitchar)==ncols-1 for line in lines]):
+            cells = splitchar.join(lines).split(splitchar)
+        else:
+            cells = [(line.split(splitchar)+ncols*[''])[:ncols] for line in lines]
+        cells = np.array(cells,dtype=str).reshape(len(lines),ncols)
+    return np.char.strip(cells)
+
+def cells2recarray(cells,names,formats,null_values=('','null')):
+    """
+    Convert a 2D string array of cells to a record array.
+    
+    Every column is converted at once. Null values become C{nan} in float
+    columns and the string C{'nan'} in string columns.
+    
+    >>> cells = np.array([['a','1.5'],['b','']])
+    >>> rec = cells2recarray(cells,['name','x'],['a1','f8'])
+    >>> rec['name'].tolist(),rec['x'].tolist()
+    (['a', 'b'], [1.5, nan])
+    
+    @param cells: cells (rows x columns)
+    @type cells: 2D string array
+    @param names: column names
+    @type names: list of str
+    @param formats: numpy dtype of each column
+    @type formats: list of str
+    @param null_values: cell contents that denote missing values
+    @type null_values: tuple of str
+    @return: data
+    @rtype: record array
+    """
+    cols = []
+    dtypes = []
+    for i,(name,fmt) in enumerate(zip(names,formats)):
+        col = cells[:,i]
+        missing = np.in1d(col,null_values)
+        if np.dtype(fmt).kind=='S':
+            fmt = 'a%d'%(max(np.dtype(fmt).itemsize,3))
+            col = col.astype(fmt)
+            col[missing] = 'nan'
+        else:
+            col_ = np.empty(len(col),fmt)
+            col_[missing] = np.nan
+            col_[~missing] = col[~missing].astype(fmt)
+            col = col_
+        cols.append(col)
+        dtypes.append((name,fmt))
+    return np.rec.fromarrays(cols,dtype=dtypes)
 #}
 
 #{ Source specific
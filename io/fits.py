@@ -246,29 +246,80 @@ def read_iue(filename,return_header=False):
 
 #{ Generic reading
 
-def read2recarray(fits_file,ext=1,return_header=False):
+def read2recarray(fits_file,ext=1,return_header=False,columns=None,rows=None,copy=False):
     """
     Read the contents of a FITS file to a record array.
     
-    Should add a test that the strings were not chopped of...
+    The table is memory mapped. When all requested columns can be used as they
+    are stored on disk (i.e. no scaled, logical, bit or variable length
+    columns), the returned array is a view on the file: nothing is read until
+    the values are used. The dtype is then the big-endian dtype of the file,
+    and string columns keep their width. Otherwise (or when C{copy=True}),
+    only the requested columns and rows are read into a new array with native
+    byte order.
+    
+    Rows can be selected with a slice, an index array, a boolean array or a
+    function that takes the (lazy) table and returns one of those, e.g.
+    
+    >>> data = read2recarray('track.fits',columns=['star_age','log_L'],
+    ...                      rows=lambda x: x['star_age']>1e6) # doctest: +SKIP
+    
+    Only a slice keeps the result a view on the file.
+    
+    @param fits_file: name of the file or opened FITS file
+    @type fits_file: str or HDUList
+    @param ext: extension to read
+    @type ext: int or str
+    @param return_header: return the header of the extension
+    @type return_header: bool
+    @param columns: names of the columns to read (default: all)
+    @type columns: list of str
+    @param rows: rows to read (default: all)
+    @type rows: slice, array or callable
+    @param copy: always read the data into memory
+    @type copy: bool
+    @return: data (, header)
+    @rtype: recarray (, dict)
     """
-    dtype_translator = dict(L=np.bool,D=np.float64,E=np.float32,J=np.int)
     if isinstance(fits_file,str):
-        ff = pyfits.open(fits_file)
+        ff = pyfits.open(fits_file,memmap=True)
     elif isinstance(fits_file,pyfits.HDUList):
         ff = fits_file
     data = ff[ext].data
-    names = ff[ext].columns.names
-    formats = ff[ext].columns.formats
-    dtypes = []
-    for name,dtype in zip(names,formats):
-        if 'A' in dtype:
-            dtypes.append((name,'S60'))
-        else:
-            dtypes.append((name,dtype_translator[dtype]))
-    dtypes = np.dtype(dtypes)
-    data = [np.cast[dtypes[i]](data.field(name)) for i,name in enumerate(names)]
-    data = np.rec.array(data,dtype=dtypes)
+    if columns is None:
+        columns = ff[ext].columns.names
+    #-- a row filter only converts the columns it uses
+    if callable(rows):
+        rows = rows(data)
+    #-- check if the columns can be used as they are stored in the file
+    raw = isinstance(ff[ext],pyfits.BinTableHDU) and not copy\
+          and (rows is None or isinstance(rows,slice))
+    for name in columns:
+        column = ff[ext].columns[name]
+        code = str(column.format).lstrip('0123456789')[:1]
+        if code in 'LXPQ' or column.bscale not in (None,1) or column.bzero not in (None,0):
+            raw = False
+    if raw:
+        #-- view on the selected columns, with the offsets of the file records
+        records = data.view(np.ndarray)
+        fields = [records.dtype.fields[name] for name in columns]
+        dtypes = np.dtype(dict(names=list(columns),formats=[field[0] for field in fields],
+                               offsets=[field[1] for field in fields],
+                               itemsize=records.dtype.itemsize))
+        data = records.view(dtypes)
+        if rows is not None:
+            data = data[rows]
+        data = data.view(np.recarray)
+    else:
+        #-- only the selected rows of the requested columns are copied
+        if rows is None:
+            rows = slice(None)
+        arrays,dtypes = [],[]
+        for name in columns:
+            array = np.asarray(data.field(name)[rows])
+            arrays.append(array.astype(array.dtype.newbyteorder('=')))
+            dtypes.append((name,arrays[-1].dtype,array.shape[1:]))
+        data = np.rec.fromarrays(arrays,dtype=dtypes)
     header = {}
     for key in ff[ext].header.keys():
         if 'TTYPE' in key: continue
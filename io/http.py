@@ -1,9 +1,51 @@
 """
 Read or download files from the internet.
+
+Besides the simple L{download} function, this module provides a small query
+layer for retrieving many URLs at once: L{fetch_all} spreads the queries over
+a bounded number of threads, reuses keep-alive connections per host via a
+L{ConnectionPool}, and retries failed queries with exponential backoff.
+
+Responses can be stored in a persistent L{QueryCache}, so that repeated
+queries (e.g. re-running an SED pipeline on the same targets) do not hit the
+network again. The cache is switched off by default, use L{enable_cache} to
+switch it on::
+
+    >>> cache = enable_cache(ttl=7*86400.)
+    >>> print(cache.stats())
+
+Example usage:
+
+    >>> urls = ['http://vizier.u-strasbg.fr/viz-bin/asu-tsv/VizieR?-source=I/239/hip_main&-c=vega',
+    ...         'http://vizier.u-strasbg.fr/viz-bin/asu-tsv/VizieR?-source=II/169/main&-c=vega']
+    >>> contents = fetch_all(urls,threads=2)
 """
+import os
+import time
+import socket
+import hashlib
+import sqlite3
+import logging
+import httplib
 import urllib
+import urlparse
+import tempfile
+import threading
+import Queue
+from multiprocessing.pool import ThreadPool
 from ivs.aux import decorators
 
+logger = logging.getLogger("IO.HTTP")
+
+class HTTPClientError(IOError):
+    """
+    The server refused the query (4xx status), retrying will not help.
+    """
+    pass
+
+#-- exceptions on which a query is retried
+RETRY_EXCEPTIONS = (IOError,socket.error,httplib.HTTPException)
+
 #@decorators.retry_http(3)
 def download(link,filename=None):
     """
@@ -29,4 +71,444 @@ def download(link,filename=None):
         url.close()
         return myfile
     else:
-        return myfile,url
\ No newline at end of file
+        return myfile,url
+
+#{ Concurrent queries
+
+class ConnectionPool(object):
+    """
+    Keep-alive HTTP connections, pooled per host.
+    
+    Connections are handed out to one thread at a time and put back after the
+    response is read, so that subsequent queries to the same host skip the
+    connection setup. At most C{maxsize} idle connections are kept per host.
+    """
+    def __init__(self, maxsize=8, timeout=None):
+        """
+        @param maxsize: maximum number of idle connections kept per host
+        @type maxsize: int
+        @param timeout: socket timeout (s), defaults to the global socket timeout
+        @type timeout: float
+        """
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+    
+    def _queue(self, key):
+        with self._lock:
+            if not key in self._idle:
+                self._idle[key] = Queue.LifoQueue(self.maxsize)
+            return self._idle[key]
+    
+    def _connect(self, scheme, host):
+        try:
+            return self._queue((scheme,host)).get_nowait()
+        except Queue.Empty:
+            timeout = self.timeout if self.timeout is not None else socket.getdefaulttimeout()
+            if scheme=='https':
+                return httplib.HTTPSConnection(host,timeout=timeout)
+            return httplib.HTTPConnection(host,timeout=timeout)
+    
+    def _release(self, scheme, host, connection):
+        try:
+            self._queue((scheme,host)).put_nowait(connection)
+        except Queue.Full:
+            connection.close()
+    
+    def request(self, url, data=None, headers=None):
+        """
+        Retrieve the contents of a URL with a GET request, or with a POST
+        request if C{data} is given.
+        
+        @param url: the url to retrieve
+        @type url: str
+        @param data: body of a POST request
+        @type data: str
+        @param headers: extra request headers
+        @type headers: dict
+        @return: contents of the response
+        @rtype: str
+        @raise HTTPClientError: when the server responds with a 4xx status
+        @raise IOError: when the server responds with another error status
+        """
+        parts = urlparse.urlsplit(url)
+        scheme,host = parts.scheme,parts.netloc
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        
+        #-- plain http requests go through a proxy if one is configured
+        proxy = urllib.getproxies().get(scheme)
+        if proxy and scheme=='http' and not urllib.proxy_bypass(parts.hostname):
+            scheme,host,path = 'http',urlparse.urlsplit(proxy).netloc,url
+        
+        connection = self._connect(scheme,host)
+        try:
+            if data is None:
+                connection.request('GET',path,headers=headers or {})
+            else:
+                headers_ = {'Content-Type':'application/x-www-form-urlencoded'}
+                headers_.update(headers or {})
+                connection.request('POST',path,data,headers_)
+            response = connection.getresponse()
+            contents = response.read()
+        except:
+            #-- never put a broken connection back into the pool
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(scheme,host,connection)
+        
+        if 400<=response.status<500:
+            raise HTTPClientError('HTTP error %d (%s) for %s'%(response.status,response.reason,url))
+        elif response.status>=500:
+            raise IOError('HTTP error %d (%s) for %s'%(response.status,response.reason,url))
+        return contents
+    
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            queues, self._idle = self._idle.values(), {}
+        for queue in queues:
+            while not queue.empty():
+                queue.get_nowait().close()
+
+class QueryCache(object):
+    """
+    Persistent cache of query responses, stored in an SQLite database.
+    
+    Responses are keyed by their normalized URL (see L{normalize_url}).
+    Entries older than C{ttl} seconds are expired, and when the cache grows
+    beyond C{max_size} bytes, the least recently used entries are evicted.
+    In C{offline} mode, queries that are not in the cache raise an IOError
+    instead of going to the network, and expired entries are still served
+    (and kept) as stale responses.
+    
+    The number of hits, misses, expired entries, stale responses and
+    evictions are counted, and can be retrieved via L{stats}.
+    """
+    def __init__(self, filename, ttl=30*86400., max_size=512*2**20, offline=False):
+        """
+        @param filename: name of the SQLite database file
+        @type filename: str
+        @param ttl: time-to-live of the entries (s), None for no expiry
+        @type ttl: float
+        @param max_size: maximum total size of the cached responses (bytes)
+        @type max_size: int
+        @param offline: never touch the network
+        @type offline: bool
+        """
+        self.filename = filename
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.hits, self.misses, self.expired, self.stale, self.evictions = 0, 0, 0, 0, 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename,timeout=60.,check_same_thread=False)
+        self._db.text_factory = str
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, '
+                             'created REAL, accessed REAL, size INTEGER, contents BLOB)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS accessed ON responses (accessed)')
+    
+    def get(self, url, data=None):
+        """
+        Retrieve a response from the cache.
+        
+        @param url: the url of the query
+        @type url: str
+        @param data: body of a POST query
+        @type data: str
+        @return: contents of the response, or None if not cached (or expired,
+        unless in offline mode)
+        @rtype: str
+        """
+        key = self.key(url,data)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT created, contents FROM responses WHERE key=?',(key,)).fetchone()
+            if row is not None and self.ttl is not None and now-row[0]>self.ttl and self.offline:
+                #-- an old response is better than none at all
+                self.stale += 1
+                return str(row[1])
+            elif row is not None and self.ttl is not None and now-row[0]>self.ttl:
+                with self._db:
+                    self._db.execute('DELETE FROM responses WHERE key=?',(key,))
+                self.expired += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            with self._db:
+                self._db.execute('UPDATE responses SET accessed=? WHERE key=?',(now,key))
+            self.hits += 1
+        return str(row[1])
+    
+    def put(self, url, contents, data=None):
+        """
+        Store a response in the cache, and evict old entries if needed.
+        
+        @param url: the url of the query
+        @type url: str
+        @param contents: contents of the response
+        @type contents: str
+        @param data: body of a POST query
+        @type data: str
+        """
+        key = self.key(url,data)
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?)',
+                                 (key,now,now,len(contents),sqlite3.Binary(contents)))
+                size = self._db.execute('SELECT SUM(size) FROM responses').fetchone()[0]
+                #-- evict the least recently used entries
+                for key_,size_ in self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+                    if size<=self.max_size: break
+                    self._db.execute('DELETE FROM responses WHERE key=?',(key_,))
+                    size -= size_
+                    self.evictions += 1
+    
+    @staticmethod
+    def key(url, data=None):
+        """
+        Key of a query: the normalized URL, with a hash of the body of POST
+        queries.
+        """
+        key = normalize_url(url)
+        if data is not None:
+            key += '#' + hashlib.sha1(data).hexdigest()
+        return key
+    
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM responses')
+    
+    def stats(self):
+        """
+        Report on the use of the cache.
+        
+        @return: number of hits, misses, expired entries, stale responses and
+        evictions, and the number of entries and total size (bytes) of the cache
+        @rtype: dict
+        """
+        with self._lock:
+            entries,size = self._db.execute('SELECT COUNT(*), SUM(size) FROM responses').fetchone()
+        return dict(hits=self.hits,misses=self.misses,expired=self.expired,
+                    stale=self.stale,evictions=self.evictions,entries=entries,size=size or 0)
+    
+    def close(self):
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._db.close()
+
+def normalize_url(url):
+    """
+    Normalize a URL, such that equivalent queries give the same key.
+    
+    The scheme and host are lower case, and the query parameters are sorted.
+    
+    >>> normalize_url('HTTP://Vizier.U-Strasbg.fr/viz-bin/asu-tsv?-source=I/239&-c=vega')
+    'http://vizier.u-strasbg.fr/viz-bin/asu-tsv?-c=vega&-source=I%2F239'
+    
+    @param url: url
+    @type url: str
+    @return: normalized url
+    @rtype: str
+    """
+    parts = urlparse.urlsplit(url)
+    query = urllib.urlencode(sorted(urlparse.parse_qsl(parts.query,keep_blank_values=True)))
+    return urlparse.urlunsplit((parts.scheme.lower(),parts.netloc.lower(),parts.path or '/',query,''))
+
+def enable_cache(filename=None, **kwargs):
+    """
+    Switch on the persistent query cache.
+    
+    Extra keyword arguments are passed to L{QueryCache}.
+    
+    @param filename: name of the SQLite database file (defaults to
+    C{~/.ivs_query_cache.sqlite})
+    @type filename: str
+    @return: the query cache
+    @rtype: QueryCache
+    """
+    global cache
+    if filename is None:
+        filename = os.path.join(os.path.expanduser('~'),'.ivs_query_cache.sqlite')
+    disable_cache()
+    cache = QueryCache(filename,**kwargs)
+    logger.info('Query cache enabled (%s)'%(filename))
+    return cache
+
+def encode_multipart(fields, files):
+    """
+    Encode form fields and files as multipart/form-data, for uploading files
+    in a POST request.
+    
+    The boundary is derived from the contents, so that identical uploads give
+    identical requests (and can be cached).
+    
+    @param fields: form fields (name, value)
+    @type fields: list of tuples
+    @param files: files (name, filename, contents)
+    @type files: list of tuples
+    @return: body, headers
+    @rtype: str, dict
+    """
+    parts = []
+    for name,value in fields:
+        parts.append('Content-Disposition: form-data; name="%s"\r\n\r\n%s'%(name,value))
+    for name,filename,contents in files:
+        parts.append('Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                     'Content-Type: text/plain\r\n\r\n%s'%(name,filename,contents))
+    boundary = 'ivs' + hashlib.sha1(''.join(parts)).hexdigest()
+    body = ''.join(['--%s\r\n%s\r\n'%(boundary,part) for part in parts]) + '--%s--\r\n'%(boundary)
+    headers = {'Content-Type':'multipart/form-data; boundary=%s'%(boundary)}
+    return body, headers
+
+def disable_cache():
+    """
+    Switch off the persistent query cache.
+    """
+    global cache
+    if cache is not None:
+        logger.info('Query cache disabled: %s'%(cache.stats()))
+        cache.close()
+    cache = None
+
+#-- connections are shared between consecutive calls, the cache is off by default
+pool = ConnectionPool()
+cache = None
+
+def fetch(url, filename=None, tries=3, delay=1., backoff=2., connections=None,
+          use_cache=True, data=None, headers=None):
+    """
+    Retrieve a URL, retrying with exponential backoff on failure.
+    
+    The query is a GET request, unless C{data} is given: then it is sent as
+    the body of a POST request (see also L{encode_multipart}).
+    
+    If C{filename} is given, the contents are written to that file and the
+    filename is returned. If C{filename} is C{True}, they are written to a
+    temporary file, which the caller should remove.
+    
+    When the query cache is enabled (see L{enable_cache}), the response is
+    taken from the cache if possible, and stored in it otherwise.
+    
+    Server errors (5xx) and network errors are retried, but a refused query
+    (4xx) raises an L{HTTPClientError} immediately.
+    
+    @param url: the url to retrieve
+    @type url: str
+    @param filename: name of the file to write the contents to (optional)
+    @type filename: str or bool
+    @param tries: number of retries after the first attempt
+    @type tries: int
+    @param delay: initial delay between attempts (s)
+    @type delay: float
+    @param backoff: factor to lengthen the delay with after each failure
+    @type backoff: float
+    @param connections: connection pool (defaults to the module's pool)
+    @type connections: ConnectionPool
+    @param use_cache: use the query cache if it is enabled
+    @type use_cache: bool
+    @param data: body of a POST request
+    @type data: str
+    @param headers: extra request headers
+    @type headers: dict
+    @return: contents or filename
+    @rtype: str
+    """
+    if connections is None:
+        connections = pool
+    cache_ = cache if use_cache else None
+    
+    contents = None
+    if cache_ is not None:
+        contents = cache_.get(url,data)
+    if contents is None and cache_ is not None and cache_.offline:
+        raise IOError('Query not in cache (offline mode): %s'%(url))
+    elif contents is None:
+        request = decorators.retry_backoff(tries,delay=delay,backoff=backoff,
+                                           exceptions=RETRY_EXCEPTIONS,
+                                           reraise=(HTTPClientError,))(connections.request)
+        contents = request(url,data,headers)
+        if cache_ is not None:
+            cache_.put(url,contents,data)
+    
+    if filename is None:
+        return contents
+    if filename is True:
+        fd,filename = tempfile.mkstemp()
+        os.close(fd)
+    with open(filename,'wb') as ff:
+        ff.write(contents)
+    return filename
+
+def fetch_all(urls, threads=8, on_failure='error', **kwargs):
+    """
+    Retrieve many URLs concurrently.
+    
+    At most C{threads} queries are running at the same time. The results are
+    returned in the same order as C{urls}. When a query still fails after all
+    retries, the first error is raised after all other queries finished
+    (C{on_failure='error'}), or the result is C{None} (C{on_failure='continue'}).
+    
+    Each query is either a url, or a tuple (url, data, headers) for a POST
+    request (see L{fetch}).
+    
+    Extra keyword arguments are passed to L{fetch}. Note that a C{filename}
+    other than C{True} does not make sense here.
+    
+    @param urls: urls to retrieve
+    @type urls: list of str or tuples
+    @param threads: maximum number of simultaneous queries
+    @type threads: int
+    @param on_failure: 'error' or 'continue'
+    @type on_failure: str
+    @return: contents or filenames
+    @rtype: list
+    """
+    urls = list(urls)
+    if not urls:
+        return []
+    
+    def worker(url):
+        kwargs_ = kwargs
+        if not isinstance(url,basestring):
+            url,data,headers = url
+            kwargs_ = dict(kwargs,data=data,headers=headers)
+        try:
+            return fetch(url,**kwargs_), None
+        except RETRY_EXCEPTIONS,msg:
+            logger.error('Query failed: %s (%s)'%(url,msg))
+            return None, msg
+    
+    workers = ThreadPool(max(1,min(int(threads),len(urls))))
+    try:
+        output = workers.map(worker,urls)
+    finally:
+        workers.close()
+        workers.join()
+    
+    errors = [error for contents,error in output if error is not None]
+    if errors and on_failure=='error':
+        #-- don't leave temporary files behind
+        if kwargs.get('filename',None) is True:
+            for contents,error in output:
+                if contents is not None: os.unlink(contents)
+        raise errors[0]
+    return [contents for contents,error in output]
+
+#}
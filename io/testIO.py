@@ -1,7 +1,15 @@
 import os
 import h5py
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
 import numpy as np
+from ivs.io import ascii
+from ivs.io import fits
 from ivs.io import hdf5
+from ivs.io import http
 
 import unittest
 
@@ -105,6 +113,196 @@ class HDF5TestCase(unittest.TestCase):
         if os.path.isfile('test.hdf5'):
             os.remove('test.hdf5')
 
+
+class ASCIITestCase(unittest.TestCase):
+    
+    def setUp(self):
+        fd,self.filename = tempfile.mkstemp()
+        lines = ['# x y']+['%d %.1f'%(i,0.5*i) for i in range(10)]
+        os.write(fd,'\n'.join(lines)+'\n')
+        os.close(fd)
+    
+    def tearDown(self):
+        os.unlink(self.filename)
+    
+    def testReadChunks(self):
+        """ io.ascii.read2chunks() """
+        comments = []
+        chunks = list(ascii.read2chunks(self.filename,chunksize=4,comments=comments))
+        self.assertEqual([len(chunk) for chunk in chunks], [4,4,2])
+        self.assertEqual(comments, [' x y'])
+        self.assertEqual(chunks[2][1].tolist(), [9.,4.5])
+    
+    def testReadArray(self):
+        """ io.ascii.read2array() """
+        data,comments = ascii.read2array(self.filename,chunksize=3,return_comments=True)
+        self.assertEqual(data.shape, (10,2))
+        self.assertTrue(np.all(data[:,1]==0.5*np.arange(10)))
+        data = ascii.read2recarray(self.filename,dtype=[('x','i4'),('y','f8')])
+        self.assertEqual(data['x'].tolist(), range(10))
+    
+    def testReadRagged(self):
+        """ io.ascii.read2array() with a varying number of columns """
+        with open(self.filename,'w') as ff:
+            ff.write('1 2 3\n4 5\n6 7 8 9\n')
+        self.assertRaises(ValueError,ascii.read2array,self.filename)
+        self.assertRaises(ValueError,ascii.read2array,self.filename,splitchar=' ')
+    
+    def testReadFixedWidth(self):
+        """ io.ascii.read2recarray() fixed width """
+        with open(self.filename,'w') as ff:
+            ff.write('abcde   0.549    71\nxy      1.250     3\n')
+        data = ascii.read2recarray(self.filename,splitchar=['A5','F8.3','I6'],chunksize=1)
+        self.assertEqual(data['0'].tolist(), ['abcde','xy   '])
+        self.assertEqual(data['1'].tolist(), [0.549,1.25])
+        self.assertEqual(data['2'].tolist(), [71,3])
+
+
+class FITSTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        fd,self.filename = tempfile.mkstemp(suffix='.fits')
+        os.close(fd)
+        os.unlink(self.filename)
+        columns = [fits.pyfits.Column(name='x',format='D',array=np.arange(5.)),
+                   fits.pyfits.Column(name='n',format='J',array=np.arange(5)),
+                   fits.pyfits.Column(name='name',format='10A',array=np.array(['a','abcdefghij','c','d','e'])),
+                   fits.pyfits.Column(name='flag',format='L',array=np.array([True,False,True,False,True]))]
+        fits.pyfits.new_table(columns).writeto(self.filename)
+    
+    def tearDown(self):
+        os.unlink(self.filename)
+    
+    def testReadView(self):
+        """ io.fits.read2recarray() lazy """
+        ff = fits.pyfits.open(self.filename,memmap=True)
+        data = fits.read2recarray(ff,columns=['x','name'],rows=slice(1,4))
+        self.assertTrue(np.may_share_memory(data,ff[1].data))
+        self.assertEqual(data['x'].tolist(), [1.,2.,3.])
+        self.assertEqual(data['name'].tolist(), ['abcdefghij','c','d'])
+        self.assertEqual(data.dtype['name'].itemsize, 10)
+        ff.close()
+    
+    def testReadCopy(self):
+        """ io.fits.read2recarray() with conversion """
+        data = fits.read2recarray(self.filename,rows=lambda x: x['flag'])
+        self.assertEqual(data.dtype.names, ('x','n','name','flag'))
+        self.assertEqual(data['n'].tolist(), [0,2,4])
+        self.assertTrue(data['x'].dtype.isnative)
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves canned catalogue responses """
+    protocol_version = 'HTTP/1.1'
+    responses_ = {'/tsv': '#Column\tVmag\t(F5.2)\nVmag\nmag\n-----\n 0.03\n',
+                  '/csv': 'ra,dec,Vmag\n279.23,38.78,0.03\n'}
+    
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        self.server.requests.append((path,self.client_address))
+        if path=='/flaky' and len([p for p,c in self.server.requests if p==path])<3:
+            code,body = 503,''
+        elif path=='/flaky':
+            code,body = 200,self.responses_['/tsv']
+        elif path in self.responses_:
+            code,body = 200,self.responses_[path]
+        else:
+            code,body = 404,''
+        self.send_response(code)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class HTTPTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = StandInServer(('127.0.0.1',0),StandInHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d'%(self.server.server_address[1])
+        self.pool = http.ConnectionPool()
+    
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def testFetchAll(self):
+        """ io.http.fetch_all() """
+        urls = [self.url+['/tsv','/csv'][i%2]+'?n=%d'%(i) for i in range(10)]
+        contents = http.fetch_all(urls,threads=4,connections=self.pool)
+        expected = [StandInHandler.responses_[['/tsv','/csv'][i%2]] for i in range(10)]
+        self.assertListEqual(contents, expected)
         
+        filens = http.fetch_all(urls[:2],threads=2,connections=self.pool,filename=True)
+        for filen,body in zip(filens,expected):
+            self.assertEqual(open(filen).read(), body)
+            os.unlink(filen)
+    
+    def testConnectionReuse(self):
+        """ io.http.ConnectionPool """
+        for i in range(3):
+            http.fetch(self.url+'/tsv',connections=self.pool)
+        clients = set([client for path,client in self.server.requests])
+        self.assertEqual(len(clients), 1)
+    
+    def testRetry(self):
+        """ io.http.fetch() retries """
+        contents = http.fetch(self.url+'/flaky',tries=3,delay=0.01,connections=self.pool)
+        self.assertEqual(contents, StandInHandler.responses_['/tsv'])
+        self.assertEqual(len(self.server.requests), 3)
         
-        
\ No newline at end of file
+        #-- a missing page is not retried
+        self.assertRaises(http.HTTPClientError, http.fetch, self.url+'/missing', tries=3,
+                          delay=10., connections=self.pool)
+        self.assertEqual(len(self.server.requests), 4)
+        contents = http.fetch_all([self.url+'/tsv',self.url+'/missing'],tries=0,
+                                  on_failure='continue',connections=self.pool)
+        self.assertEqual(contents[1], None)
+    
+    def testQueryCache(self):
+        """ io.http.QueryCache """
+        tempdir = tempfile.mkdtemp()
+        try:
+            cache = http.enable_cache(os.path.join(tempdir,'cache.sqlite'),max_size=60)
+            for i in range(2):
+                contents = http.fetch(self.url+'/tsv?b=1&a=2',connections=self.pool)
+            #-- equivalent query
+            contents = http.fetch(self.url+'/tsv?a=2&b=1',connections=self.pool)
+            self.assertEqual(contents, StandInHandler.responses_['/tsv'])
+            self.assertEqual(len(self.server.requests), 1)
+            
+            #-- in offline mode, uncached queries fail
+            cache.offline = True
+            self.assertRaises(IOError, http.fetch, self.url+'/csv', connections=self.pool)
+            cache.offline = False
+            
+            #-- the cache is too small to keep both responses
+            http.fetch(self.url+'/csv',connections=self.pool)
+            stats = cache.stats()
+            self.assertEqual((stats['hits'],stats['misses'],stats['evictions']), (2,3,1))
+            self.assertEqual(stats['entries'], 1)
+            
+            #-- expired entries are still served offline
+            cache.ttl = 0.
+            cache.offline = True
+            contents = http.fetch(self.url+'/csv',connections=self.pool)
+            self.assertEqual(contents, StandInHandler.responses_['/csv'])
+            self.assertEqual((cache.stats()['stale'],cache.stats()['entries']), (1,1))
+            cache.offline = False
+            
+            #-- expired entries are fetched again
+            http.fetch(self.url+'/csv',connections=self.pool)
+            self.assertEqual(cache.stats()['expired'], 1)
+            self.assertEqual(len(self.server.requests), 3)
+        finally:
+            http.disable_cache()
+            shutil.rmtree(tempdir)
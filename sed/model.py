@@ -2325,7 +2325,7 @@ def _get_pix_grid(photbands,
                     teffrange=(-np.inf,np.inf),loggrange=(-np.inf,np.inf),
                     ebvrange=(-np.inf,np.inf),zrange=(-np.inf,np.inf),
                     rvrange=(-np.inf,np.inf),vradrange=(-np.inf,np.inf),
-                    include_Labs=True,clear_memory=True,
+                    include_Labs=True,clear_memory=True,sparse=False,
                     variables=['teff','logg','ebv','z','rv','vrad'],**kwargs):
     """
     Prepare the pixalted grid.
@@ -2334,6 +2334,9 @@ def _get_pix_grid(photbands,
     here. I'm thinking about:
     
         teff, logg, ebv, z, Rv, vrad.
+    
+    For grids that are far from rectangular, set C{sparse=True} to only keep
+    the populated grid points in memory (see L{interpol.SparsePixelGrid}).
     """
     if clear_memory:
         clear_memoization(keys=['ivs.sed.model'])
@@ -2398,7 +2401,7 @@ def _get_pix_grid(photbands,
     grid_names = grid_names[keep]
     
     #-- create the pixeltype grid
-    axis_values, pixelgrid = interpol.create_pixeltypegrid(grid_pars,flux.T)
+    axis_values, pixelgrid = interpol.create_pixeltypegrid(grid_pars,flux.T,sparse=sparse)
     return axis_values,grid_pars.T,pixelgrid,grid_names
 
 
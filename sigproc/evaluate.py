@@ -17,7 +17,7 @@ import functools
 import numpy as np
 from numpy import pi,cos,sin,sqrt,tan,arctan
 from scipy.interpolate import splev
-from scipy.special import erf,jn
+from scipy.special import erf
 from scipy.stats import distributions
 from ivs.timeseries import keplerorbit
 
@@ -383,9 +383,6 @@ def sine_orbit(times,parameters,t0=None,nmax=10):
     #-- take epoch into account
     if t0 is None: t0 = times[0]
     
-    def ane(n,e): return 2.*np.sqrt(1-e**2)/e/n*jn(n,n*e)    
-    def bne(n,e): return 1./n*(jn(n-1,n*e)-jn(n+1,n*e))
-    
     #-- fit the signal
     signal = np.zeros(len(times))
     names = parameters.dtype.names
@@ -399,14 +396,9 @@ def sine_orbit(times,parameters,t0=None,nmax=10):
             frequency = par['freq']*(times-t0) + \
               alpha*(sin(2*pi*par['forb']*times) - sin(2*pi*par['forb']*t0))
         else:
-            e,omega = par['ecc'],par['omega']
-            ns = np.arange(1,nmax+1,1)
-            ans,bns = np.array([[ane(n,e),bne(n,e)] for n in ns]).T
-            ksins = sqrt(ans**2*cos(omega)**2+bns**2*sin(omega)**2)
-            thns = arctan(bns/ans*tan(omega))
-            tau = -np.sum(bns*sin(omega))
+            ns,ksins,thns,tau = keplerorbit.bessel_coefficients(par['ecc'],par['omega'],nmax=nmax)
             frequency = par['freq']*(times-t0) + \
-               alpha*(np.sum(np.array([ksins[i]*sin(2*pi*ns[i]*par['forb']*(times-t0)+thns[i]) for i in range(nmax)]),axis=0)+tau)
+               alpha*(np.dot(sin(2*pi*par['forb']*np.outer(times-t0,ns)+thns),ksins)+tau)
         signal += par['ampl'] * sin(2*pi*(frequency + par['phase']))
     
     return signal
@@ -468,9 +460,12 @@ def kepler(times,parameters,itermax=8):
         RVfit = parameters['gamma'].sum()
     else:
         RVfit = 0
-    for pars in parameters:
-        p = [pars['P'],pars['T0'],pars['e'],pars['omega'],pars['K'],0]
-        RVfit += keplerorbit.radial_velocity(p,times=times,itermax=itermax)
+    #-- solve Kepler's equation for all components at once
+    freq = 1./parameters['P'][:,None]
+    x0 = parameters['T0'][:,None]*2*np.pi*freq
+    e,omega = parameters['e'][:,None],parameters['omega'][:,None]
+    E,true_an = keplerorbit.true_anomaly(times*2*np.pi*freq-x0,e,itermax=itermax)
+    RVfit += np.sum(parameters['K'][:,None]*(e*np.cos(omega) + np.cos(true_an+omega)),axis=0)
     return RVfit
 
 @check_input
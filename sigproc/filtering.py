@@ -37,6 +37,7 @@ import numpy as np
 from numpy import sqrt,exp,pi,cos,sinc,trapz,average
 
 from scipy.integrate import trapz
+from scipy.signal import fftconvolve
 from multiprocessing import Process, Manager,cpu_count
 
 from ivs.aux.decorators import make_parallel
@@ -49,7 +50,7 @@ logger = logging.getLogger("TS.FILTERING")
 @defaults_filtering
 @parallel_pergram
 @make_parallel
-def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
+def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,engine='numpy',**kwargs):
     """
     Filter a signal.
     
@@ -84,16 +85,29 @@ def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
     Output parameter C{pnts} shows you how many points of the original signal
     were used to compute the given point. E.g. for a box filter, it will give
     the number of points over which was averaged.
+    
+    By default (C{engine='numpy'}), the filter is evaluated for all template
+    points at once if a vectorized version of the kernel exists
+    (L{gauss_filter}, L{box_filter}, L{inl_filter}): prefix sums for the box
+    filter, FFT convolution for a Gaussian on equidistant data and blocked
+    evaluation otherwise. With C{engine='python'}, or for the other filters,
+    the kernel function is called for every template point separately.
 
     @param ftype: one of 'gauss','pijpers','box','inl'
     @type ftype: string
+    @param engine: 'numpy' or 'python'
+    @type engine: string
     @rtype: tuple
     @return: output from the used filter: typically (x, y, pnts)
     """
+    on_grid = x_template is None
     if x_template is None:
         x_template = x + 0.
     if f0 is None: f0 = 0
     if fn is None: fn = len(x_template)
+    #-- the parallel decorator splits the index range in fractional parts
+    f0,fn = int(f0),int(fn)
+    on_grid = on_grid and f0==0 and fn==len(x_template) and step==1
     #-- set window and kernel function
     ftype = ftype.lower()    
     window = globals()[ftype+'_window']
@@ -114,6 +128,11 @@ def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
     logger.debug("FILTER between index %d-%d with step %d"%(f0,fn,step))
     x_template = x_template[f0:fn:step]
     searchsorted = x.searchsorted
+    if engine=='numpy' and (ftype+'_filter') in globals():
+        index0 = searchsorted(x_template-1e-30-lower_window)
+        indexn = searchsorted(x_template+1e-30+higher_window)
+        out = globals()[ftype+'_filter'](x,y,x_template,index0,indexn,on_grid=on_grid,**kwargs)
+        return tuple([x_template] + list(out))
     out = [kernel(x,y,t,index=searchsorted([t-1e-30-lower_window[i],t+1e-30+higher_window[i]]),
                         **kwargs) for i,t in enumerate(x_template)]
     #-- that's it!
@@ -263,7 +282,7 @@ def inl_kernel(times_in,signal_in,t,c=0.6745,sig_level=3.,tolerance=0.01,index=(
             break
         else:
             continuum = continuum_
-            outliers = (np.abs(continuum - signal_)>sig_level*sigma)
+            outliers = (np.abs(continuum - signal)>sig_level*sigma)
         
     return continuum_, sigma,len(times)
 
@@ -441,6 +460,203 @@ def box_kernel(times_in,signal_in,t,window_width=None,index=(0,-1),norm_weights=
 
 
 
+#}
+
+#{ Vectorized convolution-based filters
+
+def _window_blocks(index0,indexn,size=2**18):
+    """
+    Group template points in blocks for vectorized evaluation.
+    
+    For every block, a matrix of data indices is constructed: row i contains
+    the indices of the data points in the window of template point i (aligned
+    on the first point of the window), and is padded up to the widest window.
+    Every matrix has about C{size} elements.
+    
+    @rtype: generator
+    @return: slice of template points, matrix of data indices, window mask
+    """
+    if not len(index0):
+        return
+    width = max(1,(indexn-index0).max())
+    nblock = max(1,size/width)
+    columns = np.arange(width)
+    last = max(0,indexn.max()-1)
+    for start in xrange(0,len(index0),nblock):
+        block = slice(start,start+nblock)
+        indices = np.minimum(index0[block,None]+columns,last)
+        mask = columns<(indexn[block]-index0[block])[:,None]
+        yield block,indices,mask
+
+def _trapz_coefficients(x,indices,mask):
+    """
+    Coefficients of the trapezoidal rule for every window.
+    
+    Integrating C{f} over the window of row i with C{trapz(f,x=x[window])} is
+    the same as C{sum(f*coeffs[i])}.
+    
+    @rtype: ndarray
+    @return: coefficient matrix
+    """
+    #-- interior points get half of the intervals on both sides
+    dx = np.diff(x)
+    coeffs = np.hstack([0.,dx])/2.
+    coeffs[:-1] += dx/2.
+    coeffs = coeffs[indices]
+    #-- the first and last point of every window only get one half interval
+    rows = np.arange(len(indices))
+    npoints = mask.sum(axis=1)
+    first = indices[:,0]
+    last = indices[rows,np.maximum(npoints-1,0)]
+    coeffs[:,0] = (x[np.minimum(first+1,len(x)-1)]-x[first])/2.
+    coeffs[rows,np.maximum(npoints-1,0)] = (x[last]-x[np.maximum(last-1,0)])/2.
+    coeffs[npoints<2] = 0.
+    return coeffs*mask
+
+def _median_rows(values):
+    """
+    Median of every row, ignoring NaNs.
+    
+    Gives the same result as C{np.median} on the finite values of every row.
+    
+    @rtype: ndarray
+    @return: median per row
+    """
+    svalues = np.sort(values,axis=1)
+    n = (~np.isnan(values)).sum(axis=1)
+    rows = np.arange(len(values))
+    median = (svalues[rows,np.maximum(n-1,0)/2] + svalues[rows,n/2])/2.
+    median[n==0] = np.nan
+    return median
+
+def _blocked_trapz_filter(x,y,x_template,index0,indexn,weights,norm_weights=True):
+    """
+    Normalised convolution with a general kernel, evaluated in blocks.
+    
+    C{weights} is a function of the block slice and the distances between the
+    template points and the data points in their windows.
+    
+    @rtype: ndarray
+    @return: convolved signal
+    """
+    convolved = np.zeros(len(x_template))
+    for block,indices,mask in _window_blocks(index0,indexn):
+        w = weights(block,x[indices]-x_template[block,None])
+        if norm_weights and len(x)>1:
+            w *= _trapz_coefficients(x,indices,mask)
+        else:
+            w *= mask
+        convolved[block] = np.sum(w*y[indices],axis=1)/np.sum(w,axis=1)
+    return convolved
+
+def _fft_gauss_filter(x,y,index0,indexn,sigma=1.,norm_weights=True):
+    """
+    Gaussian convolution of equidistant data on their own grid via FFT.
+    
+    The Gaussian kernel of L{gauss_kernel} is sampled on the grid, and the
+    trapezoidal end point corrections are applied afterwards for every
+    window. If the windows are not all the same (apart from the edges of the
+    data), C{None} is returned.
+    
+    @rtype: ndarray
+    @return: convolved signal
+    """
+    N = len(x)
+    here = np.arange(N)
+    M = (here-index0).max()
+    if np.any(index0!=np.maximum(0,here-M)) or np.any(indexn!=np.minimum(N,here+M+1)):
+        return None
+    gauss = lambda dt: 1./(sqrt(2.*pi)*sigma) * exp( -dt**2./(2.*sigma**2.))
+    dx = (x[-1]-x[0])/(N-1.)
+    kernel = gauss(np.arange(-M,M+1)*dx)
+    convolved = fftconvolve(y,kernel,mode='same')
+    norm_fact = fftconvolve(np.ones(N),kernel,mode='same')
+    if norm_weights and N>1:
+        left,right = gauss(x[index0]-x),gauss(x[indexn-1]-x)
+        convolved -= (left*y[index0] + right*y[indexn-1])/2.
+        norm_fact -= (left + right)/2.
+    return convolved/norm_fact
+
+def gauss_filter(x,y,x_template,index0,indexn,sigma=1.,norm_weights=True,on_grid=False):
+    """
+    Vectorized version of L{gauss_kernel}.
+    
+    If the data are equidistant and the filter is evaluated on the original
+    grid (C{on_grid}), the convolution is done via FFT. Otherwise, the
+    kernel is evaluated in blocks of template points.
+    
+    @rtype: (ndarray,ndarray)
+    @return: convolved signal, number of points
+    """
+    pnts = (indexn-index0).astype(float)
+    if on_grid and not isinstance(sigma,np.ndarray) and len(x)>2 and pnts.min()>1:
+        dx = np.diff(x)
+        if np.all(np.abs(dx-dx.mean())<=1e-8*np.abs(dx.mean())):
+            convolved = _fft_gauss_filter(x,y,index0,indexn,sigma=sigma,norm_weights=norm_weights)
+            if convolved is not None:
+                return convolved,pnts
+    if isinstance(sigma,np.ndarray):
+        sigma = sigma[(indexn+index0)/2][:,None]
+        weights = lambda block,dt: 1./(sqrt(2.*pi)*sigma[block]) * exp( -dt**2./(2.*sigma[block]**2.))
+    else:
+        weights = lambda block,dt: 1./(sqrt(2.*pi)*sigma) * exp( -dt**2./(2.*sigma**2.))
+    convolved = _blocked_trapz_filter(x,y,x_template,index0,indexn,weights,
+                                      norm_weights=norm_weights)
+    return convolved,pnts
+
+def box_filter(x,y,x_template,index0,indexn,norm_weights=True,**kwargs):
+    """
+    Vectorized version of L{box_kernel}, using prefix sums.
+    
+    @rtype: (ndarray,ndarray)
+    @return: convolved signal, number of points
+    """
+    pnts = (indexn-index0).astype(float)
+    #-- subtract the mean to limit round-off in the cumulative sum
+    offset = y.mean()
+    prefix = np.hstack([0.,np.cumsum(y-offset)])
+    convolved = prefix[indexn]-prefix[index0] + pnts*offset
+    if norm_weights:
+        convolved[pnts>0] /= pnts[pnts>0]
+        convolved[pnts==0] = 0.
+    return convolved,pnts
+
+def inl_filter(x,y,x_template,index0,indexn,c=0.6745,sig_level=3.,tolerance=0.01,**kwargs):
+    """
+    Vectorized version of L{inl_kernel}.
+    
+    The running medians and MADs are computed for blocks of windows at once,
+    on the sorted rows of the window matrix.
+    
+    @rtype: (ndarray,ndarray,ndarray)
+    @return: continuum, sigma, number of points
+    """
+    continuum = np.zeros(len(x_template))
+    sigma = np.zeros(len(x_template))
+    max_iter = 3
+    for block,indices,mask in _window_blocks(index0,indexn):
+        signal = np.where(mask,y[indices],np.nan)
+        cont = _median_rows(signal)
+        sig = _median_rows(np.abs(signal-cont[:,None]))/c
+        #-- the padding of the windows is nan, and never an outlier
+        with np.errstate(invalid='ignore'):
+            outliers = np.abs(cont[:,None]-signal)>sig_level*sig[:,None]
+        #-- only keep iterating on the windows that did not converge
+        active = np.arange(len(signal))
+        for iteration in range(max_iter):
+            signal_ = np.where(outliers,np.nan,signal[active])
+            cont_ = _median_rows(signal_)
+            sig = _median_rows(np.abs(signal_-cont_[:,None]))/c
+            continuum[block][active] = cont_
+            sigma[block][active] = sig
+            with np.errstate(divide='ignore',invalid='ignore'):
+                keep = ~(np.abs((cont_-cont)/cont_)<tolerance)
+                active,cont,sig = active[keep],cont_[keep],sig[keep]
+                outliers = np.abs(cont[:,None]-signal[active])>sig_level*sig[:,None]
+            if not len(active):
+                break
+    return continuum,sigma,(indexn-index0).astype(float)
+
 #}
 
 def test():
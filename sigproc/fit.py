@@ -431,6 +431,7 @@ import numpy as np
 from numpy import pi,cos,sin
 import numpy.linalg as la
 from scipy.interpolate import splrep
+from scipy.linalg import qr, qr_insert, cho_solve, solve_triangular
 import scipy.optimize
 
 from ivs.aux import progressMeter as progress
@@ -440,6 +441,7 @@ from ivs.timeseries import pyKEP
 
 import re
 import copy
+from multiprocessing import Pool, Value, Array, cpu_count
 import pylab as pl
 import matplotlib as mpl
 from ivs.sigproc import lmfit
@@ -449,7 +451,141 @@ logger = logging.getLogger('SP.FIT')
 #{Linear fit functions
 
 
-def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0):
+class HarmonicFit(object):
+    """
+    Linear least squares fit of harmonic functions with fixed frequencies.
+    
+    The fit function is of the form
+    
+    C + \sum_j a_j sin(2pi nu_j (t-t0)) + b_j cos(2pi nu_j (t-t0))
+    
+    which is linear in its fit parameters. The weighted basisfunction matrix A
+    is kept as an (economic) QR factorization, which is updated with two
+    columns for every frequency that is added. When frequencies are added one
+    by one, as in a prewhitening analysis, earlier columns are never
+    factorized again.
+    
+    The parameters are solved from R p = Q^T b, and the covariance matrix
+    (A^T A)^-1 follows from Cholesky solves with R, since A^T A = R^T R.
+    
+    >>> times = np.linspace(0,100,1000)
+    >>> signal = 2.*np.sin(2*pi*(0.3*times+0.1)) + 1.
+    >>> fitter = HarmonicFit(times,signal)
+    >>> fitter.add_frequency(0.3)
+    >>> print np.round(fitter.parameters()['ampl'],5)
+    [ 2.]
+    
+    @param times: time points
+    @type times: numpy array
+    @param signal: observations
+    @type signal: numpy array
+    @keyword sigma: standard error of observations
+    @type sigma: numpy array
+    @keyword constant: flag, if not None, also fit a constant
+    @type constant: boolean
+    @keyword t0: time zero point.
+    @type t0: float
+    """
+    def __init__(self, times, signal, sigma=None, constant=True, t0=0):
+        if sigma is None:
+            sigma = np.ones_like(signal)
+        elif not hasattr(sigma,'__len__'):
+            sigma = sigma * np.ones_like(signal)
+        self.times = times - t0
+        self.signal = signal
+        self.sigma = sigma
+        self.constant = constant
+        self.t0 = t0
+        self.freq = []
+        self.b = signal * sigma
+        #-- the constant is the first column of the basisfunction matrix
+        if constant:
+            self.Q, self.R = qr(sigma[:,np.newaxis], mode='economic')
+        else:
+            self.Q, self.R = np.zeros((len(times),0)), np.zeros((0,0))
+    
+    def same_data(self, times, signal, sigma=None, constant=True, t0=0):
+        """
+        Check if the fit was set up with the given data and options.
+        
+        @return: True if the data and options are the same
+        @rtype: bool
+        """
+        if sigma is None:
+            sigma = 1.
+        if len(times)!=len(self.times) or constant!=self.constant or t0!=self.t0:
+            return False
+        return np.array_equal(times-t0,self.times) and np.array_equal(signal,self.signal)\
+               and np.all(sigma==self.sigma)
+    
+    def add_frequency(self, freq):
+        """
+        Add one or more frequencies to the fit, by appending their sine and
+        cosine columns to the QR factorization.
+        
+        @param freq: frequencies of the harmonics
+        @type freq: numpy array or float
+        """
+        if not hasattr(freq,'__len__'):
+            freq = [freq]
+        for nu in freq:
+            columns = np.column_stack([sin(2*pi*nu*self.times) * self.sigma,
+                                       cos(2*pi*nu*self.times) * self.sigma])
+            self.Q, self.R = qr_insert(self.Q, self.R, columns, self.R.shape[1],
+                                       which='col')
+            self.freq.append(nu)
+    
+    def solve(self):
+        """
+        Solve the linear least squares problem.
+        
+        @return: fit parameters (constant, and sine and cosine amplitude per frequency)
+        @rtype: numpy array
+        """
+        return solve_triangular(self.R, np.dot(self.Q.T, self.b))
+    
+    def covariance(self, chisq=None):
+        """
+        Covariance matrix of the fit parameters, in the order of L{solve}.
+        
+        @keyword chisq: chi square to scale the covariance matrix with. If None,
+        the chi square of the least squares solution is used.
+        @type chisq: float
+        @return: covariance matrix
+        @rtype: 2D numpy array
+        """
+        Ndata, Nparam = self.Q.shape
+        if chisq is None:
+            chisq = np.sum((self.b - np.dot(self.Q, np.dot(self.Q.T, self.b)))**2)
+        covariance = cho_solve((self.R, False), np.eye(Nparam))
+        return covariance * chisq / (Ndata - Nparam)
+    
+    def parameters(self):
+        """
+        Compute the amplitudes and phases: A_j sin(2pi*\nu_j t_i + phi_j)
+        
+        @return: parameters, in the format of L{sine}
+        @rtype: record array
+        """
+        fitparam = self.solve()
+        freq = np.array(self.freq)
+        offset = self.constant and 1 or 0
+        a, b = fitparam[offset::2], fitparam[offset+1::2]
+        amplitude = np.sqrt(a**2 + b**2)
+        phase = np.arctan2(b, a)
+        
+        if self.constant:
+            constn = np.zeros(len(amplitude))
+            constn[0] = fitparam[0]
+            names = ['const','ampl','freq','phase']
+            fpars = [constn,amplitude,freq,phase/(2*pi)]
+        else:
+            names = ['ampl','freq','phase']
+            fpars = [amplitude,freq,phase/(2*pi)]
+        return np.rec.fromarrays(fpars,names=names)
+
+
+def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0,fitter=None):
     """
     Fit a harmonic function.
     
@@ -462,6 +598,12 @@ def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0):
     
     (phase in radians!)
     
+    The fit is done by a L{HarmonicFit}. If such a C{fitter} is given of
+    which the frequencies are the first frequencies of C{freq}, only the
+    remaining frequencies are added to it, and the factorization of the
+    previous fit is reused. This is only done if the fitter was set up with
+    the same data and options, otherwise a new fit is made.
+    
     @param times: time points
     @type times: numpy array
     @param signal: observations
@@ -476,69 +618,24 @@ def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0):
     @type error: boolean
     @keyword t0: time zero point.
     @type t0: float
+    @keyword fitter: fitter of a previous fit with part of the frequencies
+    @type fitter: L{HarmonicFit}
     @return: parameters
     @rtype: record array
     """
-    #-- Subtract the zero point from the time points.
-    times = times - t0
-    
-    #-- Prepare the input: if a frequency value is given, put it in a list. If
-    #   an iterable is given convert it to an array
+    #-- Prepare the input: if a frequency value is given, put it in a list.
     if not hasattr(freq,'__len__'):
         freq = [freq]
-    freq = np.asarray(freq)
-    #   do the same for the sigmas
-    if sigma is None:
-        sigma = np.ones_like(signal)
-    elif not hasattr(sigma,'__len__'):
-        sigma = sigma * np.ones_like(signal)
-    
-    #-- Determine the number of fit parameters
-    Ndata = len(times)
-    Nfreq = len(freq)
-    if not constant: Nparam = 2*Nfreq
-    else:            Nparam = 2*Nfreq+1
-        
-    #-- The fit function used is of the form
-    #      C + \sum_j a_j sin(2pi\nu_j t_i) + b_j cos(2pi\nu_j t_i)
-    #   which is linear in its fit parameters. These parameters p can therefore be
-    #   solved by minimizing ||b - A p||, where b are the observations, and A is the
-    #   basisfunction matrix, i.e. A[i,j] is the j-th base function evaluated in 
-    #   the i-th timepoint. The first Nfreq columns are the amplitudes of the sine,
-    #   the second Nfreq columns are the amplitudes of the cosine, and if requested,
-    #   the last column belongs to the constant
-    A = np.zeros((Ndata,Nparam))
-    for j in range(Nfreq):
-        A[:,j]       = sin(2*pi*freq[j]*times) * sigma
-        A[:,Nfreq+j] = cos(2*pi*freq[j]*times) * sigma
-    if constant:
-        A[:,2*Nfreq] = np.ones(Ndata) * sigma
+    freq = list(freq)
     
-    b = signal * sigma
-  
-    #-- Solve using SVD decomposition
-    fitparam, chisq, rank, s = np.linalg.lstsq(A,b)
-  
-    #-- Compute the amplitudes and phases: A_j sin(2pi*\nu_j t_i + phi_j)
-    amplitude = np.zeros(Nfreq)
-    phase = np.zeros(Nfreq)
-    for j in range(Nfreq):
-        amplitude[j] = np.sqrt(fitparam[j]**2 + fitparam[Nfreq+j]**2)
-        phase[j]     = np.arctan2(fitparam[Nfreq+j], fitparam[j])
-
-    #-- If no error bars are needed, we are finished here, we collect all parameters    
-    if constant:
-        constn = np.zeros(len(amplitude))
-        constn[0] = fitparam[2*Nfreq]
-        names = ['const','ampl','freq','phase']
-        fpars = [constn,amplitude,freq,phase/(2*pi)]
-    else:
-        names = ['ampl','freq','phase']
-        fpars = [amplitude,freq,phase/(2*pi)]
-        
-    parameters = np.rec.fromarrays(fpars,names=names)
+    #-- Reuse the factorization of a previous fit if possible
+    if fitter is None or fitter.freq != freq[:len(fitter.freq)] or \
+             not fitter.same_data(times, signal, sigma=sigma, constant=constant, t0=t0):
+        fitter = HarmonicFit(times, signal, sigma=sigma, constant=constant, t0=t0)
+    fitter.add_frequency(freq[len(fitter.freq):])
+    parameters = fitter.parameters()
     
-    logger.debug('SINEFIT: Calculated harmonic fit with %d frequencies through %d datapoints'%(Nfreq,Ndata))
+    logger.debug('SINEFIT: Calculated harmonic fit with %d frequencies through %d datapoints'%(len(freq),len(times)))
         
     return parameters
 
@@ -899,12 +996,12 @@ def gauss(x,y,threshold=0.1,constant=False,full_output=False,
 #}
 #{ Error determination
 
-def e_sine(times,signal,parameters,correlation_correction=True,limit=10000):
+def e_sine(times,signal,parameters,correlation_correction=True,limit=10000,fitter=None):
     """
     Compute the errors on the parameters from a sine fit.
     
     Note: errors on the constant are only calculated when the number of datapoints
-    is below 1000. Otherwise, the matrices involved become to huge.
+    is below C{limit}, unless the L{HarmonicFit} of the fit is given.
     
     @param times: time points
     @type times: numpy array
@@ -915,11 +1012,14 @@ def e_sine(times,signal,parameters,correlation_correction=True,limit=10000):
     @type parameters: numpy record array
     @param correlation_correction: set to True if you want to correct for correlation effects
     @type correlation_correction: boolean
-    @param limit: Calculating the error on the constant requires the calculation
+    @param limit: Calculating the error on the constant requires the factorization
     of a matrix of size Ndata x Nparam, which takes a long time for large datasets.
     The routines skips the estimation of the error on the constant if the timeseries
     is longer than C{limit} datapoints
     @type limit: integer
+    @param fitter: the unweighted fitter used to fit the parameters, of which the
+    factorization is reused.
+    @type fitter: L{HarmonicFit}
     @return: errors
     @rtype: Nx4 array(, Nx3 array)
     """
@@ -932,41 +1032,28 @@ def e_sine(times,signal,parameters,correlation_correction=True,limit=10000):
     #-- for quick reference, we also need the dimensions of the data and
     #   fit parameters
     Ndata = len(times)
-    Nparam = 2*len(parameters)
     Nfreq = len(freq)
     T = times.ptp()
     
     #-- do we need to include the constant?
-    if 'const' in parameters.dtype.names:
-        constant = True
-        Nparam += 1   
+    constant = 'const' in parameters.dtype.names
     
     #-- these lists will contain the columns and their names
     errors = []
     names = []
     
     #-- If error bars on the constant are needed, we do it here. The errors
-    #   on the amplitude, frequency and phase are computed below.
-    if constant and Ndata<limit:
-        #   First the derivative matrix: the 1st Nfreq columns the derivative w.r.t.
-        #   the amplitude, the 2nd Nfreq columns w.r.t. the phase, and the if relevant
-        #   the last column w.r.t. the constant. From this the covariance matrix.
-        F = np.zeros((Ndata, Nparam))   
-        for i in range(Ndata):
-            F[i,0:Nfreq] = sin(2*pi*freq*times[i] + phase)
-            F[i,Nfreq:2*Nfreq] = amplitude * cos(2*pi*freq*times[i] + phase)
-            #-- and for the constant
-            F[i,2*Nfreq] = 1.0 
-      
-        covariance = np.linalg.inv(np.dot(F.T, F))
-        covariance *= chisq / (Ndata - Nparam)
-  
-        #error_ampl = np.sqrt(covariance.diagonal()[:Nfreq])
-        #error_phase = np.sqrt(covariance.diagonal()[Nfreq:2*Nfreq])
-        error_const = np.sqrt(covariance[2*Nfreq,2*Nfreq])
-        error_const = np.ones(Nfreq)*error_const
-        if len(error_const)>1:
-            error_const[1:] = 0
+    #   on the amplitude, frequency and phase are computed below. The
+    #   derivatives to the amplitude and phase span the same space as the
+    #   sine and cosine basisfunctions, so the covariance of the constant
+    #   follows from the factorization of the linear fit.
+    if constant and (Ndata<limit or fitter is not None):
+        if fitter is None or list(fitter.freq) != list(freq) or not fitter.same_data(times, signal):
+            fitter = HarmonicFit(times, signal)
+            fitter.add_frequency(freq)
+        covariance = fitter.covariance(chisq=chisq)
+        error_const = np.zeros(Nfreq)
+        error_const[0] = np.sqrt(covariance[0,0])
         errors.append(error_const)
         names.append('e_const')
     elif constant:
@@ -1169,8 +1256,10 @@ class Function(object):
     
     >>> jacobian = lambda pars, x: np.array([-np.ones(len(x)), -x, -x**2]).T
         
-    If you get bad results, try flipping all signs. The jacobian does not really improve the speed
-    of the fitprocess, but it does help to reach the minimum in a more consistent way (see examples).
+    If you get bad results, try flipping all signs. With a jacobian the leastsq engine does not
+    need extra function evaluations to estimate the derivatives, and it helps to reach the minimum
+    in a more consistent way (see examples). Most functions in L{ivs.sigproc.funclib} provide an
+    analytic jacobian.
     
     The internal representation of the parameters uses a parameter object of the U{lmfit 
     <http://cars9.uchicago.edu/software/python/lmfit/index.html>} package. No knowledge of this
@@ -1507,9 +1596,11 @@ class Model(object):
     other settings are provided. If wanted, the parameters object itself can be obtained with
     the L{parameters} attribute.
     
-    At the moment the use of a jacobian is not supported at the Model level as it is not possible
-    to derive a symbolic jacobian from the provided functions. If you want to use a jacobian you
-    will have to write a Function yourself in which you can provide a jacobian function.
+    When the Functions are simply summed (no I{expr} given) and all of them provide a jacobian,
+    the jacobian of the Model is the combination of the jacobians of its Functions. For other
+    expressions it is not possible to derive a symbolic jacobian from the provided functions. If
+    you want to use a jacobian in that case, you will have to write a Function yourself in which
+    you can provide a jacobian function.
     """
     
     def __init__(self, functions=None, expr=None, resfunc=None):
@@ -1529,7 +1620,6 @@ class Model(object):
         self.functions = functions
         self.expr = expr
         self.resfunc = resfunc
-        self.jacobian = None
         self._par_names = None
         self.parameters = None
         
@@ -1578,9 +1668,29 @@ class Model(object):
         
     def evaluate_jacobian(self, x, *args):
         """
-        Not implemented!
+        Evaluate the jacobian of the model for the given values and optional a given
+        parameter object. This is only possible for a sum of Functions which all provide
+        a jacobian (see L{jacobian}).
+        
+        @param x: the independant values for which to evaluate the jacobian.
+        @type x: array
+        
+        @return: jacobian, one column for each parameter in the model
+        @rtype: 2D numpy array
         """
-        return [0.0 for p in self.parameters]
+        if self.jacobian == None:
+            return [0.0 for p in self.parameters]
+        
+        if len(args) == 0:
+            #-- Use the parameters belonging to this object
+            parameters = self.parameters
+        elif len(args) == 1:
+            #-- Use the provided parameters
+            parameters = args[0]
+        
+        #-- Update the parameters of the individual functions and combine their jacobians
+        self.push_parameters(parameters=parameters)
+        return np.hstack([function.evaluate_jacobian(x) for function in self.functions])
         
     def setup_parameters(self,values=None, bounds=None, vary=None, exprs=None):
         """
@@ -1732,6 +1842,16 @@ class Model(object):
     
     #{ Advanced attributes
     
+    @property
+    def jacobian(self):
+        'the jacobian function of a sum of Functions that all have a jacobian, None otherwise'
+        if self.expr != None or self.functions == None:
+            return None
+        for function in self.functions:
+            if function.jacobian == None:
+                return None
+        return self.evaluate_jacobian
+    
     @property
     def par_names(self):
         'get par_names'
@@ -1845,7 +1965,7 @@ class Minimizer(object):
 
     def __init__(self, x, y, model, errors=None, weights=None, resfunc=None,
              engine='leastsq', args=None, kws=None, grid_points=1, grid_params=None,
-             verbose=False, **kwargs):
+             verbose=False, threads=1, unique=None, prune=None, **kwargs):
         
         self.x = x
         self.y = y
@@ -1878,12 +1998,13 @@ class Minimizer(object):
         self._prepare_minimizer(fcn_args, fcn_kws, grid_points, grid_params)
         
         #-- Actual fitting
-        self._start_minimize(engine, verbose=verbose, Dfun=self.jacobian)
+        self._start_minimize(engine, verbose=verbose, threads=threads, unique=unique,
+                             prune=prune, Dfun=self.jacobian)
     
     #{ Error determination
     
     def calculate_CI(self, parameters=None, sigmas=[0.654, 0.95, 0.997], maxiter=200,
-                     **kwargs):
+                     threads=1, **kwargs):
         """
         Returns the confidence intervalls of the given parameters. This function uses
         the F-test method described below to calculate confidence intervalls. The
@@ -1899,6 +2020,10 @@ class Minimizer(object):
         The confidence intervalls calculated with this function are stored in the 
         Model or Function as well.
         
+        The lower and upper boundary of each parameter are independent searches, and
+        can be distributed over C{threads} processes ('max', 'half', 'safe' or an
+        integer).
+        
         F-test
         ======
         The F-test is used to compare the null model, which is the best fit
@@ -1921,6 +2046,8 @@ class Minimizer(object):
         @type parameters: array of strings
         @param sigmas: The probability levels used to calculate the CI
         @type sigmas: array or float
+        @param threads: number of processes
+        @type threads: int or str
         
         @return: the confidence intervals.
         @rtype: dict
@@ -1939,24 +2066,36 @@ class Minimizer(object):
             sigmas = [kwargs['sigma']]
             print 'WARNING: sigma is depricated, use sigmas'
         
-        #-- Use the adjusted conf_interval() function of the lmfit package.
+        #-- Use the ConfidenceInterval class of the lmfit package.
         #   We need to work on a copy of the minimizer and make a backup of
         #   the parameter object cause lmfit messes up the minimizer when
         #   running conf_interval
         mini = copy.copy(self.minimizer)
         backup = copy.deepcopy(self.model.parameters)
-        ci = lmfit.conf_interval(mini, p_names=parameters, sigmas=sigmas,
+        self._ci = lmfit.ConfidenceInterval(mini, p_names=parameters, sigmas=sigmas,
                                  maxiter=maxiter, prob_func=prob_func, trace=False, 
                                  verbose=False)
+        
+        #-- search the lower and upper boundary of every parameter separately
+        jobs = [(name, direction) for name in parameters for direction in (-1, 1)]
+        limits = dict(zip(jobs, _pool_imap(_ci_worker, self, jobs, threads=threads)))
+        sigmas = self._ci.sigmas
+        del self._ci
         self.model.parameters = backup
         
+        ci = {}
+        for name in parameters:
+            lower, upper = limits[(name, -1)], limits[(name, 1)]
+            ci[name] = dict([(s, (l[1], u[1])) for s, l, u in zip(sigmas, lower, upper)])
+        
         #-- store the CI values in the parameter object
         for key, value in ci.items():
             self.model.parameters[key].cierr.update(value)
         
         return ci
     
-    def calculate_CI_2D(self, xpar=None, ypar=None, res=10,  limits=None, ctype='prob'):
+    def calculate_CI_2D(self, xpar=None, ypar=None, res=10,  limits=None, ctype='prob',
+                        threads=1):
         """
         Calculates the confidence interval for 2 given parameters. Both the  confidence interval
         calculated using the F-test method from the I{estimate_error} method, and the normal chi 
@@ -1965,36 +2104,74 @@ class Minimizer(object):
         The confidence intervall is returned as a grid, together with the x and y distribution of
         the parameters: (x-values, y-values, grid)
         
+        Every row of the grid (fixed y value) is fitted starting from the cell closest to
+        the best fit, and each next cell starts from the solution of its neighbour. The
+        rows are distributed over C{threads} processes ('max', 'half', 'safe' or an
+        integer), which write their chi2 values in a shared array.
+        
         @param xname: The parameter on the x axis
         @param yname: The parameter on the y axis
         @param res: The resolution of the grid over which the confidence intervall is calculated
         @param limits: The upper and lower limit on the parameters for which the confidence
                        intervall is calculated. If None, 5 times the stderr is used.
         @param ctype: 'prob' for probabilities plot (using F-test), 'chi2' for chi-squares. 
+        @param threads: number of processes
+        @type threads: int or str
         
         @return: the x values, y values and confidence values
         @rtype: (array, array, 2d array)
         """
+        global _POOL_GRID
         
         xn = hasattr(res,'__iter__') and res[0] or res
         yn = hasattr(res,'__iter__') and res[1] or res
         
-        prob_func = None
+        #-- work on a copy of the minimizer, which has to be fitted with leastsq
+        mini = copy.copy(self.minimizer)
+        if not hasattr(mini, 'covar'):
+            mini.leastsq()
+        best_chi, ndata = mini.chisqr, mini.ndata
+        org = lmfit.confidence.copy_vals(mini.params)
+        
+        x, y = mini.params[xpar], mini.params[ypar]
+        if limits is None:
+            limits = ((x.value + 5*x.stderr, x.value - 5*x.stderr),
+                      (y.value + 5*y.stderr, y.value - 5*y.stderr))
+        x_points = np.linspace(limits[0][1], limits[0][0], xn)
+        y_points = np.linspace(limits[1][1], limits[1][0], yn)
+        
+        #-- fix both parameters and fit all rows of the grid
+        varies = x.vary, y.vary
+        x.vary, y.vary = False, False
+        mini.prepare_fit(mini.params)
+        nparas = mini.nvarys
+        self._ci2d = mini, x, y, x_points, y_points, org
+        _POOL_GRID = Array('d', xn*yn, lock=False)
+        try:
+            for row in _pool_imap(_ci2d_worker, self, range(yn), threads=threads):
+                pass
+            chi2 = np.frombuffer(_POOL_GRID).reshape(yn, xn).copy()
+        finally:
+            _POOL_GRID = None
+            del self._ci2d
+        
+        #-- restore the minimizer
+        x.vary, y.vary = varies
+        lmfit.confidence.restore_vals(org, mini.params)
+        mini.prepare_fit(mini.params)
+        
         if ctype == 'chi2':
-            def prob_func(Ndata, Nparas, new_chi, best_chi, nfix=1.):
-                return new_chi
+            return x_points, y_points, chi2
+        
         old = np.seterr(divide='ignore') #turn division errors off temporary
-        x, y, grid = lmfit.conf_interval2d(self.minimizer, xpar, ypar, xn, yn, limits=limits,
-                                           prob_func=prob_func)
+        grid = lmfit.confidence.f_compare(ndata, nparas, chi2, best_chi, nfix=2.) * 100.
         np.seterr(divide=old['divide'])
         
-        if ctype=='prob':
-            grid *= 100.
- 
-        return x, y, grid
+        return x_points, y_points, grid
     
     def calculate_MC_error(self, points=100, errors=None, distribution='gauss', 
-                           short_output=True, verbose=True, **kwargs):
+                           short_output=True, verbose=True, threads=1, seed=None,
+                           tolerance=None, check=50, **kwargs):
         """
         Use Monte-Carlo simulations to estimate the error of each parameter. In this
         approach each datapoint is perturbed by its error, and for each new dataset 
@@ -2010,7 +2187,19 @@ class Minimizer(object):
         
         The MC errors are saved in the Model or Function supplied to this fitter, and
         can be returned as an array (short_output=True), or as a dictionary
-        (short_output=False).
+        (short_output=False). The fitted parameter values of all iterations are
+        stored as a (points x parameters) array in the attribute I{mc_values}.
+        
+        Every iteration starts from the best fitting parameters. The iterations can
+        be distributed over C{threads} processes ('max', 'half', 'safe' or an
+        integer). If a C{seed} is given, iteration i perturbs the data with the
+        random seed C{seed+i}, so the results do not depend on the number of
+        processes. Otherwise all perturbed datasets are drawn upfront from the
+        global random generator.
+        
+        If a C{tolerance} is given, the simulations are stopped early as soon as the
+        relative change of all MC errors over the last C{check} iterations is
+        smaller than the tolerance.
         
         @param points: The number of itterations
         @type points: int
@@ -2020,39 +2209,55 @@ class Minimizer(object):
         @type distribution: str
         @param short_output: True if you want array, False if you want dictionary
         @type short_output: bool
+        @param threads: number of processes
+        @type threads: int or str
+        @param seed: base random seed of the iterations
+        @type seed: int
+        @param tolerance: relative tolerance on the MC errors for early stopping
+        @type tolerance: float
+        @param check: number of iterations between convergence checks
+        @type check: int
         
         @return: The MC errors of all parameters.
         @rtype: array or dict
         """
-        if errors != None:
+        if errors is not None:
             self.errors = errors
         
         perturb_args = dict(distribution=distribution)
         perturb_args.update(kwargs)
-        params = np.empty(shape=(points), dtype=object)
         
-        #-- perturb the data
-        y_perturbed = self._perturb_input_data(points, **perturb_args)
+        #-- perturb the data upfront, or let every iteration do it with its own seed
+        if seed is None:
+            jobs = [(None, y_) for y_ in self._perturb_input_data(points, **perturb_args)]
+        else:
+            jobs = [(seed + i, None) for i in range(points)]
         
         if verbose: print "MC simulations ({:.0f} points):".format(points)
         if verbose: Pmeter = progress.ProgressMeter(total=points)
-        for i, y_ in enumerate(y_perturbed):
-            if verbose: Pmeter.update(1)
-        
-            #-- setup the fit
-            pars = copy.deepcopy(self.model.parameters)
-            fcn_args = (self.x, y_)
-            fcn_kws = dict(weights=self.weights, errors=self.errors)
-            if self.model_kws != None:
-                fcn_kws.update(self.model_kws)
-            result = lmfit.Minimizer(self.residuals, pars, fcn_args=fcn_args,
-                                     fcn_kws=fcn_kws, **self.fit_kws)
-            
-            #-- run the fit and save the results
-            result.start_minimize(self.engine, Dfun=self.jacobian)
-            params[i] = pars
-        
-        pnames, mcerrors = self._mc_error_from_parameters(params)
+        values = np.zeros((points, len(self.model.parameters)))
+        previous = None
+        results = _pool_imap(_mc_fit_worker, self, jobs, threads=threads)
+        try:
+            for i, value in enumerate(results):
+                if verbose: Pmeter.update(1)
+                values[i] = value
+                
+                #-- check if the MC errors are converged
+                if tolerance is not None and (i+1) % check == 0:
+                    current = np.std(values[:i+1], axis=0)
+                    if previous is not None and \
+                       np.all(np.abs(current-previous) <= tolerance*np.abs(current)):
+                        logger.info('MC errors converged after {:.0f} points'.format(i+1))
+                        values = values[:i+1]
+                        break
+                    previous = current
+        finally:
+            #-- close the pool and release the fitter, also when stopped early
+            results.close()
+        
+        self.mc_values = values
+        pnames, mcerrors = self._mc_error_from_parameters(values)
         
         if short_output:
             return mcerrors
@@ -2325,7 +2530,7 @@ class Minimizer(object):
     @errors.setter
     def errors(self, val):
         'set error'
-        if val == None:
+        if val is None:
             self._error = None
         elif np.shape(val) == ():
             self._error = np.ones_like(self.x) * val
@@ -2369,10 +2574,20 @@ class Minimizer(object):
         self.residuals = residuals
     
     def _setup_jacobian_function(self):
-        "Internal function to setup the jacobian function for the minimizer."
-        if self.model.jacobian != None:
+        """
+        Internal function to setup the jacobian function for the minimizer. The jacobian
+        is only used by the leastsq engine, and not when some parameters are expressions
+        of other parameters or when a custom residual function is used (its derivatives
+        are unknown). Only the columns of the varying parameters are passed on,
+        weighted in the same way as the residuals.
+        """
+        exprs = [par.expr != None for par in self.model.parameters.values()]
+        if self.model.jacobian != None and self.engine.lower() == 'leastsq' and not any(exprs) \
+                 and self.resfunc == None:
             def jacobian(params, x, y, weights=None, errors=None, **kwargs):
-                return self.model.evaluate_jacobian(x, params, **kwargs)
+                jac = np.asarray(self.model.evaluate_jacobian(x, params))
+                varying = np.array([params[name].vary for name in self.model.par_names])
+                return jac[:,varying] * weights[:,np.newaxis]
             self.jacobian = jacobian
         else:
             self.jacobian = None
@@ -2401,48 +2616,75 @@ class Minimizer(object):
         else:
             self._minimizers = minimizers
         
-    def _start_minimize(self, engine, verbose=False, **kwargs):
-        "Internal function that starts all minimizers one by one"
+    def _start_minimize(self, engine, verbose=False, threads=1, unique=None, prune=None,
+                        **kwargs):
+        """
+        Internal function that starts all minimizers, possibly distributed over
+        several processes. Fits that end up in the same minimum as a better
+        fit (all parameters equal within a relative tolerance C{unique}) are
+        removed from the grid, as are fits that are aborted because their chi2
+        stays above C{prune} times the best chi2 found so far.
+        """
+        global _POOL_BEST
         #-- Possible termial output
         if len(self._minimizers) <= 1: verbose = False
         if verbose: print "Grid Minimizer ({:.0f} points):".format(len(self._minimizers))
         if verbose: Pmeter = progress.ProgressMeter(total=len(self._minimizers))
         
         #-- Start all minimizers
-        chisqrs = np.empty_like(self._minimizers, dtype=float)
-        for i, mini in enumerate(self._minimizers):
-            if verbose: Pmeter.update(1)
-            mini.start_minimize(engine, **kwargs)
-            chisqrs[i] = mini.chisqr
-            
-        #-- Sort on chisqr
-        inds = chisqrs.argsort()
+        self._start_kws = kwargs
+        self._prune = prune
+        _POOL_BEST = Value('d', np.inf)
+        jobs = range(len(self._minimizers))
+        chisqrs = np.empty(len(self._minimizers), dtype=float)
+        try:
+            for i, summary in _pool_imap(_grid_fit_worker, self, jobs, threads=threads):
+                if verbose: Pmeter.update(1)
+                if summary is None:
+                    chisqrs[i] = np.nan
+                    continue
+                _apply_fit_summary(self._minimizers[i], summary)
+                chisqrs[i] = self._minimizers[i].chisqr
+        finally:
+            _POOL_BEST = None
+        
+        #-- Remove pruned fits and sort on chisqr
+        inds = np.arange(len(chisqrs))[~np.isnan(chisqrs)]
+        if len(inds) < len(chisqrs):
+            logger.info('Pruned {:.0f} of {:.0f} fits'.format(len(chisqrs)-len(inds), len(chisqrs)))
+        inds = inds[chisqrs[inds].argsort()]
+        
+        #-- Remove fits that converged to the same minimum as a better one
+        if unique is not None and len(inds) > 1:
+            values = np.array([self._minimizers[i].params.value for i in inds], dtype=float)
+            keep = [0]
+            for j in range(1, len(inds)):
+                kept = values[keep]
+                same = np.abs(kept - values[j]) <= unique*np.maximum(np.abs(kept), np.abs(values[j]))
+                if not np.any(np.all(same, axis=1)):
+                    keep.append(j)
+            logger.info('Found {:.0f} unique minima in {:.0f} fits'.format(len(keep), len(inds)))
+            inds = inds[keep]
+        
         self._minimizers = self._minimizers[inds]
         self.model.parameters = self._minimizers[0].params
     
-    def _perturb_input_data(self, points, **kwargs):
+    def _perturb_input_data(self, points, seed=None, **kwargs):
         "Internal function to perturb the input data for MC simulations"
         
-        #-- create iterator for the data points
-        y_ = np.empty( (points,)+self.y.shape, dtype=float)
-        it = np.nditer([self.y, self.errors], ['multi_index'], [['readonly'], ['readonly']])
-        
-        #-- perturb the data
-        while not it.finished:
-            index = (slice(0,points),) + it.multi_index
-            y_[index] = np.random.normal(loc=it[0], scale=it[1], size=points)
-            it.iternext()
+        #-- draw the perturbations for every data point in turn, either from the
+        #   global random generator or from one with the given seed
+        random = np.random if seed is None else np.random.RandomState(seed)
+        draws = random.standard_normal(size=np.shape(self.y)+(points,))
+        y_ = self.y[...,None] + self.errors[...,None] * draws
             
-        return y_
+        return np.rollaxis(y_, -1)
     
-    def _mc_error_from_parameters(self, params):
+    def _mc_error_from_parameters(self, values):
         " Use standard deviation to get the error on a parameter "
         #-- calculate the std
-        pnames = params[0].keys()
-        errors = np.zeros((len(params), len(pnames)))
-        for i, pars in enumerate(params):
-            errors[i] = np.array(pars.value)
-        errors = np.std(errors, axis=0)
+        pnames = self.model.parameters.keys()
+        errors = np.std(values, axis=0)
         
         #-- store the error in the original parameter object
         params = self.model.parameters
@@ -2528,7 +2770,8 @@ def minimize(x, y, model, errors=None, weights=None, resfunc=None, engine='least
 
 def grid_minimize(x, y, model, errors=None, weights=None, resfunc=None, engine='leastsq',
                   args=None, kws=None, scale_covar=True, iter_cb=None, points=100, 
-                  parameters=None, return_all=False, verbose=True, **fit_kws):
+                  parameters=None, return_all=False, verbose=True, threads=1,
+                  unique=None, prune=None, **fit_kws):
     """                  
     Grid minimizer. Offers the posibility to start minimizing from a grid of starting
     parameters defined by the used. The number of starting points can be specified, as 
@@ -2544,6 +2787,13 @@ def grid_minimize(x, y, model, errors=None, weights=None, resfunc=None, engine='
     has vary = False, it will be kicked by the grid minimizer if it appears in parameters.
     This parameter will then be fixed at its new starting value.
     
+    The fits can be distributed over C{threads} processes. Fits that converge to
+    the same minimum as a better fit can be removed by setting C{unique} to the
+    relative tolerance at which parameter values are considered equal. Setting
+    C{prune} aborts fits whose chi2 is still larger than C{prune} times the best
+    chi2 found so far after a few iterations. Removed fits do not appear in the
+    returned grid.
+    
     @param parameters: The parameters that you want to randomly chose in the fitting process
     @type parameters: array of strings
     @param points: The number of starting points
@@ -2551,6 +2801,12 @@ def grid_minimize(x, y, model, errors=None, weights=None, resfunc=None, engine='
     @param return_all: if True, the results of all fits are returned, if False, only the 
                        best fit is returned.
     @type return_all: Boolean
+    @param threads: number of processes ('max', 'half', 'safe' or an integer)
+    @type threads: int or str
+    @param unique: relative tolerance to consider two fits identical
+    @type unique: float
+    @param prune: abort fits with a chi2 larger than this factor times the best chi2
+    @type prune: float
     
     @return: The best minimizer, or all minimizers as [minimizers, newmodels, chisqrs]
     @rtype: Minimizer object or array of [Minimizer, Model, float]
@@ -2559,7 +2815,8 @@ def grid_minimize(x, y, model, errors=None, weights=None, resfunc=None, engine='
     fitter = Minimizer(x, y, model, errors=errors, weights=weights, resfunc=resfunc,
                        engine=engine, args=args, kws=kws,  scale_covar=scale_covar,
                        iter_cb=iter_cb, grid_points=points, grid_params=parameters,
-                       verbose=verbose, **fit_kws)
+                       verbose=verbose, threads=threads, unique=unique, prune=prune,
+                       **fit_kws)
     if fitter.message and verbose:
         logger.warning(fitter.message)
         
@@ -2572,6 +2829,39 @@ def grid_minimize(x, y, model, errors=None, weights=None, resfunc=None, engine='
 
 #{ General purpose
 
+def get_run_lengths(residus):
+    """
+    Calculate the lengths of consecutive runs of residus with the same sign.
+    
+    Sign changes are located in one vectorized pass over the residus, so this
+    is cheap even for light curves with millions of points. Zero residus form
+    their own sign class.
+    
+    Example usage:
+    
+    >>> lengths, histogram = get_run_lengths(np.array([1.,2.,-1.,3.,4.,5.,-2.]))
+    >>> print(lengths)
+    [2 1 3 1]
+    >>> print(histogram)
+    [0 2 1 1]
+    
+    @param residus: residus after the fit
+    @type residus: numpy array
+    @return: lengths of the same sign runs, histogram of the run lengths
+    (C{histogram[n]} is the number of runs of length n)
+    @rtype: array, array
+    """
+    signs = np.sign(np.ravel(residus))
+    if not len(signs):
+        return np.ones(1,int), np.bincount([1])
+    
+    #-- a new run starts at every index where the sign differs from the previous one
+    edges = np.flatnonzero(np.diff(signs)) + 1
+    edges = np.hstack([0, edges, len(signs)])
+    lengths = np.diff(edges)
+    
+    return lengths, np.bincount(lengths)
+
 def get_correlation_factor(residus, full_output=False):
     """
     Calculate the correlation facor rho (Schwarzenberg-Czerny, 2003).
@@ -2581,6 +2871,8 @@ def get_correlation_factor(residus, full_output=False):
     
     The errors are then underestimated by a factor 1/sqrt(rho).
     
+    The run lengths are computed with L{get_run_lengths}.
+    
     @param residus: residus after the fit
     @type residus: numpy array
     @param full_output: if True, the groups of data with same sign will be returned
@@ -2588,20 +2880,18 @@ def get_correlation_factor(residus, full_output=False):
     @return: rho(,same sign groups)
     @rtype: float(,list)
     """
-    same_sign_groups = [1]
+    lengths = get_run_lengths(residus)[0]
     
-    for i in xrange(1,len(residus)):
-        if np.sign(residus[i])==np.sign(residus[i-1]):
-            same_sign_groups[-1] += 1
-        else:
-            same_sign_groups.append(0)
+    #-- every group after the first one is counted from its second point on
+    same_sign_groups = lengths - 1
+    same_sign_groups[0] += 1
     
     rho = np.average(same_sign_groups)
     
     logger.debug("Correlation factor rho = %f, sqrt(rho)=%f"%(rho,np.sqrt(rho)))
     
     if full_output:
-        return rho, same_sign_groups
+        return rho, list(same_sign_groups)
     else:
         return rho
 
@@ -2877,6 +3167,154 @@ def plot_convergence(startpars, models, chi2s, xpar=None, ypar=None, clim=None):
 
 
 
+#{ Parallel processing
+
+#-- the Minimizer that is shared with the worker processes
+_POOL_FITTER = None
+
+def _pool_threads(threads):
+    "Translate the threads keyword to a number of processes"
+    if threads == 'max':
+        return cpu_count()
+    elif threads == 'half':
+        return cpu_count()/2
+    elif threads == 'safe':
+        return cpu_count()-1
+    return int(threads)
+
+def _pool_imap(function, fitter, jobs, threads=1):
+    """
+    Apply a worker function to all jobs, and yield the results in order.
+    
+    The fitter is made available to the workers as a module attribute, which
+    is inherited by the worker processes on creation of the pool. This avoids
+    having to pickle the fitter (and its residual functions) for every job.
+    If C{threads} is one, the jobs are run in the current process.
+    """
+    global _POOL_FITTER
+    _POOL_FITTER = fitter
+    threads = _pool_threads(threads)
+    try:
+        if threads <= 1:
+            for job in jobs:
+                yield function(job)
+        else:
+            pool = Pool(threads)
+            chunksize = max(1, len(jobs)/(4*threads))
+            try:
+                for result in pool.imap(function, jobs, chunksize=chunksize):
+                    yield result
+            finally:
+                pool.terminate()
+    finally:
+        #-- don't keep the fitter (and its data) alive after the pool is gone
+        _POOL_FITTER = None
+
+def _mc_fit_worker(job):
+    "Fit one Monte Carlo realisation of the data, starting from the best fit"
+    fitter = _POOL_FITTER
+    seed, y_ = job
+    if y_ is None:
+        y_ = fitter._perturb_input_data(1, seed=seed)[0]
+    
+    #-- setup the fit
+    pars = copy.deepcopy(fitter.model.parameters)
+    fcn_args = (fitter.x, y_)
+    fcn_kws = dict(weights=fitter.weights, errors=fitter.errors)
+    if fitter.model_kws != None:
+        fcn_kws.update(fitter.model_kws)
+    result = lmfit.Minimizer(fitter.residuals, pars, fcn_args=fcn_args,
+                             fcn_kws=fcn_kws, **fitter.fit_kws)
+    
+    #-- run the fit and return the results
+    result.start_minimize(fitter.engine, Dfun=fitter.jacobian)
+    return np.array(pars.value, dtype=float)
+
+def _ci_worker(job):
+    "Search the confidence interval of one parameter in one direction"
+    name, direction = job
+    return _POOL_FITTER._ci.calc_ci(name, direction)
+
+#-- the chi2 map of the 2D confidence interval, shared with the worker processes
+_POOL_GRID = None
+
+def _ci2d_worker(row):
+    """
+    Fit all cells of one row of the 2D confidence interval grid, and write the
+    chi2 values in the shared grid. The cell closest to the best fit starts from
+    the best fit, all other cells start from the solution of their neighbour.
+    """
+    mini, x, y, x_points, y_points, org = _POOL_FITTER._ci2d
+    nx = len(x_points)
+    start = np.argmin(np.abs(x_points - org[x.name][0]))
+    
+    lmfit.confidence.restore_vals(org, mini.params)
+    y.value = y_points[row]
+    for sweep in (range(start, nx), range(start-1, -1, -1)):
+        for i in sweep:
+            x.value = x_points[i]
+            mini.prepare_fit(mini.params)
+            mini.leastsq()
+            _POOL_GRID[row*nx+i] = mini.chisqr
+            if i == start:
+                first = lmfit.confidence.copy_vals(mini.params)
+        #-- the left part of the row starts again from the first cell
+        lmfit.confidence.restore_vals(first, mini.params)
+    return row
+
+class _PrunedFit(Exception):
+    "Raised to abort a fit that stays clearly worse than the best fit so far"
+    pass
+
+#-- the best chi2 found so far by any of the grid fits
+_POOL_BEST = None
+
+def _grid_fit_worker(index):
+    """
+    Run one minimizer of the grid, and summarize the result. If pruning is
+    requested, the fit is aborted when its chi2 is still more than C{prune}
+    times the best chi2 so far after a few iterations.
+    """
+    fitter = _POOL_FITTER
+    mini = fitter._minimizers[index]
+    iter_cb = mini.iter_cb
+    if fitter._prune is not None:
+        prune_after = 5*(len(mini.params)+1)
+        def pruning_cb(params, nfev, out, *args, **kws):
+            if iter_cb is not None:
+                iter_cb(params, nfev, out, *args, **kws)
+            if nfev >= prune_after and np.sum(np.square(out)) > fitter._prune*_POOL_BEST.value:
+                raise _PrunedFit
+        mini.iter_cb = pruning_cb
+    try:
+        mini.start_minimize(fitter.engine, **fitter._start_kws)
+    except _PrunedFit:
+        return index, None
+    finally:
+        mini.iter_cb = iter_cb
+    
+    with _POOL_BEST.get_lock():
+        if mini.chisqr < _POOL_BEST.value:
+            _POOL_BEST.value = mini.chisqr
+    return index, _fit_summary(mini)
+
+def _fit_summary(mini):
+    "Picklable summary of the parameters and results of a lmfit Minimizer"
+    params = [(name, par.value, par.stderr, par.correl) for name, par in mini.params.items()]
+    results = dict([(key, val) for key, val in mini.__dict__.items() if \
+        isinstance(val, (bool, int, long, float, str, np.ndarray, np.number, type(None)))])
+    return params, results
+
+def _apply_fit_summary(mini, summary):
+    "Copy the results summarized by L{_fit_summary} to a lmfit Minimizer"
+    params, results = summary
+    for name, value, stderr, correl in params:
+        par = mini.params[name]
+        par.value, par.stderr, par.correl = value, stderr, correl
+    mini.__dict__.update(results)
+
+#}
+
 if __name__=="__main__":
     import doctest
     import pylab as pl
@@ -117,7 +117,7 @@ divide by zero encountered in power
 """
 import numpy as np
 from numpy import pi,cos,sin,sqrt,tan,arctan
-from scipy.special import erf,jn
+from scipy.special import erf, jn, jvp
 from ivs.sigproc.fit import Model, Function
 import ivs.timeseries.keplerorbit as kepler
 from ivs.sed import model as sed_model
@@ -183,7 +183,7 @@ def wien(wave_units='AA',flux_units='erg/s/cm2/AA',disc_integrated=True):
     
     return Function(function=function, par_names=pnames)
 
-def kepler_orbit(type='single'):
+def kepler_orbit(type='single', use_jacobian=True):
     """
     Kepler orbits ((p,t0,e,omega,K,v0) or (p,t0,e,omega,K1,v01,K2,v02))
     
@@ -193,13 +193,31 @@ def kepler_orbit(type='single'):
     A double kepler orbit
     parameters are: [p, t0, e, omega, k_1, v0_1, k_2, v0_2]
     Warning: This function uses 2d input and output!
+    
+    The single orbit has an analytic jacobian. The double orbit uses its own
+    residual function, and is fitted with a finite difference jacobian.
     """
     if type == 'single':
         pnames = ['p','t0','e','omega','k','v0']
         function = lambda p, x: kepler.radial_velocity(p, times=x, itermax=8)
         function.__name__ = 'kepler_orbit_single'
-    
-        return Function(function=function, par_names=pnames)
+        
+        if not use_jacobian:
+            return Function(function=function, par_names=pnames)
+        
+        def jacobian(p, x):
+            P,T0,e,omega,K,RV0 = p
+            M = 2*pi*(x-T0)/P
+            E,v = kepler.true_anomaly(M,e,itermax=8)
+            #-- derivatives of the true anomaly to the mean anomaly and eccentricity
+            dv_dM = (1+e*cos(v))**2 / (1-e**2)**1.5
+            dv_de = sin(v)*(2+e*cos(v)) / (1-e**2)
+            dRV_dv = -K*sin(v+omega)
+            return -np.array([dRV_dv*dv_dM*(-M/P), dRV_dv*dv_dM*(-2*pi/P),
+                              K*cos(omega) + dRV_dv*dv_de,
+                              -K*e*sin(omega) - K*sin(v+omega),
+                              e*cos(omega) + cos(v+omega), np.ones(len(x))]).T
+        return Function(function=function, par_names=pnames, jacobian=jacobian)
         
     elif type == 'double':
         pnames = ['p','t0','e','omega','k1','v01','k2','v02' ]
@@ -285,7 +303,7 @@ def gauss(use_jacobian=True):
             return np.array([-ex, -p[0] * (x-p[1]) * ex / p[2]**2, -p[0] * (x-p[1])**2 * ex / p[2]**3, [-1 for i in x] ]).T
         return Function(function=function, par_names=pnames, jacobian=jacobian)
     
-def sine():
+def sine(use_jacobian=True):
     """
     Sine (ampl,freq,phase,const)
     
@@ -295,7 +313,14 @@ def sine():
     function = lambda p, x: p[0] * sin(2*pi*(p[1]*x + p[2])) + p[3]
     function.__name__ = 'sine'
     
-    return Function(function=function, par_names=pnames)
+    if not use_jacobian:
+        return Function(function=function, par_names=pnames)
+    
+    def jacobian(p, x):
+        arg = 2*pi*(p[1]*x + p[2])
+        dphase = 2*pi*p[0]*cos(arg)
+        return -np.array([sin(arg), dphase*x, dphase, np.ones(len(x))]).T
+    return Function(function=function, par_names=pnames, jacobian=jacobian)
 
 
 def sine_linfreqshift(t0=0.):
@@ -337,7 +362,7 @@ def sine_expfreqshift(t0=0.):
     return Function(function=function, par_names=pnames)
 
     
-def sine_orbit(t0=0.,nmax=10):
+def sine_orbit(t0=0.,nmax=10,use_jacobian=True):
     """
     Sine with a sinusoidal frequency shift (ampl,freq,phase,const,forb,asini,omega,(,ecc))
     
@@ -353,34 +378,49 @@ def sine_orbit(t0=0.,nmax=10):
     @type nmax: int
     """
     pnames = ['ampl', 'freq', 'phase', 'const','forb','asini','omega']
-    def ane(n,e): return 2.*sqrt(1-e**2)/e/n*jn(n,n*e)    
-    def bne(n,e): return 1./n*(jn(n-1,n*e)-jn(n+1,n*e))
+    cc = 173.144632674 # speed of light in AU/d
     def function(p,x):
         ampl,freq,phase,const,forb,asini,omega = p[:7]
         ecc = None
         if len(p)==8:
             ecc = p[7]
-        cc = 173.144632674 # speed of light in AU/d
         alpha = freq*asini/cc
         if ecc is None:
             frequency = freq*(x-t0) + alpha*(sin(2*pi*forb*x) - sin(2*pi*forb*t0))
         else:
-            ns = np.arange(1,nmax+1,1)
-            ans,bns = np.array([[ane(n,ecc),bne(n,ecc)] for n in ns]).T
-            ksins = sqrt(ans**2*cos(omega)**2+bns**2*sin(omega)**2)
-            thns = arctan(bns/ans*tan(omega))
-            tau = -np.sum(bns*sin(omega))
+            ns,ksins,thns,tau = kepler.bessel_coefficients(ecc,omega,nmax=nmax)
             frequency = freq*(x-t0) + \
-               alpha*(np.sum(np.array([ksins[i]*sin(2*pi*ns[i]*forb*(x-t0)+thns[i]) for i in range(nmax)]),axis=0)+tau)
+               alpha*(np.dot(sin(2*pi*forb*np.outer(x-t0,ns)+thns),ksins)+tau)
         return ampl * sin(2*pi*(frequency + phase)) + const
     function.__name__ = 'sine_orbit'
-    return Function(function=function, par_names=pnames)
+    
+    if not use_jacobian:
+        return Function(function=function, par_names=pnames)
+    
+    def jacobian(p,x):
+        ampl,freq,phase,const,forb,asini,omega = p[:7]
+        #-- light travel time term and its derivatives to forb, omega and ecc
+        if len(p)==8:
+            delay,ddelay = _light_travel_time(x-t0,forb,omega,p[7],nmax)
+        else:
+            delay = sin(2*pi*forb*x) - sin(2*pi*forb*t0)
+            ddelay = [2*pi*(x*cos(2*pi*forb*x) - t0*cos(2*pi*forb*t0))]
+        alpha = freq*asini/cc
+        arg = 2*pi*(freq*(x-t0) + alpha*delay + phase)
+        dphase = 2*pi*ampl*cos(arg)
+        jac = [sin(arg), dphase*((x-t0) + asini/cc*delay), dphase, np.ones(len(x)),
+               dphase*alpha*ddelay[0], dphase*freq/cc*delay]
+        jac += [dphase*alpha*dd for dd in ddelay[1:]]
+        if len(p)==7:
+            jac.append(np.zeros(len(x)))
+        return -np.array(jac).T
+    return Function(function=function, par_names=pnames, jacobian=jacobian)
 
 #def generic(func_name):
     ##func = model.FUNCTION(function=getattr(evaluate,func_name), par_names)
     #raise NotImplementedError
 
-def power_law():
+def power_law(use_jacobian=True):
     """
     Power law (A,B,C,f0,const)
     
@@ -389,10 +429,23 @@ def power_law():
     pnames = ['ampl','b','c','f0','const']
     function = lambda p, x: p[0] / (1 + (p[1]*(x-p[3]))**p[2]) + p[4]
     function.__name__ = 'power_law'
-    return Function(function=function, par_names=pnames)
+    
+    if not use_jacobian:
+        return Function(function=function, par_names=pnames)
+    
+    def jacobian(p, x):
+        u = p[1]*(x-p[3])
+        w = u**p[2]
+        dw = -p[0] / (1 + w)**2
+        #-- w*log(u) goes to zero for u=0
+        wlogu = np.where(u>0, w*np.log(np.where(u>0,u,1.)), 0.)
+        du = p[2]*u**(p[2]-1)
+        return -np.array([1./(1 + w), dw*du*(x-p[3]), dw*wlogu, -dw*du*p[1],
+                          np.ones(len(x))]).T
+    return Function(function=function, par_names=pnames, jacobian=jacobian)
 
 
-def lorentz():
+def lorentz(use_jacobian=True):
     """
     Lorentz profile (ampl,mu,gamma,const)
     
@@ -401,14 +454,25 @@ def lorentz():
     pnames = ['ampl','mu','gamma','const']
     function = lambda p,x: p[0] / ((x-p[1])**2 + p[2]**2) + p[3]
     function.__name__ = 'lorentz'
-    return Function(function=function, par_names=pnames)
+    
+    if not use_jacobian:
+        return Function(function=function, par_names=pnames)
+    
+    def jacobian(p, x):
+        den = (x-p[1])**2 + p[2]**2
+        return -np.array([1./den, 2*p[0]*(x-p[1])/den**2, -2*p[0]*p[2]/den**2,
+                          np.ones(len(x))]).T
+    return Function(function=function, par_names=pnames, jacobian=jacobian)
 
-def voigt():
+def voigt(use_jacobian=True):
     """
     Voigt profile (ampl,mu,sigma,gamma,const)
     
     z = (x + gamma*i) / (sigma*sqrt(2))
     V = A * Real[cerf(z)] / (sigma*sqrt(2*pi))
+    
+    The jacobian uses the derivative of the complex error function
+    w'(z) = -2z w(z) + 2i/sqrt(pi).
     """
     pnames = ['ampl','mu','sigma','gamma','const']
     def function(p,x):
@@ -416,20 +480,32 @@ def voigt():
         z = (x+1j*p[3])/(p[2]*sqrt(2))
         return p[0]*_complex_error_function(z).real/(p[2]*sqrt(2*pi))+p[4]
     function.__name__ = 'voigt'
-    return Function(function=function, par_names=pnames)
+    
+    if not use_jacobian:
+        return Function(function=function, par_names=pnames)
+    
+    def jacobian(p, x):
+        z = (x-p[1]+1j*p[3])/(p[2]*sqrt(2))
+        w = _complex_error_function(z)
+        dw = -2*z*w + 2j/sqrt(pi)
+        norm = 1./(p[2]*sqrt(2*pi))
+        scale = p[0]*norm/(p[2]*sqrt(2))
+        return -np.array([norm*w.real, -scale*dw.real, -p[0]*norm/p[2]*(w + z*dw).real,
+                          -scale*dw.imag, np.ones(len(x))]).T
+    return Function(function=function, par_names=pnames, jacobian=jacobian)
 
 #}
 
 #{ Combination functions
 
-def multi_sine(n=10):
+def multi_sine(n=10, use_jacobian=True):
     """
     Multiple sines.
     
     @param n: number of sines
     @type n: int
     """
-    return Model(functions=[sine() for i in range(n)])
+    return Model(functions=[sine(use_jacobian=use_jacobian) for i in range(n)])
 
 def multi_blackbody(n=3,**kwargs):
     """
@@ -461,6 +537,37 @@ def _complex_error_function(x):
 
     return cef_value
 
+def _light_travel_time(x,forb,omega,ecc,nmax):
+    """
+    Light travel time term of an eccentric orbit (in units of asini/c), and its
+    derivatives to forb, omega and ecc.
+    
+    This is the Bessel series of L{kepler.bessel_coefficients}, written as
+    sum(a*cos(omega)*sin(phi) + b*sin(omega)*cos(phi)) - sum(b*sin(omega)), with
+    the derivatives of the Bessel coefficients a and b to the eccentricity.
+    """
+    ns = np.arange(1,nmax+1)
+    ne = ns*ecc
+    g = sqrt(1-ecc**2)/ecc
+    ans = 2.*g/ns*jn(ns,ne)
+    bns = 2.*jvp(ns,ne)/ns
+    dans = 2./ns*(-jn(ns,ne)/(ecc**2*sqrt(1-ecc**2)) + g*ns*jvp(ns,ne))
+    dbns = 2.*jvp(ns,ne,2)
+    #-- bessel_coefficients combines both terms with a positive amplitude
+    sign = np.where(ans*cos(omega)<0,-1.,1.)
+    phi = 2*pi*forb*np.outer(x,ns)
+    sinphi,cosphi = sin(phi),cos(phi)
+    
+    delay = np.dot(sinphi,sign*ans)*cos(omega) + np.dot(cosphi,sign*bns)*sin(omega) \
+            - np.sum(bns)*sin(omega)
+    ddelay_forb = 2*pi*x*(np.dot(cosphi,sign*ans*ns)*cos(omega) - \
+                          np.dot(sinphi,sign*bns*ns)*sin(omega))
+    ddelay_omega = -np.dot(sinphi,sign*ans)*sin(omega) + np.dot(cosphi,sign*bns)*cos(omega) \
+                   - np.sum(bns)*cos(omega)
+    ddelay_ecc = np.dot(sinphi,sign*dans)*cos(omega) + np.dot(cosphi,sign*dbns)*sin(omega) \
+                 - np.sum(dbns)*sin(omega)
+    return delay,[ddelay_forb,ddelay_omega,ddelay_ecc]
+
 #}
 
 
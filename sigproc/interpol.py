@@ -1,6 +1,7 @@
 """
 Non-standard interpolation methods.
 """
+import logging
 import numpy as np
 from scipy import ndimage
 import pyfits as pf
@@ -8,6 +9,8 @@ import time
 import itertools
 import pyfinterpol
 
+logger = logging.getLogger("SP.INTERPOL")
+
 def __df_dx(oldx,oldy,index,sharp=False):
     """
     Preliminary estimation of df/dx
@@ -134,7 +137,7 @@ def local_interpolation_ND(newx,oldx,oldy):
     polynomials = []
     
 
-def create_pixeltypegrid(grid_pars,grid_data):
+def create_pixeltypegrid(grid_pars,grid_data,sparse=False):
     """
     Creates pixelgrid and arrays of axis values.
     
@@ -145,12 +148,19 @@ def create_pixeltypegrid(grid_pars,grid_data):
     The grid should be rectangular and complete, i.e. every combination of the unique values in the 
     parameter columns should exist. If not, a nan value will be inserted.
     
+    Grids that are far from rectangular waste most of the memory of the dense
+    pixelgrid on missing models. With C{sparse=True}, only the populated grid
+    points are stored in a L{SparsePixelGrid}, which can be used in the same
+    way in L{interpolate} and L{PixelGridInterpolator}.
+    
     @param grid_pars: Npar x Ngrid array of parameters
     @type grid_pars: array
     @param grid_data: Ndata x Ngrid array of data
     @type grid_data:array
+    @param sparse: only store the populated grid points
+    @type sparse: bool
     @return: axis values and pixelgrid
-    @rtype: array, array
+    @rtype: array, array/SparsePixelGrid
     """
 
     uniques = [np.unique(column, return_inverse=True) for column in grid_pars]
@@ -163,6 +173,10 @@ def create_pixeltypegrid(grid_pars,grid_data):
 
     par_dims   = [len(uv[0]) for uv in uniques]
 
+    if sparse:
+        indices = [uv[1] for uv in uniques]
+        return axis_values, SparsePixelGrid(indices, par_dims, grid_data.T)
+
     par_dims.append(data_dim)
     pixelgrid = np.ones(par_dims)
     
@@ -175,45 +189,243 @@ def create_pixeltypegrid(grid_pars,grid_data):
     pixelgrid[indices] = grid_data.T
     return axis_values, pixelgrid
 
+class SparsePixelGrid(object):
+    """
+    Pixelgrid that only stores the populated grid points.
+    
+    The grid points are identified by their flat index in the full (dense)
+    grid. These keys are kept sorted, so that looking up a set of grid points
+    is a single C{searchsorted}. Grid points that are not populated map to an
+    extra row filled with C{np.inf}, exactly like the dense pixelgrid.
+    
+    >>> grid = SparsePixelGrid([[0,1],[0,1]],[2,2],[[1.,5.],[4.,8.]])
+    >>> print(grid.n_missing)
+    2
+    >>> print(grid.todense()[...,0].tolist())
+    [[1.0, inf], [inf, 4.0]]
+    """
+    def __init__(self, indices, par_dims, data):
+        """
+        Store the populated grid points.
+        
+        @param indices: Npar x Ngrid array of the indices of the grid points on every axis
+        @type indices: array
+        @param par_dims: number of values on every axis
+        @type par_dims: list of int
+        @param data: Ngrid x Ndata array of data
+        @type data: array
+        """
+        data = np.asarray(data)
+        self.shape = tuple(par_dims) + (data.shape[1],)
+        keys = np.ravel_multi_index(tuple(indices), tuple(par_dims))
+        
+        #-- sort the keys, when a grid point is given more than once, the last
+        #   one is kept (as in the dense pixelgrid)
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        last = np.hstack([keys[1:]!=keys[:-1], True])
+        self.keys = keys[last]
+        self.data = np.vstack([data[order[last]], np.inf*np.ones((1,data.shape[1]))])
+        
+        self.n_missing = int(np.prod(par_dims)) - len(self.keys)
+        logger.info('Sparse pixelgrid: %d grid points populated, %d missing'%(len(self.keys),self.n_missing))
+    
+    @property
+    def dtype(self):
+        return self.data.dtype
+    
+    def rows(self, flat):
+        """
+        Look up the rows in C{data} of grid points given by their flat index.
+        
+        @param flat: flat indices of grid points
+        @type flat: array of int
+        @return: row indices, pointing to the C{inf} row for missing grid points
+        @rtype: array of int
+        """
+        rows = self.keys.searchsorted(flat).clip(0,max(len(self.keys)-1,0))
+        if not len(self.keys):
+            return np.zeros_like(rows)
+        return np.where(self.keys[rows]==flat, rows, len(self.keys))
+    
+    def todense(self):
+        """
+        Convert to a dense pixelgrid, as returned by create_pixeltypegrid().
+        
+        @return: dense pixelgrid
+        @rtype: array
+        """
+        flat = np.arange(int(np.prod(self.shape[:-1])))
+        return self.data[self.rows(flat)].reshape(self.shape)
+
+class PixelGridInterpolator(object):
+    """
+    Multilinear interpolator in a grid prepared by create_pixeltypegrid().
+    
+    The axis values, the strides of the flattened grid and the corners of the
+    interpolation hypercube are computed once, at construction time. Every
+    evaluation then needs only one C{searchsorted} per axis, after which all
+    data columns of the pixelgrid are gathered and blended at once, instead of
+    interpolating column per column.
+    
+    Nodes that are not populated in the pixelgrid (C{np.inf}) only propagate
+    to the points that actually depend on them: points that lie exactly on a
+    populated node are not contaminated by their unpopulated neighbours.
+    Points outside the grid get C{fill_value}. After every evaluation, the
+    number of grid corners that were needed but not populated is stored in
+    C{n_missing} (points outside the grid do not count).
+    
+    The pixelgrid can also be a L{SparsePixelGrid}.
+    
+    Example usage:
+    
+    >>> grid_pars = np.array([[1.,1.,2.,2.],[10.,20.,10.,20.]])
+    >>> grid_data = np.array([[1.,2.,3.,4.],[5.,6.,7.,8.]])
+    >>> axis_values, pixelgrid = create_pixeltypegrid(grid_pars,grid_data)
+    >>> interpolator = PixelGridInterpolator(axis_values,pixelgrid)
+    >>> print(interpolator([[1.5,2.],[15.,10.]]).tolist())
+    [[2.5, 3.0], [6.5, 7.0]]
+    """
+    def __init__(self, axis_values, pixelgrid, dtype=None, fill_value=0., chunksize=65536):
+        """
+        Prepare the grid for interpolation.
+        
+        Use C{dtype=np.float32} to halve the memory footprint of the grid and
+        the amount of data that needs to be gathered per evaluation.
+        
+        @param axis_values: list of the (sorted) values on every parameter axis
+        @type axis_values: list of arrays
+        @param pixelgrid: grid with one axis per parameter, and the data on the last axis
+        @type pixelgrid: array or SparsePixelGrid
+        @param dtype: dtype of the interpolated values (defaults to the dtype of the pixelgrid)
+        @type dtype: numpy dtype
+        @param fill_value: value for points outside the grid
+        @type fill_value: float
+        @param chunksize: maximum number of points evaluated in one pass
+        @type chunksize: int
+        """
+        if isinstance(pixelgrid,SparsePixelGrid):
+            self.sparse = pixelgrid
+            table = pixelgrid.data
+        else:
+            self.sparse = None
+            pixelgrid = np.asarray(pixelgrid)
+            table = pixelgrid.reshape(-1,pixelgrid.shape[-1])
+        if dtype is None:
+            dtype = table.dtype if table.dtype.kind=='f' else np.float64
+        self.dtype = np.dtype(dtype)
+        self.axis_values = [np.asarray(av) for av in axis_values]
+        self.shape = pixelgrid.shape[:-1]
+        self.fill_value = fill_value
+        self.chunksize = int(chunksize)
+        self.n_missing = 0
+        
+        #-- one row per grid point, one column per data column
+        self.table = np.ascontiguousarray(table,dtype=self.dtype)
+        self.missing = np.isposinf(self.table).all(axis=1)
+        
+        #-- strides of the parameter axes (in rows of the table)
+        self.strides = np.cumprod((self.shape[1:]+(1,))[::-1])[::-1]
+        
+        #-- corners of the interpolation hypercube: axes with only one value
+        #   are not interpolated
+        self.axes = [i for i,av in enumerate(self.axis_values) if len(av)>1]
+        self.corners = np.array(list(itertools.product([False,True],repeat=len(self.axes))),bool)
+        self.offsets = np.dot(self.corners,self.strides[self.axes]).astype(int)
+    
+    def __call__(self, p):
+        """
+        Interpolate in the grid.
+        
+        @param p: Npar x Ninterpolate array
+        @type p: array
+        @return: Ndata x Ninterpolate array
+        @rtype: array
+        """
+        #-- the type of p is changed to the same type as in axis_values to catch possible rounding errors
+        #   when comparing float64 to float32.
+        values = [np.asarray(val, dtype=av.dtype).ravel() for av,val in zip(self.axis_values,p)]
+        N = len(values[0])
+        
+        output = np.empty((self.table.shape[1],N),self.dtype)
+        self.n_missing = 0
+        for start in range(0,N,self.chunksize):
+            chunk = slice(start,start+self.chunksize)
+            output[:,chunk] = self._evaluate([val[chunk] for val in values]).T
+        return output
+    
+    def _evaluate(self, values):
+        """
+        Gather and blend the grid values surrounding a chunk of points.
+        
+        @param values: Npar arrays with the coordinates of the points
+        @type values: list of arrays
+        @return: Nchunk x Ndata array
+        @rtype: array
+        """
+        N = len(values[0])
+        base = np.zeros(N,int)
+        inside = np.ones(N,bool)
+        weights = []
+        for av, stride, val in zip(self.axis_values, self.strides, values):
+            if len(av)==1:
+                inside &= (val==av[0])
+                continue
+            #-- lower node of the cell containing every point
+            index = np.searchsorted(av,val).clip(1,len(av)-1)
+            lower = av[index-1]
+            weight = np.true_divide(val-lower,av[index]-lower).astype(self.dtype)
+            inside &= (0<=weight) & (weight<=1)
+            base += (index-1)*stride
+            weights.append(weight)
+        
+        #-- blend the corners, only gathering those that contribute
+        output = np.zeros((N,self.table.shape[1]),self.dtype)
+        for corner, offset in zip(self.corners, self.offsets):
+            weight = np.ones(N,self.dtype)
+            for upper, weight_ in zip(corner,weights):
+                weight *= weight_ if upper else (1-weight_)
+            nonzero = weight!=0
+            if nonzero.all():
+                rows = self._rows(base+offset)
+                self.n_missing += (self.missing[rows] & inside).sum()
+                rows = self.table.take(rows,axis=0)
+                rows *= weight[:,None]
+                output += rows
+            elif nonzero.any():
+                keep = np.flatnonzero(nonzero)
+                rows = self._rows(base[keep]+offset)
+                self.n_missing += (self.missing[rows] & inside[keep]).sum()
+                output[keep] += weight[keep,None] * self.table.take(rows,axis=0)
+        
+        output[~inside] = self.fill_value
+        return output
+    
+    def _rows(self, flat):
+        """
+        Rows in the table of grid points given by their flat index.
+        """
+        if self.sparse is None:
+            return flat
+        return self.sparse.rows(flat)
+
 def interpolate(p, axis_values, pixelgrid):
     """
     Interpolates in a grid prepared by create_pixeltypegrid().
     
-    p is an array of parameter arrays
+    p is an array of parameter arrays. For repeated interpolation in the same
+    grid, it is cheaper to create a L{PixelGridInterpolator} once.
     
     @param p: Npar x Ninterpolate array
     @type p: array
     @return: Ndata x Ninterpolate array
     @rtype: array
     """
-    # convert requested parameter combination into a coordinate
-    #p_ = [np.searchsorted(av_,val) for av_, val in zip(axis_values,p)]
-    # we force the values to be inside the grid, to avoid edge-effect rounding
-    # (e.g. 3.099999 is edge, while actually it is 3.1). For values below the
-    # lowest value, this is automatically done via searchsorted (it return 0)
-    # for values higher up, we need to force it
-    p_ = []
-    for av_,val in zip(axis_values,p):
-        indices = np.searchsorted(av_,val)
-        indices[indices==len(av_)] = len(av_)-1
-        p_.append(indices)
-    
-
-    #-- The type of p is changes to the same type as in axis_values to catch possible rounding errors
-    #   when comparing float64 to float32.
-    for i, ax in enumerate(axis_values):
-        p[i] = np.array(p[i], dtype = ax.dtype)
-    
-    #-- Convert requested parameter combination into a coordinate
-    p_ = np.array([np.searchsorted(av_,val) for av_, val in zip(axis_values,p)])
-    lowervals_stepsize = np.array([[av_[p__-1], av_[p__]-av_[p__-1]] \
-                            for av_, p__ in zip(axis_values,p_)])
-    p_coord = (p-lowervals_stepsize[:,0])/lowervals_stepsize[:,1] + np.array(p_)-1
-
-    # interpolate
-    return np.array([ndimage.map_coordinates(pixelgrid[...,i],p_coord, order=1, prefilter=False) \
-                for i in range(np.shape(pixelgrid)[-1])])
-
+    interpolator = PixelGridInterpolator(axis_values, pixelgrid)
+    values = interpolator(p)
+    if interpolator.n_missing:
+        logger.debug('Interpolation needed %d missing grid corners'%(interpolator.n_missing))
+    return values
 
 
 
@@ -60,6 +60,30 @@ def op2func(op):
     "return function for operator nodes"
     return OPERATORS[op.__class__]
 
+# ast nodes that can be compiled to python code objects: pure expressions
+# without attribute access or function definitions
+COMPILABLE_NODES = tuple([ast.Expression, ast.Num, ast.Str, ast.Name, ast.Load,
+                          ast.Tuple, ast.List, ast.BinOp, ast.UnaryOp, ast.BoolOp,
+                          ast.Compare, ast.IfExp, ast.Call, ast.keyword,
+                          ast.Subscript, ast.Index, ast.Slice, ast.ExtSlice] +
+                         list(OPERATORS.keys()))
+
+# code objects of compiled expressions, keyed by expression string
+CODE_CACHE = {}
+
+def compilable(node):
+    "check if an ast node only contains nodes that can be compiled safely"
+    for child in ast.walk(node):
+        if not isinstance(child, COMPILABLE_NODES):
+            return False
+        if isinstance(child, ast.Name) and child.id.startswith('_'):
+            return False
+        if isinstance(child, ast.Call) and (not isinstance(child.func, ast.Name)
+                                            or child.starargs is not None
+                                            or child.kwargs is not None):
+            return False
+    return True
+
 __version__ = '0.3.1'
 
 # holder for 'returned None' from Larch procedure
@@ -240,6 +264,27 @@ class Interpreter:
             print(errmsg, file=self.writer)
             return
 
+    def compile(self, expr):
+        """compile an expression to a python code object, which can be
+        evaluated with the current symtable by evaluate(). Returns None
+        if the expression can only be run by the interpreter. The code
+        objects are cached per expression string."""
+        if expr not in CODE_CACHE:
+            code = None
+            try:
+                node = ast.parse(expr, mode='eval')
+                if compilable(node):
+                    code = compile(node, '<%s>' % expr, 'eval',
+                                   division.compiler_flag, True)
+            except SyntaxError:
+                pass
+            CODE_CACHE[expr] = code
+        return CODE_CACHE[expr]
+
+    def evaluate(self, code):
+        """evaluates a code object made by compile() in the symtable"""
+        return eval(code, {'__builtins__': {}}, self.symtable)
+
     def dump(self, node, **kw):
         "simple ast dumper"
         return ast.dump(node, **kw)
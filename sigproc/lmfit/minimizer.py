@@ -11,7 +11,7 @@ function-to-be-minimized (residual function) in terms of these Parameters.
    <newville@cars.uchicago.edu>
 """
 
-from numpy import (dot, eye, ndarray, ones_like,
+from numpy import (asarray, dot, eye, ndarray, newaxis, ones_like,
                    sqrt, take, transpose, triu)
 from numpy.dual import inv
 from numpy.linalg import LinAlgError
@@ -124,38 +124,60 @@ or set  leastsq_kws['maxfev']  to increase this maximum."""
         self.asteval = Interpreter()
         self.namefinder = NameFinder()
         self.__prepared = False
+        self.__constraints = []
         self.__set_params(params)
         self.prepare_fit()
 
-    def __update_paramval(self, name):
+    def __update_paramval(self, name, code):
         """
-        update parameter value, including setting bounds.
-        For a constrained parameter (one with an expr defined),
-        this first updates (recursively) all parameters on which
-        the parameter depends (using the 'deps' field).
+        update the value of a constrained parameter (one with an
+        expr defined). The compiled code object of the expression is
+        used when available, the ast interpreter otherwise.
        """
-        # Has this param already been updated?
-        # if this is called as an expression dependency,
-        # it may have been!
-        if self.updated[name]:
-            return
         par = self.params[name]
-        if par.expr is not None:
-            for dep in par.deps:
-                self.__update_paramval(dep)
+        if code is not None:
+            par.value = self.asteval.evaluate(code)
+        else:
+            # not compilable: let the interpreter handle it
             par.value = self.asteval.run(par.ast)
             out = check_ast_errors(self.asteval.error)
             if out is not None:
                 self.asteval.raise_exception(None)
         self.asteval.symtable[name] = par.value
-        self.updated[name] = True
 
-    def update_constraints(self):
-        """update all constrained parameters, checking that
-        dependencies are evaluated as needed."""
-        self.updated = dict([(name, False) for name in self.params])
+    def __constraint_order(self):
+        """
+        sort the constrained parameters so that every parameter comes
+        after all parameters on which it depends (using the 'deps'
+        field), and compile their expressions.
+        """
+        order, done, visiting = [], set(), set()
+        def visit(name):
+            par = self.params[name]
+            if par.expr is None or name in done:
+                return
+            if name in visiting:
+                raise MinimizerException(
+                    'Circular constraint for parameter %s' % name)
+            visiting.add(name)
+            for dep in par.deps:
+                visit(dep)
+            visiting.remove(name)
+            done.add(name)
+            order.append((name, self.asteval.compile(par.expr)))
         for name in self.params:
-            self.__update_paramval(name)
+            visit(name)
+        return order
+
+    def update_constraints(self):
+        """update all constrained parameters, in the dependency order
+        determined by prepare_fit."""
+        symtable = self.asteval.symtable
+        for name, par in self.params.items():
+            if par.expr is None:
+                symtable[name] = par.value
+        for name, code in self.__constraints:
+            self.__update_paramval(name, code)
 
     def __residual(self, fvars):
         """
@@ -185,14 +207,19 @@ or set  leastsq_kws['maxfev']  to increase this maximum."""
 
         modified 02-01-2012 by Glenn Jones, Aberystwyth University
         """
+        scale = []
         for varname, val in zip(self.var_map, fvars):
-            # self.params[varname].value = val
-            self.params[varname].from_internal(val)
+            par = self.params[varname]
+            par.value = par.from_internal(val)
+            scale.append(par.scale_gradient(val))
 
         self.nfev = self.nfev + 1
         self.update_constraints()
-        # computing the jacobian
-        return self.jacfcn(self.params, *self.userargs, **self.userkws)
+        # computing the jacobian, and scale it to the internal variables
+        jac = asarray(self.jacfcn(self.params, *self.userargs, **self.userkws))
+        if self.col_deriv:
+            return jac * asarray(scale)[:, newaxis]
+        return jac * asarray(scale)
 
     def __set_params(self, params):
         """ set internal self.params from a Parameters object or
@@ -257,6 +284,7 @@ or set  leastsq_kws['maxfev']  to increase this maximum."""
                 par.name = name
 
         self.nvarys = len(self.vars)
+        self.__constraints = self.__constraint_order()
 
         # now evaluate make sure initial values
         # are used to set values of the defined expressions.
@@ -382,6 +410,7 @@ or set  leastsq_kws['maxfev']  to increase this maximum."""
 
         if lskws['Dfun'] is not None:
             self.jacfcn = lskws['Dfun']
+            self.col_deriv = lskws.get('col_deriv', 0)
             lskws['Dfun'] = self.__jacobian
 
         lsout = scipy_leastsq(self.__residual, self.vars, **lskws)
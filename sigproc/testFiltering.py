@@ -0,0 +1,41 @@
+"""
+Unit test covering sigproc.filtering.py
+"""
+import numpy as np
+from ivs.sigproc import filtering
+
+import unittest
+
+class FilterEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(2)
+        self.x_equi = np.linspace(0, 100, 2000)
+        self.x_rand = np.sort(np.random.uniform(0, 100, 2000))
+        self.x_template = np.linspace(-1, 101, 333)
+
+    def compareEngines(self, ftype, **kwargs):
+        for x in [self.x_equi, self.x_rand]:
+            y = np.sin(2*np.pi*x/20.) + np.random.normal(size=len(x))*0.3
+            #-- add some outliers
+            y[::97] += 5
+            for template in [{}, dict(x_template=self.x_template)]:
+                kwargs.update(template)
+                out1 = filtering.filter_signal(x, y, ftype, engine='numpy', **kwargs)
+                out2 = filtering.filter_signal(x, y, ftype, engine='python', **kwargs)
+                self.assertEqual(len(out1), len(out2))
+                for i, (col1, col2) in enumerate(zip(out1, out2)):
+                    msg = '%s filter: output %d differs (template=%s)'%(ftype, i, bool(template))
+                    self.assertTrue(np.allclose(col1, col2, rtol=0, atol=1e-12, equal_nan=True), msg=msg)
+
+    def testGauss(self):
+        """ sigproc.filtering.filter_signal gauss numpy against python engine """
+        self.compareEngines('gauss', sigma=1.)
+
+    def testBox(self):
+        """ sigproc.filtering.filter_signal box numpy against python engine """
+        self.compareEngines('box', window_width=2.)
+
+    def testINL(self):
+        """ sigproc.filtering.filter_signal inl numpy against python engine """
+        self.compareEngines('inl', window_width=2.)
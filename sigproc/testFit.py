@@ -206,7 +206,15 @@ class TestCase3Minimizer(FitTestCase):
         msg = 'attr jacobian is not set'
         self.assertTrue(hasattr(result, 'jacobian'), msg=msg)
         
+        msg = 'jacobian of funclib.sine is not used'
+        self.assertTrue(result.jacobian != None, msg=msg)
+        jac = result.jacobian(self.parameters, self.x, self.y, weights=2*self.weights)
+        self.assertEqual(jac.shape, (len(self.x), 4), msg=msg)
+        
         msg = 'jacobian should be None in this case'
+        result = fit.minimize(self.x, self.y, funclib.sine(use_jacobian=False), err=self.errors)
+        self.assertTrue(result.jacobian == None, msg=msg)
+        result = fit.minimize(self.x, self.y, self.model, err=self.errors, engine='nelder')
         self.assertTrue(result.jacobian == None, msg=msg)
     
     @unittest.skipIf(noMock, "Mock not installed")
@@ -428,6 +436,63 @@ class TestCase4FittingFunction(FitTestCase):
         self.assertEqual(params['ampl'].mcerr, mcerrors['ampl'], msg=msg)
         self.assertEqual(params['freq'].mcerr, mcerrors['freq'], msg=msg)
         self.assertEqual(params['phase'].mcerr, mcerrors['phase'], msg=msg)
+    
+    def test6mc_error_parallel(self):
+        """ I sigproc.fit.Minimizer Function calculate_MC_error in parallel """
+        result = fit.minimize(self.x, self.y, self.model)
+        
+        mcerrors1 = result.calculate_MC_error(errors=0.5, points=40, seed=11,
+                                              verbose=False)
+        msg = 'MC values are not stored as a (points x parameters) array'
+        self.assertEqual(result.mc_values.shape, (40, 3), msg=msg)
+        
+        mcerrors2 = result.calculate_MC_error(errors=0.5, points=40, seed=11,
+                                              threads=2, verbose=False)
+        msg = 'Seeded MC errors depend on the number of processes'
+        self.assertArrayAlmostEqual(mcerrors1, mcerrors2, places=10, msg=msg)
+    
+    def test7grid_minimize_parallel(self):
+        """ I sigproc.fit.Minimizer Function grid_minimize in parallel """
+        np.random.seed(3)
+        fitters1, newmodels1, chisqrs1 = fit.grid_minimize(self.x, self.y, self.model,
+                                            parameters=self.pnames, points=20, 
+                                            return_all=True, verbose=False)
+        np.random.seed(3)
+        fitters2, newmodels2, chisqrs2 = fit.grid_minimize(self.x, self.y, self.model,
+                                            parameters=self.pnames, points=20, threads=2,
+                                            return_all=True, verbose=False)
+        
+        msg = 'Parallel grid minimize gives different results'
+        self.assertEqual(len(fitters2), 20, msg=msg)
+        self.assertArrayAlmostEqual(chisqrs1, chisqrs2, places=6, msg=msg)
+        
+        np.random.seed(3)
+        fitters3, newmodels3, chisqrs3 = fit.grid_minimize(self.x, self.y, self.model,
+                                            parameters=self.pnames, points=20, threads=2,
+                                            unique=1e-4, prune=3., return_all=True,
+                                            verbose=False)
+        
+        msg = 'Duplicate or pruned fits are not removed'
+        self.assertTrue(len(fitters3) < 20, msg=msg)
+        self.assertEqual(len(newmodels3), len(chisqrs3), msg=msg)
+        self.assertAlmostEqual(chisqrs3[0], chisqrs1[0], places=6, msg=msg)
+
+    def test8ci_interval_parallel(self):
+        """ I sigproc.fit.Minimizer Function calculate_CI and calculate_CI_2D in parallel """
+        result = fit.minimize(self.x, self.y, self.model)
+
+        ci1 = result.calculate_CI(parameters=['ampl', 'freq'], sigmas=[0.674])
+        ci2 = result.calculate_CI(parameters=['ampl', 'freq'], sigmas=[0.674], threads=2)
+        msg = 'Parallel CI gives different results'
+        self.assertArrayAlmostEqual(ci1['ampl'][0.674], ci2['ampl'][0.674], places=8, msg=msg)
+        self.assertArrayAlmostEqual(ci1['freq'][0.674], ci2['freq'][0.674], places=8, msg=msg)
+
+        x1, y1, grid1 = result.calculate_CI_2D(xpar='ampl', ypar='freq', res=6, ctype='chi2')
+        x2, y2, grid2 = result.calculate_CI_2D(xpar='ampl', ypar='freq', res=6, ctype='chi2',
+                                               threads=2)
+        msg = 'Parallel 2D CI gives different results'
+        self.assertEqual(grid2.shape, (6, 6), msg=msg)
+        self.assertArrayAlmostEqual(grid1.ravel(), grid2.ravel(), places=8, msg=msg)
 
 class TestCase5IntegrationJacobian(FitTestCase):
     """
@@ -503,7 +568,7 @@ class TestCase5IntegrationJacobian(FitTestCase):
         val = self.model.parameters.value
         err = self.model.parameters.stderr
         valr = [2.4272, 1.2912, 0.4928]
-        errr = [0.4345, 0.3796, 0.0921]
+        errr = [0.0665, 0.0772, 0.0297]
         
         print self.model.param2str(accuracy=4, output='result')
         
@@ -670,7 +735,117 @@ class TestCase7Funclib(unittest.TestCase):
         
         #-- power_law
         check_function('power_law', [2.,3.,1.5,0.0,0.5], [0.24, 2.0, 7.32], [1.74151, 0.62741, 0.51925])
-    
+
+    def testFunclibJacobians(self):
+        """ sigproc.funclib: analytic jacobians """
+        def check_jacobian(function, param, x):
+            param = np.array(param, dtype=float)
+            jac = function.jacobian(list(param), x)
+            for i in range(len(param)):
+                dp = np.zeros(len(param))
+                dp[i] = 1e-6 * max(abs(param[i]), 1e-3)
+                numerical = -(function.function(list(param+dp), x) - \
+                              function.function(list(param-dp), x)) / (2*dp[i])
+                msg = function.function.__name__ + " jacobian Failed for parameter %i"%(i)
+                self.assertTrue(np.allclose(jac[:,i], numerical, rtol=1e-5, atol=1e-5), msg=msg)
+
+        x = np.linspace(0.1, 10, 200)
+        check_jacobian(funclib.sine(), [1.3, 0.7, 0.2, 0.1], x)
+        check_jacobian(funclib.lorentz(), [1.3, 4., 0.5, 0.1], x)
+        check_jacobian(funclib.power_law(), [2., 3., 1.5, 0.05, 0.5], x)
+        check_jacobian(funclib.voigt(), [20., 5., 1.5, 0.7, 0.5], x)
+        check_jacobian(funclib.kepler_orbit(), [3.1, 0.4, 0.3, 2.5, 20., 3.], x)
+        check_jacobian(funclib.sine_orbit(t0=0.5), [1.3, 3.7, 0.2, 0.1, 0.05, 2., 0.5], x)
+        check_jacobian(funclib.sine_orbit(t0=0.5), [1.3, 3.7, 0.2, 0.1, 0.05, 2., 2.5, 0.3], x)
+
+        #-- a multi-frequency fit needs far less function evaluations with the jacobian
+        np.random.seed(5)
+        t = np.sort(np.random.uniform(0, 100, 1000))
+        freqs, ampls, phases = [1.23, 2.59, 3.89], [5., 3., 1.], [0.1, 0.5, 0.7]
+        y = np.sum([a*np.sin(2*np.pi*(f*t+p)) for a, f, p in zip(ampls, freqs, phases)], axis=0)
+        y = y + np.random.normal(scale=0.5, size=len(t))
+        results = []
+        for use_jacobian in [False, True]:
+            model = funclib.multi_sine(n=3, use_jacobian=use_jacobian)
+            values = np.ravel([[a*1.05, f+1e-4, p+0.01, 0.] for a, f, p in \
+                               zip(ampls, freqs, phases)])
+            for name, value in zip(model.par_names, values):
+                model.update_parameter(parameter=name, value=value)
+            results.append(fit.minimize(t, y, model))
+
+        msg = 'multi_sine fit with jacobian does not converge to the same solution'
+        self.assertAlmostEqual(results[0].chisqr, results[1].chisqr, places=5, msg=msg)
+        msg = 'multi_sine fit with jacobian needs more function evaluations'
+        self.assertTrue(results[1].nfev < results[0].nfev, msg=msg)
+
+        #-- with a custom residual function, the fit is the same as without jacobian
+        resfunc = lambda synth, data, weights=None, errors=None: (data-synth)/errors
+        results = []
+        for use_jacobian in [False, True]:
+            model = funclib.sine(use_jacobian=use_jacobian)
+            for name, value in zip(model.par_names, [5.1, 1.23+1e-4, 0.11, 0.]):
+                model.update_parameter(parameter=name, value=value)
+            results.append(fit.minimize(t, y, model, errors=0.25*np.ones_like(t), resfunc=resfunc))
+        msg = 'analytic jacobian is used with a custom residual function'
+        self.assertTrue(results[1].jacobian == None, msg=msg)
+        self.assertAlmostEqual(results[0].chisqr, results[1].chisqr, places=8, msg=msg)
+        stderrs = [[par.stderr for par in result.model.parameters.values()] for result in results]
+        self.assertTrue(np.allclose(stderrs[0], stderrs[1], rtol=1e-6), msg=msg)
+
+class TestCase8LinearFit(FitTestCase):
+
+    def testHarmonicFit(self):
+        """ sigproc.fit sine and e_sine with a reused HarmonicFit """
+        np.random.seed(7)
+        times = np.sort(np.random.uniform(0, 50, 400))
+        freqs = [1.23, 2.59, 0.71]
+        signal = 1.5 + np.sum([np.sin(2*np.pi*(f*times + 0.1*i)) for i, f in enumerate(freqs)], axis=0)
+        signal += np.random.normal(scale=0.2, size=len(times))
+
+        #-- solve the same problem directly with all basisfunctions
+        A = np.column_stack([np.ones(len(times))] + \
+                            [np.sin(2*np.pi*f*times) for f in freqs] + \
+                            [np.cos(2*np.pi*f*times) for f in freqs])
+        p = np.linalg.lstsq(A, signal, rcond=-1)[0]
+        chisq = np.sum((signal - np.dot(A, p))**2)
+        covariance = np.linalg.inv(np.dot(A.T, A)) * chisq / (len(times) - A.shape[1])
+
+        fitter = fit.HarmonicFit(times, signal)
+        for i in range(1, len(freqs)+1):
+            pars = fit.sine(times, signal, freqs[:i], fitter=fitter)
+        e_pars = fit.e_sine(times, signal, pars, fitter=fitter)
+
+        msg = 'Incremental harmonic fit is not correct'
+        self.assertEqual(fitter.freq, freqs, msg=msg)
+        self.assertAlmostEqual(pars['const'][0], p[0], places=8, msg=msg)
+        self.assertArrayAlmostEqual(pars['ampl'], np.hypot(p[1:4], p[4:]), places=8, msg=msg)
+        self.assertArrayAlmostEqual(2*np.pi*pars['phase'], np.arctan2(p[4:], p[1:4]), places=8, msg=msg)
+
+        msg = 'Error on the constant is not correct'
+        self.assertAlmostEqual(e_pars['e_const'][0], np.sqrt(covariance[0,0]), places=8, msg=msg)
+        e_pars2 = fit.e_sine(times, signal, pars)
+        self.assertArrayAlmostEqual(e_pars2['e_const'], e_pars['e_const'], places=10, msg=msg)
+
+        msg = 'Fitter of other data is reused'
+        pars2 = fit.sine(times, 2*signal, freqs, fitter=fitter)
+        self.assertArrayAlmostEqual(pars2['ampl'], 2*pars['ampl'], places=8, msg=msg)
+        pars2 = fit.sine(times, signal, freqs, t0=10., fitter=fitter)
+        self.assertFalse(np.allclose(pars2['phase'], pars['phase']), msg=msg)
+
+    def testCorrelationFactor(self):
+        """ sigproc.fit get_correlation_factor and get_run_lengths """
+        residus = np.array([1., 2., -1., 3., 4., 5., -2., 0., 0.])
+        lengths, histogram = fit.get_run_lengths(residus)
+        
+        msg = 'Run lengths are not correct'
+        self.assertArrayEqual(lengths, [2, 1, 3, 1, 2], msg=msg)
+        self.assertArrayEqual(histogram, [0, 2, 2, 1], msg=msg)
+        
+        msg = 'Correlation factor is not correct'
+        rho, groups = fit.get_correlation_factor(residus, full_output=True)
+        self.assertEqual(groups, [2, 0, 2, 0, 1], msg=msg)
+        self.assertAlmostEqual(rho, 1.0, places=10, msg=msg)
+
 #if __name__ == '__main__':
     #unittest.main() 
   
@@ -0,0 +1,97 @@
+"""
+Unit test covering sigproc.interpol.py
+"""
+import numpy as np
+from scipy import ndimage
+from ivs.sigproc import interpol
+
+import unittest
+
+def map_coordinates_interpolate(p, axis_values, pixelgrid):
+    """
+    Reference: interpolation in the pixelgrid with ndimage.map_coordinates
+    """
+    p = [np.array(val, dtype=av.dtype) for av, val in zip(axis_values, p)]
+    p_ = np.array([np.searchsorted(av, val) for av, val in zip(axis_values, p)])
+    lowervals_stepsize = np.array([[av[p__-1], av[p__]-av[p__-1]] \
+                            for av, p__ in zip(axis_values, p_)])
+    p_coord = (p-lowervals_stepsize[:,0])/lowervals_stepsize[:,1] + p_-1
+    return np.array([ndimage.map_coordinates(pixelgrid[...,i], p_coord, order=1, prefilter=False) \
+                for i in range(np.shape(pixelgrid)[-1])])
+
+class PixelGridInterpolatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1114)
+        axes = [np.array([1., 2., 4., 5.]), np.array([10., 20., 25.]), np.array([0., 0.5, 1., 3., 4.])]
+        grid = np.array([g.ravel() for g in np.meshgrid(*axes, indexing='ij')])
+        data = np.random.uniform(size=(6, grid.shape[1]))
+        self.axis_values, self.pixelgrid = interpol.create_pixeltypegrid(grid, data)
+        self.points = np.array([np.random.uniform(av[0], av[-1], 500) for av in axes])
+
+    def testMapCoordinates(self):
+        """ sigproc.interpol.PixelGridInterpolator against map_coordinates """
+        interpolator = interpol.PixelGridInterpolator(self.axis_values, self.pixelgrid, chunksize=128)
+        values = interpolator(self.points)
+        reference = map_coordinates_interpolate(self.points, self.axis_values, self.pixelgrid)
+        self.assertEqual(values.shape, (6, 500))
+        self.assertTrue(np.allclose(values, reference, rtol=0, atol=1e-13))
+        self.assertEqual(interpolator.n_missing, 0)
+        #-- the grid nodes themselves are reproduced
+        self.assertTrue(np.allclose(interpolator([[2.], [25.], [0.5]])[:,0], self.pixelgrid[1,2,1]))
+
+    def testFillValue(self):
+        """ sigproc.interpol.PixelGridInterpolator outside the grid """
+        interpolator = interpol.PixelGridInterpolator(self.axis_values, self.pixelgrid, fill_value=-1.)
+        points = [[0.5, 6., 3., 3.], [15., 15., 30., 9.], [1., 1., 1., 1.]]
+        values = interpolator(points)
+        self.assertTrue((values == -1).all())
+        points = [[1., 5., 3.], [10., 25., 20.], [0., 4., 2.]]
+        values = interpolator(points)
+        self.assertTrue((values != -1).all())
+
+    def testMissingNode(self):
+        """ sigproc.interpol.PixelGridInterpolator next to an unpopulated node """
+        pixelgrid = self.pixelgrid.copy()
+        pixelgrid[1,1,1] = np.inf
+        interpolator = interpol.PixelGridInterpolator(self.axis_values, pixelgrid, fill_value=-1.)
+        #-- exactly on the populated neighbours of the missing node
+        values = interpolator([[1., 2., 4.], [20., 10., 20.], [0.5, 0.5, 0.5]])
+        self.assertTrue(np.allclose(values, pixelgrid[[0,1,2],[1,0,1],1].T, rtol=0, atol=1e-15))
+        self.assertEqual(interpolator.n_missing, 0)
+        #-- inside a cell with the missing node as one of its corners
+        values = interpolator([[1.5], [15.], [0.25]])
+        self.assertFalse(np.isfinite(values).any())
+        self.assertEqual(interpolator.n_missing, 1)
+        #-- outside the grid, next to the missing node
+        values = interpolator([[1.5], [15.], [-0.25]])
+        self.assertTrue((values == -1).all())
+        self.assertEqual(interpolator.n_missing, 0)
+
+class SparsePixelGridTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1114)
+        axes = [np.array([1., 2., 4., 5.]), np.array([10., 20., 25.]), np.array([0., 0.5, 1., 3., 4.])]
+        grid = np.array([g.ravel() for g in np.meshgrid(*axes, indexing='ij')])
+        data = np.random.uniform(size=(6, grid.shape[1]))
+        #-- remove a part of the grid
+        keep = grid[0] + grid[2] < 7.
+        self.grid, self.data = grid[:,keep], data[:,keep]
+        self.n_removed = (~keep).sum()
+        self.points = np.array([np.random.uniform(av[0], av[-1], 500) for av in axes])
+
+    def testSparseDense(self):
+        """ sigproc.interpol.SparsePixelGrid against the dense pixelgrid """
+        axis_values, dense = interpol.create_pixeltypegrid(self.grid, self.data)
+        axis_values_, sparse = interpol.create_pixeltypegrid(self.grid, self.data, sparse=True)
+        self.assertEqual(sparse.n_missing, self.n_removed)
+        self.assertTrue(np.array_equal(sparse.todense(), dense))
+
+        interpolator1 = interpol.PixelGridInterpolator(axis_values, dense)
+        interpolator2 = interpol.PixelGridInterpolator(axis_values_, sparse)
+        values1 = interpolator1(self.points)
+        values2 = interpolator2(self.points)
+        self.assertTrue(np.array_equal(values1, values2))
+        self.assertEqual(interpolator1.n_missing, interpolator2.n_missing)
+        self.assertTrue(interpolator1.n_missing > 0)
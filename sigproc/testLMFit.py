@@ -228,6 +228,31 @@ class TestCase4Minimizer(FitTestCase):
         self.assertFalse(mini.lbfgsb.called, msg=msg)
         self.assertTrue(mini.fmin.called, msg=msg)
 
+    def test2update_constraints(self):
+        """ sigproc.lmfit.minimize.Minimizer(): update_constraints() """
+        pars = Parameters()
+        pars.add('a', value=1.0)
+        pars.add('b', value=2.0)
+        pars.add('d', expr='2*c + sqrt(a)')
+        pars.add('c', expr='a + b/3 if a > 0 else -b')
+        pars.add('e', expr='b.real')
+        mini = Minimizer(lambda p: np.zeros(3), pars)
+
+        pars['a'].value = 4.0
+        mini.update_constraints()
+        msg = "Constraints are not evaluated in the order of their dependencies"
+        self.assertAlmostEqual(pars['c'].value, 4.0 + 2.0/3, places=10, msg=msg)
+        self.assertAlmostEqual(pars['d'].value, 2*(4.0 + 2.0/3) + 2.0, places=10, msg=msg)
+        msg = "Constraints that cannot be compiled are not interpreted"
+        self.assertEqual(pars['e'].value, 2.0, msg=msg)
+
+        pars = Parameters()
+        pars.add('a', value=1.0)
+        pars.add('b', expr='c')
+        pars.add('c', expr='b')
+        msg = "Circular constraints are not detected"
+        self.assertRaises(lmfit.MinimizerException, Minimizer, lambda p: np.zeros(3), pars)
+
 class TestCase5Integration(FitTestCase):
     
     @classmethod  
@@ -150,6 +150,7 @@ or
 Author: Pieter Degroote
 """
 import logging
+import inspect
 import numpy as np
 import pylab as pl
 from ivs.sigproc import fit
@@ -166,7 +167,7 @@ logger = logging.getLogger("TS.FREQANAL")
 def find_frequency(times,signal,method='scargle',model='sine',full_output=False,
             optimize=0,max_loops=20, scale_region=0.1, scale_df=0.20, model_kwargs=None,
             correlation_correction=True,prewhiteningorder_snr=False,
-            prewhiteningorder_snr_window=1.,**kwargs):
+            prewhiteningorder_snr_window=1.,pergram=None,**kwargs):
     """
     Find one frequency, automatically going to maximum precision and return
     parameters & error estimates.
@@ -193,6 +194,10 @@ def find_frequency(times,signal,method='scargle',model='sine',full_output=False,
     C{prewhiteningorder_snr} to True. In this case, the noise spectrum is calculated 
     using a convolution with a C{prewhiteningorder_snr_window} wide box.
     
+    If the periodogram is already computed, you can pass it as a tuple
+    (frequencies, amplitudes) via C{pergram}: it is then used instead of the
+    first periodogram calculation.
+    
     Possible extra keywords: see definition of the used periodogram function.
     
     B{Warning}: the timeseries must be B{sorted in time} and B{cannot contain
@@ -252,8 +257,11 @@ def find_frequency(times,signal,method='scargle',model='sine',full_output=False,
         if freq_diff==np.inf and not isinstance(method,str):
             method_ = method[1]
             method = method[0]  # override method to be a string the next time
-        #-- calculate periodogram
-        freqs,ampls = getattr(pergrams,method)(times,signal,**method_kwargs)
+        #-- calculate periodogram (or take the one that was given)
+        if pergram is not None and counter==0:
+            freqs,ampls = pergram
+        else:
+            freqs,ampls = getattr(pergrams,method)(times,signal,**method_kwargs)
         f0,fn,df = freqs[0],freqs[-1],freqs[1]-freqs[0]
         #-- now use the second method for the zoom-ins from now on
         if freq_diff==np.inf and not isinstance(method,str):
@@ -372,6 +380,11 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
     residuals = signal.copy()
     frequencies = []
     stop_criteria = []
+    #-- a harmonic fit of the original signal is extended with every new
+    #   frequency, instead of fitting all frequencies again
+    model_kwargs = dict()
+    if model=='sine':
+        model_kwargs['fitter'] = fit.HarmonicFit(times,signal)
     while maxiter:
         #-- compute the next frequency from the residuals
         params,pergram,this_fit = find_frequency(times,residuals,method=method,
@@ -381,7 +394,7 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
         
         #-- do the fit including all frequencies
         frequencies.append(params['freq'][-1])
-        allparams = getattr(fit,model)(times,signal,frequencies)
+        allparams = getattr(fit,model)(times,signal,frequencies,**model_kwargs)
         
         #-- if there's a need to optimize, optimize the last n parameters
         if optimize>0:
@@ -414,7 +427,7 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
                 break
         
     #-- calculate the errors
-    e_allparams = getattr(fit,'e_'+model)(times,signal,allparams,correlation_correction=correlation_correction)
+    e_allparams = getattr(fit,'e_'+model)(times,signal,allparams,correlation_correction=correlation_correction,**model_kwargs)
     
     allparams = numpy_ext.recarr_join(allparams,e_allparams)
     if stopcrit is not None:
@@ -429,7 +442,8 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
     
     
 def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
-                subs_av=True,full_output=False,**kwargs):
+                subs_av=True,full_output=False,vectorize=True,chunksize=500,
+                **kwargs):
     """
     Compute a 2D periodogram.
     
@@ -456,6 +470,13 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
     C{f0=frequency} and C{fn=frequency+df} with C{df} the size of the frequency
     step.
     
+    All wavelength bins share the same time points. Therefore, if the Scargle
+    periodogram is used without weights, the periodograms of all bins are
+    computed at once with L{pergrams.scargle_matrix} (set C{vectorize=False} to
+    compute them bin per bin). The frequency grid is then processed in chunks
+    of C{chunksize} frequencies, to limit the memory usage. Set C{single=True}
+    to accumulate the periodograms in single precision.
+    
     B{Example usage}: first we generate some variable line profiles. In this case,
     this is just a radial velocity variation
     
@@ -508,6 +529,18 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
     else:
         matrix_av = 0.
     
+    #-- compute the periodograms of all wavelength bins at once if possible:
+    #   this is only the case if the periodogram keywords are all understood
+    #   by scargle_matrix
+    pergram_keys = set(kwargs.keys()) - set(inspect.getargspec(find_frequency)[0])
+    vectorize = vectorize and weights_2d is None \
+                 and kwargs.get('method','scargle')=='scargle' \
+                 and pergram_keys <= set(['f0','fn','df','norm','nyq_stat','single'])
+    if vectorize:
+        pergram_kwargs = dict([(key,kwargs[key]) for key in pergram_keys])
+        freqs,ampls = pergrams.scargle_matrix(x,matrix,chunksize=chunksize,**pergram_kwargs)
+        logger.debug('Computed %d periodograms simultaneously'%(ampls.shape[1]))
+    
     #-- prepare output of sine-parameters
     params = []
     freq_spectrum = []
@@ -518,6 +551,8 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
         if weights_2d is not None:
             weights = weights_2d[:,iwave]
             kwargs['weights'] = weights
+        if vectorize:
+            kwargs['pergram'] = freqs,ampls[:,iwave]
                 
         #-- make sure output is always a tuple, in case full output was asked
         #   we don't want iterative zoom in so set scale_df=0
@@ -124,6 +124,7 @@ Plot it:
 import logging
 import numpy as np
 from scipy import optimize
+from scipy.special import jn
 from ivs.units import conversions
 from ivs.units.constants import *
 from ivs.coordinates import vectors
@@ -344,11 +345,105 @@ def orbit_on_sky(times,parameters,distance=None,component='primary'):
     
 
 
-def true_anomaly(M,e,itermax=8):
+def eccentric_anomaly(M,e,itermax=8,tol=1e-12,table=None):
+    """
+    Vectorized solution of Kepler's equation M = E - e sin(E).
+    
+    M and e can be scalars or arrays (they are broadcasted against each other).
+    Convergence is tracked per element: only those elements for which the
+    Newton correction is still larger than C{tol} are iterated further, so a
+    few badly conditioned points (e close to 1, M close to 0) do not slow down
+    the whole array.
+    
+    The starting value is taken from Markley (1995, Celestial Mechanics 63,
+    101), which is accurate to machine precision for all but the most
+    extreme eccentricities, so that the Newton iterations are mostly only a
+    safety net. Alternatively, if the eccentricity is fixed (e.g. when
+    scanning a grid of periods for a given e), you can precompute a table of
+    E(M) with L{kepler_table} and pass it via C{table}: the starting value is
+    then linearly interpolated from that table.
+    
+    The returned eccentric anomaly is continuous with M, i.e. it is not reduced
+    to the interval [-pi,pi].
+    
+    >>> E = eccentric_anomaly(np.array([0.,1.,2.,3.]),0.5)
+    >>> print np.allclose(E-0.5*np.sin(E),[0.,1.,2.,3.])
+    True
+    
+    @parameter M: mean anomaly (radians)
+    @type M: float or array
+    @parameter e: eccentricity
+    @type e: float or array
+    @keyword itermax: maximum number of Newton iterations
+    @type itermax: integer
+    @keyword tol: absolute tolerance on E (radians)
+    @type tol: float
+    @keyword table: precomputed table from L{kepler_table} (for scalar e only)
+    @type table: array
+    @return: eccentric anomaly
+    @rtype: float or array
+    """
+    scalar = np.isscalar(M) and np.isscalar(e)
+    M,e = np.broadcast_arrays(np.asarray(M,float),np.asarray(e,float))
+    shape = M.shape
+    M,e = M.ravel(),e.ravel()
+    #-- reduce the mean anomaly to [-pi,pi], but remember the offset
+    offset = 2*np.pi*np.floor((M+np.pi)/(2*np.pi))
+    m = M - offset
+    
+    #-- starting value: either from the table or from Markley's approximation
+    if table is not None:
+        size = len(table)-1
+        x = (m+np.pi)*(size/(2*np.pi))
+        index = np.clip(x.astype(int),0,size-1)
+        E = table[index] + (table[index+1]-table[index])*(x-index)
+    else:
+        E = __markley__(m,e)
+    
+    #-- Newton-Raphson iterations, only on the elements that did not converge
+    active = np.arange(len(m))
+    for i in range(itermax):
+        Ea,ea = E[active],e[active]
+        dE = (m[active]-Ea+ea*np.sin(Ea))/(1.-ea*np.cos(Ea))
+        E[active] = Ea + dE
+        active = active[np.abs(dE)>tol]
+        if not len(active):
+            break
+    else:
+        logger.debug('Kepler equation did not converge for %d points'%(len(active)))
+    
+    E = E + offset
+    if scalar:
+        return E[0]
+    return E.reshape(shape)
+
+
+def kepler_table(e,size=1024):
+    """
+    Precompute a table of eccentric anomalies for a fixed eccentricity.
+    
+    The table samples E(M) on a regular grid of C{size+1} mean anomalies
+    between -pi and pi, and can be passed to L{eccentric_anomaly} or
+    L{true_anomaly} to seed the solver. This is worthwhile if Kepler's
+    equation needs to be solved many times for the same eccentricity.
+    
+    @parameter e: eccentricity
+    @type e: float
+    @parameter size: number of intervals in the table
+    @type size: integer
+    @return: eccentric anomalies on the grid
+    @rtype: array
+    """
+    M = np.linspace(-np.pi,np.pi,size+1)
+    return eccentric_anomaly(M,e,itermax=20)
+
+
+def true_anomaly(M,e,itermax=8,tol=1e-12,table=None):
     """
     Calculation of true and eccentric anomaly in Kepler orbits.
     
-    M is the phase of the star, e is the eccentricity
+    M is the phase of the star, e is the eccentricity. The eccentric anomaly
+    is computed with L{eccentric_anomaly}.
     
     See p.39 of Hilditch, 'An Introduction To Close Binary Stars'
     
@@ -358,28 +453,71 @@ def true_anomaly(M,e,itermax=8):
     @type e: float
     @keyword itermax: maximum number of iterations
     @type itermax: integer
+    @keyword tol: absolute tolerance on the eccentric anomaly
+    @type tol: float
+    @keyword table: precomputed table from L{kepler_table}
+    @type table: array
     @return: eccentric anomaly (E), true anomaly (theta)
     @rtype: float,float
     """
-    #-- initial value
-    Fn = M + e*np.sin(M) + e**2/2.*np.sin(2*M)
-    #-- iterative solving of the transcendent Kepler's equation
-    for i in range(itermax):
-        F = Fn
-        Mn = F-e*np.sin(F)
-        Fn = F+(M-Mn)/(1.-e*np.cos(F))
-        keep = F!=0 #-- take care of zerodivision
-        if hasattr(F,'__iter__'):
-            if np.all(abs((Fn-F)[keep]/F[keep])<0.00001):
-                break
-        elif (abs((Fn-F)/F)<0.00001):
-            break
+    Fn = eccentric_anomaly(M,e,itermax=itermax,tol=tol,table=table)
     #-- relationship between true anomaly (theta) and eccentric
     #   anomalie (Fn)
     true_an = 2.*np.arctan(np.sqrt((1.+e)/(1.-e))*np.tan(Fn/2.))
     return Fn,true_an
 
 
+def bessel_coefficients(e,omega,nmax=10):
+    """
+    Coefficients of the Bessel series expansion of the light travel time
+    in an eccentric orbit.
+    
+    The light travel time delay (in units of asini/c) is then given by
+    
+    sum(ksins*sin(2*pi*ns*forb*t + thns)) + tau
+    
+    @parameter e: eccentricity
+    @type e: float
+    @parameter omega: longitude of periastron (radians)
+    @type omega: float
+    @parameter nmax: number of terms in the series
+    @type nmax: integer
+    @return: orders ns, amplitudes ksins, phases thns, constant term tau
+    @rtype: array,array,array,float
+    """
+    ns = np.arange(1,nmax+1)
+    ans = 2.*np.sqrt(1-e**2)/e/ns*jn(ns,ns*e)
+    bns = 1./ns*(jn(ns-1,ns*e)-jn(ns+1,ns*e))
+    ksins = np.sqrt(ans**2*np.cos(omega)**2+bns**2*np.sin(omega)**2)
+    thns = np.arctan(bns/ans*np.tan(omega))
+    tau = -np.sum(bns*np.sin(omega))
+    return ns,ksins,thns,tau
+
+
+def __markley__(M,e):
+    """
+    Starting value for Kepler's equation after Markley (1995).
+    
+    M must be reduced to [-pi,pi]. The cubic approximation is refined with a
+    single fifth order correction step.
+    """
+    pi2 = np.pi**2
+    alpha = (3*pi2 + 1.6*np.pi*(np.pi-np.abs(M))/(1.+e))/(pi2-6.)
+    d = 3*(1-e) + alpha*e
+    q = 2*alpha*d*(1-e) - M**2
+    r = 3*alpha*d*(d-1+e)*M + M**3
+    w = (np.abs(r) + np.sqrt(np.abs(q**3 + r**2)))**(2./3.)
+    E = (2*r*w/(w**2 + w*q + q**2) + M)/d
+    #-- fifth order correction
+    f2 = e*np.sin(E)
+    f3 = e*np.cos(E)
+    f0 = E - f2 - M
+    f1 = 1 - f3
+    d3 = -f0/(f1 - 0.5*f0*f2/f1)
+    d4 = -f0/(f1 + 0.5*d3*f2 + d3**2*f3/6.)
+    d5 = -f0/(f1 + 0.5*d4*f2 + d4**2*f3/6. - d4**3*f2/24.)
+    return E + d5
+
 
 
 def calculate_phase(T,e,omega,pshift=0):
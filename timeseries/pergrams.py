@@ -23,6 +23,11 @@ Many periodograms can be computed in parallel, by supplying an extra keyword
 
 >>> freq,ampl = scargle(times,signal,threads=2)
 
+When many light curves need to be analysed (e.g. a survey), use L{scargle_many}:
+light curves with the same time stamps then share the trigonometric terms.
+
+>>> output = scargle_many([times,times],[signal,2*signal])
+
 B{Warning}: the timeseries must be B{sorted in time} and B{cannot contain the
 same timepoint twice}. Otherwise, a 'ValueError, concatenation problem' can
 occur.
@@ -138,13 +143,19 @@ Phase folding techniques: L{box} and L{pdm}
 ]]include figure]]ivs_timeseries_pergrams_phase.png]
 
 """
+import os
+import time
+import hashlib
 import logging
 import numpy as np
 from numpy import cos,sin,pi
-from scipy.special import jn
 from ivs.aux.decorators import make_parallel
 from ivs.aux import loggers
 from ivs.aux import termtools
+from ivs.aux import progressMeter
+from ivs.io import ascii
+from ivs.units import constants
+from ivs.timeseries import keplerorbit
 from ivs.timeseries.decorators import parallel_pergram,defaults_pergram,getNyquist
 
 import pyscargle
@@ -798,7 +809,8 @@ def weightedpower(time, signal, weight, freq):
 @parallel_pergram
 @make_parallel
 def pdm(times, signal,f0=None,fn=None,df=None,Nbin=5,Ncover=2,
-         D=0,forbit=None,asini=None,e=None,omega=None,nmax=10):
+         D=0,forbit=None,asini=None,e=None,omega=None,nmax=10,t0=0.,
+         blocksize=None,engine='numpy'):
     """
     Phase Dispersion Minimization of Jurkevich-Stellingwerf (1978)
     
@@ -813,6 +825,17 @@ def pdm(times, signal,f0=None,fn=None,df=None,Nbin=5,Ncover=2,
     
     For circular orbits, give only forbit and asini.
     
+    Two engines are available. The Fortran engine (C{engine='fortran'})
+    loops over the frequencies and is limited to C{Nbin*Ncover<=1000}. The
+    NumPy engine (C{engine='numpy'}) phase folds blocks of C{blocksize}
+    frequencies at once, distributes the phases over C{Nbin*Ncover} small bins
+    with a single C{np.bincount} pass, and gets the statistics of all shifted
+    bins from cumulative sums of the small bins. The orbital light travel
+    time effect only changes the time stamps, so it is corrected once before
+    the folding. The NumPy engine gives the same statistic as the Fortran
+    routines (up to rounding at the bin edges) and is about twice as fast on
+    large data sets, so it is the default.
+    
     @param times: time points
     @type times: numpy array
     @param signal: observations
@@ -829,6 +852,23 @@ def pdm(times, signal,f0=None,fn=None,df=None,Nbin=5,Ncover=2,
     @type Ncover: int
     @param D: linear frequency shift parameter
     @type D: float
+    @param forbit: orbital frequency
+    @type forbit: float
+    @param asini: projected semi-major axis (AU)
+    @type asini: float
+    @param e: eccentricity
+    @type e: float
+    @param omega: longitude of periastron (radians)
+    @type omega: float
+    @param nmax: number of terms in the series for eccentric orbits
+    @type nmax: int
+    @param t0: reference time of eccentric orbits, as in
+    L{funclib.sine_orbit<ivs.sigproc.funclib.sine_orbit>}
+    @type t0: float
+    @param blocksize: number of frequencies processed at once (NumPy engine)
+    @type blocksize: int
+    @param engine: 'fortran' or 'numpy'
+    @type engine: str
     @return: frequencies, theta statistic
     @rtype: array,array
     """
@@ -843,27 +883,41 @@ def pdm(times, signal,f0=None,fn=None,df=None,Nbin=5,Ncover=2,
     s1 = np.zeros(nf,'d')
     
     #-- use Fortran subroutine
-    #-- Normal PDM
-    if D is None and asini is None:
-        f1, s1 = pyscargle.justel(signal,times,f0,df,Nbin,Ncover,xvar,xx,f1,s1,n,nf)
-    #-- PDM with linear frequency shift
-    elif asini is None:
-        f1, s1 = pyscargle.justel2(signal,times,f0,df,Nbin,Ncover,xvar,xx,D,f1,s1,n,nf)
-    #-- PDM with circular binary orbit
-    elif asini is not None and (e is None or e==0):
-        f1, s1 = pyscargle.justel3(signal,times,f0,df,Nbin,Ncover,xvar,xx,asini,
-                  forbit,f1,s1,n,nf)
-    #-- PDM with eccentric binary orbit
-    elif e>0:
-        forbit = 2*pi*forbit
-        ans,bns = np.array([[__ane__(n,e),__bne__(n,e)] for n in range(1,nmax+1)]).T
-        ksins = np.sqrt(ans**2*np.cos(omega)**2+bns**2*np.sin(omega)**2)
-        thns = np.arctan(bns/ans*np.tan(omega))
-        tau = -np.sum(bns*np.sin(omega))
-        f1, s1 = pyscargle.justel4(signal,times,f0,df,Nbin,Ncover,xvar,xx,asini,
-        forbit,e,omega,ksins,thns,tau,f1,s1,n,nf,nmax)
-        
+    if engine=='fortran':
+        if asini is not None:
+            raise ValueError('Fortran PDM engine does not support binary orbits')
+        #-- Normal PDM
+        if D is None:
+            f1, s1 = pyscargle.justel(signal,times,f0,df,Nbin,Ncover,xvar,xx,f1,s1,n,nf)
+        #-- PDM with linear frequency shift
+        else:
+            f1, s1 = pyscargle.justel2(signal,times,f0,df,Nbin,Ncover,xvar,xx,D,f1,s1,n,nf)
     
+    #-- use the vectorized engine
+    else:
+        #-- PDM with circular binary orbit: correct for the light travel time
+        #   (asini in AU, times in days)
+        if asini is not None and (e is None or e==0):
+            delay = asini*constants.au/constants.cc/(24*3600.)
+            times = times + delay*np.sin(2*pi*forbit*times)
+        #-- PDM with eccentric binary orbit
+        elif asini is not None:
+            delay = asini*constants.au/constants.cc/(24*3600.)
+            orders,ksins,thns,tau = keplerorbit.bessel_coefficients(e,omega,nmax=nmax)
+            arg = 2*pi*forbit*np.outer(times-t0,orders) + thns
+            times = times + delay*(np.dot(np.sin(arg),ksins) + tau)
+        f1 = f0 + np.arange(nf)*df
+        if blocksize is None:
+            blocksize = max(1,int(1e6/n))
+        for start in xrange(0,nf,blocksize):
+            counts,sums,sumsq = __pdm_covers__(times,signal,f1[start:start+blocksize],
+                                               Nbin,Ncover,D=D)
+            empty = counts==0
+            vm = xx*Ncover - (sums**2/np.where(empty,1,counts)).sum(axis=1)
+            dfre = n*Ncover - Nbin*Ncover + empty.sum(axis=1)
+            s1[start:start+blocksize] = vm/dfre/xvar
+    
+
     #-- it is possible that the first computed value is a none-variable
     if not s1[0]: s1[0] = 1. 
     
@@ -885,7 +939,9 @@ def pdm(times, signal,f0=None,fn=None,df=None,Nbin=5,Ncover=2,
 @defaults_pergram
 @parallel_pergram
 @make_parallel
-def box(times, signal, f0=None, fn=None, df=None, Nbin=10, qmi=0.005, qma=0.75 ):
+def box(times, signal, f0=None, fn=None, df=None, Nbin=10, qmi=0.005, qma=0.75,
+        rho_star=None, q_factors=(0.5,1.5), blocksize=None, full_output=False,
+        engine=None):
     """
     Box-Least-Squares spectrum of Kovacs et al (2002).
 
@@ -905,8 +961,35 @@ def box(times, signal, f0=None, fn=None, df=None, Nbin=10, qmi=0.005, qma=0.75 )
     
     Transit fraction and precision are given by nb,qmi and qma
     
-    Remark: output parameter parameter contains:
-    [frequency,depth,transit fraction width,fractional start, fraction end]
+    The spectrum is computed for blocks of C{blocksize} frequencies at once:
+    the phase-folded light curves of a block are binned with a single
+    C{np.bincount} call, and the sums over all trial transit durations and
+    starting bins are taken from the cumulative sums of the binned (and
+    wrapped) light curve. Hence every trial duration costs O(Nbin) operations
+    per frequency, instead of re-summing the bins. By default, the block size
+    is chosen to keep about 10^6 phases in memory.
+    
+    The original Fortran routine (C{engine='fortran'}) is faster for a plain
+    scan of all durations between C{qmi} and C{qma}, but is limited to 2000
+    bins and only returns the spectrum. The NumPy engine (C{engine='numpy'})
+    has no limit on the number of bins, can tie the durations to the stellar
+    density and can return the parameters of the best box at each frequency.
+    By default, the NumPy engine is only used when one of these features is
+    needed.
+    
+    If the density of the star is known (C{rho_star}, in solar units and
+    assuming the times are given in days), the range of fractional transit
+    durations is tied to the duration of a central transit of a circular orbit
+    at each trial period::
+    
+        q = 1/pi * arcsin( (3pi / (G rho P^2))^(1/3) )
+    
+    and only durations between C{q_factors[0]*q} and C{q_factors[1]*q} are
+    tested (still within C{qmi} and C{qma}).
+    
+    With C{full_output=True}, also the parameters of the best box at each
+    frequency are returned: depth, transit fraction width, and the (one-based)
+    bin indices of the start and end of the transit.
     
     @param times: observation times
     @type times: numpy 1D array
@@ -924,26 +1007,125 @@ def box(times, signal, f0=None, fn=None, df=None, Nbin=10, qmi=0.005, qma=0.75 )
     @type qmi: 0<float<qma<1
     @param qma: maximum fractional transit length to be tested
     @type qma: 0<qmi<float<1
+    @param rho_star: stellar density (solar units)
+    @type rho_star: float
+    @param q_factors: range of tested durations relative to the central transit
+    @type q_factors: tuple of two floats
+    @param blocksize: number of frequencies processed at once
+    @type blocksize: integer
+    @param full_output: return the parameters of the best box too
+    @type full_output: bool
+    @param engine: 'fortran' or 'numpy' (default: automatic)
+    @type engine: str
     @return: frequencies, amplitude spectrum
     @rtype: array,array
     """
     #-- initialize some variables needed in the FORTRAN module
     n = len(times)
     T = times.ptp()
-    u = np.zeros(n)
-    v = np.zeros(n)
     
     #-- frequency vector and variables
-    nf = (fn-f0)/df
     if f0<2./T: f0=2./T
     
-    #-- calculate EEBLS spectrum and model parameters
-    power,depth,qtran,in1,in2 = eebls.eebls(times,signal,u,v,nf,f0,df,Nbin,qmi,qma,n)
-    frequencies = np.linspace(f0,fn,nf)
+    if engine is None:
+        use_numpy = full_output or (rho_star is not None) or Nbin>2000
+        engine = use_numpy and 'numpy' or 'fortran'
+    
+    if engine=='fortran':
+        u = np.zeros(n)
+        v = np.zeros(n)
+        nf = (fn-f0)/df
+        #-- calculate EEBLS spectrum and model parameters
+        power,depth,qtran,in1,in2 = eebls.eebls(times,signal,u,v,nf,f0,df,Nbin,qmi,qma,n)
+        frequencies = np.linspace(f0,fn,nf)
+        #-- to return parameters of fit, do this:
+        # pars = [max_freq,depth,qtran+(1./float(nb)),(in1-1)/float(nb),in2/float(nb)]
+        return frequencies,power
+    
+    nf = int((fn-f0)/df+0.001)+1
+    frequencies = f0 + np.arange(nf)*df
+    if blocksize is None:
+        blocksize = max(1,int(1e6/n))
+    
+    #-- minimum number of bins and points in the box, as in EEBLS
+    minbin = 5
+    kkmi = max(minbin,int(n*qmi))
+    kmi = max(1,int(qmi*Nbin))
+    kma = int(qma*Nbin)+1
+    #-- if the stellar density is given, the range of trial durations depends on
+    #   the period
+    if rho_star is not None:
+        rho = rho_star*constants.Msol/(4./3.*pi*constants.Rsol**3)
+        periods = 86400./frequencies
+        q_circ = np.arcsin(np.minimum(1.,(3*pi/(constants.GG*rho*periods**2))**(1./3.)))/pi
+        k_min = np.maximum(kmi,(q_factors[0]*q_circ*Nbin).astype(int))
+        k_max = np.minimum(kma+1,(q_factors[1]*q_circ*Nbin).astype(int)+1)
+    else:
+        k_min = kmi*np.ones(nf,int)
+        k_max = (kma+1)*np.ones(nf,int)
+    
+    u = times - times[0]
+    v = signal - signal.mean()
+    power = np.zeros(nf)
+    depth = np.zeros(nf)
+    qtran = np.zeros(nf)
+    in1 = np.zeros(nf,int)
+    in2 = np.zeros(nf,int)
+    
+    weights = np.tile(v,min(blocksize,nf))
+    for start in xrange(0,nf,blocksize):
+        freqs = frequencies[start:start+blocksize]
+        nfb = len(freqs)
+        #-- phase fold and bin all frequencies of this block at once
+        bins = np.outer(Nbin*freqs,u).astype(int)
+        bins %= Nbin
+        bins += Nbin*np.arange(nfb)[:,None]
+        bins = bins.ravel()
+        counts = np.bincount(bins,minlength=nfb*Nbin).reshape((nfb,Nbin))
+        sums = np.bincount(bins,weights=weights[:nfb*n],minlength=nfb*Nbin).reshape((nfb,Nbin))
+        #-- wrap the bins to take the edge effect into account, and compute the
+        #   cumulative sums
+        cum_counts = np.zeros((nfb,Nbin+kma+1))
+        cum_sums = np.zeros((nfb,Nbin+kma+1))
+        cum_counts[:,1:] = np.hstack([counts,counts[:,np.arange(kma)%Nbin]]).cumsum(axis=1)
+        cum_sums[:,1:] = np.hstack([sums,sums[:,np.arange(kma)%Nbin]]).cumsum(axis=1)
+        #-- evaluate all trial durations (in number of bins) and start bins
+        best = np.zeros(nfb)
+        best_s = np.zeros(nfb)
+        best_kk = np.zeros(nfb)
+        best_i = np.zeros(nfb,int)
+        best_k = np.zeros(nfb,int)
+        k_min_ = k_min[start:start+blocksize]
+        k_max_ = k_max[start:start+blocksize]
+        for k in xrange(k_min_.min(),k_max_.max()+1):
+            kk = cum_counts[:,k:k+Nbin] - cum_counts[:,:Nbin]
+            s = cum_sums[:,k:k+Nbin] - cum_sums[:,:Nbin]
+            denom = kk*(n-kk)
+            denom[(kk<kkmi) | (denom==0)] = np.inf
+            #-- not all durations are tested at all frequencies
+            if rho_star is not None:
+                denom[(k<k_min_) | (k>k_max_)] = np.inf
+            pow_ = s**2/denom
+            i = pow_.argmax(axis=1)
+            pow_ = pow_[np.arange(nfb),i]
+            better = pow_>best
+            best[better] = pow_[better]
+            best_s[better] = s[better,i[better]]
+            best_kk[better] = kk[better,i[better]]
+            best_i[better] = i[better]
+            best_k[better] = k
+        power[start:start+blocksize] = np.sqrt(best)
+        if full_output:
+            found = best_kk>0
+            depth[start:start+blocksize][found] = -best_s[found]*n/(best_kk[found]*(n-best_kk[found]))
+            qtran[start:start+blocksize] = best_kk/n
+            in1[start:start+blocksize] = best_i+1
+            in2[start:start+blocksize] = (best_i+best_k-1)%Nbin+1
     
-    #-- to return parameters of fit, do this:
-    # pars = [max_freq,depth,qtran+(1./float(nb)),(in1-1)/float(nb),in2/float(nb)]
-    return frequencies,power
+    if full_output:
+        return frequencies,power,depth,qtran,in1,in2
+    else:
+        return frequencies,power
 
 
 
@@ -953,10 +1135,20 @@ def box(times, signal, f0=None, fn=None, df=None, Nbin=10, qmi=0.005, qma=0.75 )
 @parallel_pergram
 @make_parallel
 def kepler(times,signal, f0=None, fn=None, df=None, e0=0., en=0.91, de=0.1,
-           errors=None, wexp=2, x00=0.,x0n=359.9):
+           errors=None, wexp=2, x00=0.,x0n=359.9, blocksize=None, tablesize=2**14,
+           engine='numpy'):
     """
     Keplerian periodogram of Zucker et al (2010).
     
+    For every frequency, a grid in eccentricity and x0 is scanned, and the
+    power of the best Keplerian fit is retained. The original Fortran routine
+    (C{engine='fortran'}) solves Kepler's equation point by point. The NumPy
+    engine (C{engine='numpy'}, default) tabulates the true anomaly on a grid of
+    C{tablesize} mean anomalies for every eccentricity (see
+    L{keplerorbit.kepler_table}), and evaluates C{blocksize} frequencies and
+    the whole x0 grid at once by interpolation in that table. It is several
+    times faster and has no limit on the number of observations.
+    
     @param times: observation times
     @type times: numpy 1D array
     @param signal: observations
@@ -977,6 +1169,12 @@ def kepler(times,signal, f0=None, fn=None, df=None, e0=0., en=0.91, de=0.1,
     @type x00: float
     @param x0n: end x0
     @type x0n: float
+    @param blocksize: number of frequencies processed at once (NumPy engine)
+    @type blocksize: int
+    @param tablesize: number of intervals in the true anomaly tables (NumPy engine)
+    @type tablesize: int
+    @param engine: 'fortran' or 'numpy'
+    @type engine: str
     @return: frequencies, amplitude spectrum
     @rtype: array,array
     """
@@ -986,6 +1184,53 @@ def kepler(times,signal, f0=None, fn=None, df=None, e0=0., en=0.91, de=0.1,
         errors = np.ones(n)
     maxstep = int((fn-f0)/df+1)
     
+    if engine=='numpy':
+        #-- normalised weights and weighted, mean subtracted observations
+        weights = (1./errors)**wexp
+        weights = weights/weights.sum()
+        residus = signal - np.sum(weights*signal)
+        wresidus = weights*residus
+        YY = np.sum(wresidus*residus)
+        #-- x0 is measured with respect to the times as given, as in the
+        #   Fortran routine
+        phases = times*2*pi
+        f1 = f0 + np.arange(maxstep)*df
+        s2 = np.zeros(maxstep)
+        #-- same eccentricity and polar x0 grid as the Fortran routine
+        x00,x0n = x00/180.*pi,x0n/180.*pi
+        eccs = e0 + np.arange(max(int((en-e0+de)/de),0))*de
+        for ee in eccs:
+            x0step = 2*pi/int(2*pi*ee/de+1)
+            x0s = x00 + np.arange(max(int((x0n-x00+x0step)/x0step),0))*x0step
+            #-- tabulate the true anomaly on a fine grid in mean anomaly,
+            #   so that no trigonometric functions need to be evaluated
+            E = keplerorbit.kepler_table(ee,size=tablesize)
+            costab = (np.cos(E)-ee)/(1-ee*np.cos(E))
+            sintab = np.sqrt(1-ee**2)*np.sin(E)/(1-ee*np.cos(E))
+            dcostab,dsintab = np.diff(costab),np.diff(sintab)
+            nblock = blocksize
+            if nblock is None:
+                nblock = max(1,int(1e6/(n*len(x0s))))
+            for start in xrange(0,maxstep,nblock):
+                M = np.outer(f1[start:start+nblock],phases)[:,None,:] - x0s[:,None]
+                x = np.mod(M+pi,2*pi)*(tablesize/(2*pi))
+                index = np.minimum(x.astype(int),tablesize-1)
+                x -= index
+                cosv = costab[index] + dcostab[index]*x
+                sinv = sintab[index] + dsintab[index]*x
+                #-- weighted sine fit to the true anomalies (cfr. GLS)
+                C,S = np.dot(cosv,weights),np.dot(sinv,weights)
+                YC,YS = np.dot(cosv,wresidus),np.dot(sinv,wresidus)
+                CC = np.dot(cosv**2,weights)
+                CS = np.dot(cosv*sinv,weights)
+                SS = 1. - CC - S*S
+                CC = CC - C*C
+                CS = CS - C*S
+                D = CC*SS - CS*CS
+                power = (SS*YC**2 + CC*YS**2 - 2*CS*YC*YS)/D/YY
+                s2[start:start+nblock] = np.maximum(s2[start:start+nblock],power.max(axis=1))
+        return f1,s2
+    
     #-- initialize parameters
     f1 = np.zeros(maxstep) #-- frequency
     s1 = np.zeros(maxstep) #-- power
@@ -1138,49 +1383,31 @@ def pdm_py(time, signal, f0=None, fn=None, df=None, Nbin=10, Ncover=5, D=0.):
     Ntime = len(time)
     Nfreq = len(freq)
   
-    binsize = 1.0 / Nbin
-    covershift = 1.0 / (Nbin * Ncover)
-  
     theta = np.zeros(Nfreq)
-  
-    for i in range(Nfreq):
-  
-        # Compute the phases in [0,1[ for all time points
-        phase = np.fmod((time - time[0]) * freq[i] + D/2.*time**2, 1.0)
-    
-        # Reset the number of (shifted) bins without datapoints
     
-        Nempty = 0
+    # Process blocks of frequencies at once. The phases are distributed over
+    # Nbin*Ncover small bins, every (shifted) bin consists of Ncover
+    # consecutive small bins.
     
-        # Loop over all Nbin * Ncover (shifted) bins
+    blocksize = max(1,int(1e6/Ntime))
     
-        for k in range(Nbin):
-            for n in range(Ncover):
+    for start in xrange(0,Nfreq,blocksize):
         
-                # Determine the left and right boundary of one such bin
-                # Note that due to the modulo, right may be < left. So instead
-                # of 0-----+++++------1, the bin might be 0++-----------+++1 .
+        counts,sums,sumsq = __pdm_covers__(time-time[0],signal,freq[start:start+blocksize],
+                                           Nbin,Ncover,D=D,t_quad=time)
         
-                left = np.fmod(k * binsize + n * covershift, 1.0) 
-                right = np.fmod((k+1) * binsize + n * covershift, 1.0) 
-
-                # Select all data points in that bin
+        # Compute the contribution of each bin to the theta-statistics:
+        # (len(bindata) - 1) * bindata.var()
         
-                if (left < right):
-                    bindata = np.compress((left <= phase) & (phase < right), signal)
-                else:
-                    bindata = np.compress(~((right <= phase) & (phase < left)), signal)
-
-                # Compute the contribution of that bin to the theta-statistics  
-          
-                if (len(bindata) != 0):
-                    theta[i] += (len(bindata) - 1) * bindata.var()
-                else:
-                    Nempty += 1
-  
-        # Normalize the theta-statistics        
-
-        theta[i] /= Ncover * Ntime - (Ncover * Nbin - Nempty)     
+        nonempty = counts>0
+        counts_ = np.where(nonempty,counts,1)
+        contrib = (counts_-1.) * (sumsq/counts_ - (sums/counts_)**2)
+        Nempty = (~nonempty).sum(axis=1)
+        
+        # Normalize the theta-statistics
+        
+        theta[start:start+blocksize] = np.where(nonempty,contrib,0.).sum(axis=1) \
+                                     / (Ncover * Ntime - (Ncover * Nbin - Nempty))
     
     # Normalize the theta-statistics again
   
@@ -1319,6 +1546,205 @@ def fasper_py(x,y,ofac,hifac, MACC=4):
     return wk1,wk2,nout,jmax,prob
 #}
 
+#{ Batch processing
+
+@defaults_pergram
+def scargle_matrix(times, matrix, f0=None, fn=None, df=None, norm='amplitude',
+                   single=False, chunksize=500):
+    """
+    Scargle periodograms of all columns of a (time x column) matrix.
+
+    All columns share the same time stamps, so the sine and cosine terms are
+    the same for all of them. The sums over the time points are therefore
+    computed as the matrix product of the (frequency x time) trigonometric
+    basis with the (time x column) data matrix. The basis is built for
+    C{chunksize} frequencies at a time, to bound the memory usage.
+
+    The periodogram of each column is identical to the one computed with
+    L{scargle}. With C{single=True}, the matrix products are accumulated in
+    single precision (the phases are always computed in double precision).
+
+    >>> times = np.linspace(0,100,1000)
+    >>> matrix = np.column_stack([np.sin(2*pi*0.1*times),np.sin(2*pi*0.2*times)])
+    >>> freqs,ampls = scargle_matrix(times,matrix,fn=1.)
+
+    @param times: time points
+    @type times: numpy array
+    @param matrix: observations, one column per signal
+    @type matrix: 2D numpy array
+    @param f0: start frequency
+    @type f0: float
+    @param fn: stop frequency
+    @type fn: float
+    @param df: step frequency
+    @type df: float
+    @param norm: type of normalisation
+    @type norm: str
+    @param single: accumulate in single precision
+    @type single: bool
+    @param chunksize: number of frequencies evaluated in one matrix product
+    @type chunksize: int
+    @return: frequencies, amplitude spectra (frequency x column)
+    @rtype: array,2D array
+    """
+    dtype = single and np.float32 or np.float64
+    matrix = np.asarray(matrix)
+    if matrix.ndim==1:
+        matrix = matrix[:,None]
+    if matrix.shape[0]!=len(times):
+        raise ValueError('first axis of matrix must have the same length as times')
+    n = len(times)
+    T = times.ptp()
+    nf = int((fn-f0)/df+0.001)+1
+    freqs = f0 + np.arange(nf)*df
+    data = matrix.astype(dtype)
+
+    sum_s = np.zeros((nf,data.shape[1]),dtype)
+    sum_c = np.zeros((nf,data.shape[1]),dtype)
+    sum_s2 = np.zeros(nf)
+    sum_c2 = np.zeros(nf)
+    for start in xrange(0,nf,chunksize):
+        arg = 2*pi*np.outer(freqs[start:start+chunksize],times)
+        sin_arg = np.sin(arg)
+        cos_arg = np.cos(arg)
+        #-- double angle terms only depend on the time stamps
+        sum_s2[start:start+chunksize] = (2*sin_arg*cos_arg).sum(axis=1)
+        sum_c2[start:start+chunksize] = ((cos_arg-sin_arg)*(cos_arg+sin_arg)).sum(axis=1)
+        sum_s[start:start+chunksize] = np.dot(sin_arg.astype(dtype),data)
+        sum_c[start:start+chunksize] = np.dot(cos_arg.astype(dtype),data)
+    sum_s2 = sum_s2[:,None]
+    sum_c2 = sum_c2[:,None]
+    power = (sum_c**2*(n-sum_c2) + sum_s**2*(n+sum_c2) - 2*sum_s*sum_c*sum_s2) \
+              / (n**2 - sum_c2**2 - sum_s2**2)
+
+    #-- normalise as in scargle
+    fact = np.sqrt(4./n)
+    if norm=='distribution':
+        power /= matrix.var(axis=0)
+    elif norm=='amplitude':
+        power = fact * np.sqrt(power)
+    elif norm=='density':
+        power = fact**2 * power * T
+    return freqs,power
+
+def scargle_many(times_list, signals_list, f0=None, fn=None, df=None,
+                 norm='amplitude', nyq_stat=np.min, decimals=None,
+                 chunksize=500, batchsize=500, outdir=None, names=None,
+                 verbose=False):
+    """
+    Scargle periodograms of many light curves at once.
+
+    Light curves are grouped according to their time stamps. Within one group,
+    the trigonometric terms are computed only once for all stars, and the
+    sums over the time points are done as a matrix product of the (frequency
+    x time) basis with the (time x star) signal matrix (see L{scargle_matrix}).
+    The frequency grid is processed in chunks of C{chunksize} frequencies and
+    the stars of a group in batches of C{batchsize} light curves, so that the
+    memory usage stays bounded.
+
+    The result is identical to calling L{scargle} for each star separately,
+    except when C{decimals} is given: then light curves whose time stamps are
+    equal after rounding to C{decimals} decimals are put in the same group,
+    and the time stamps of the first light curve of the group are used for
+    all of them.
+
+    If C{outdir} is given, the periodogram of each star is written to disk as
+    soon as its batch is finished (two columns: frequency and amplitude), and
+    the list of filenames is returned instead of the periodograms. The names of
+    the files are taken from C{names}, or are the index of the star in the
+    input lists otherwise.
+
+    If C{f0}, C{fn} or C{df} are not given, they are determined per group in
+    the same way as in the L{defaults_pergram} decorator.
+
+    At the end, the number of stars, number of sampling groups and the
+    throughput (stars per second) are logged. With C{verbose=True}, a progress
+    bar is shown too.
+
+    >>> times = np.linspace(0,100,1000)
+    >>> signals = [np.sin(2*pi*(i+1)/10.*times) for i in range(3)]
+    >>> output = scargle_many([times]*3,signals,fn=1.)
+    >>> freqs,ampls = output[0]
+
+    @param times_list: time points of every star
+    @type times_list: list of numpy arrays
+    @param signals_list: observations of every star
+    @type signals_list: list of numpy arrays
+    @param f0: start frequency
+    @type f0: float
+    @param fn: stop frequency
+    @type fn: float
+    @param df: step frequency
+    @type df: float
+    @param norm: type of normalisation
+    @type norm: str
+    @param decimals: number of decimals used to group time stamps
+    @type decimals: int
+    @param chunksize: number of frequencies evaluated in one matrix product
+    @type chunksize: int
+    @param batchsize: maximum number of stars evaluated in one matrix product
+    @type batchsize: int
+    @param outdir: directory to write the periodograms to
+    @type outdir: str
+    @param names: names of the stars, used as filenames
+    @type names: list of str
+    @param verbose: show a progress bar
+    @type verbose: bool
+    @return: list of (frequencies, amplitude spectrum), or list of filenames
+    @rtype: list
+    """
+    nstars = len(times_list)
+    if len(signals_list)!=nstars:
+        raise ValueError('times_list and signals_list must have the same length')
+    if names is None:
+        names = ['%d'%(i) for i in range(nstars)]
+    if outdir is not None and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    #-- group the stars with the same time stamps
+    groups = {}
+    for i,times in enumerate(times_list):
+        times = np.asarray(times,float)
+        if decimals is not None:
+            times = np.round(times,decimals)
+        key = (len(times),hashlib.md5(times.tostring()).hexdigest())
+        groups.setdefault(key,[]).append(i)
+    logger.info('scargle_many: %d stars in %d sampling groups'%(nstars,len(groups)))
+
+    #-- only pass the frequency grid when it is given, the defaults are then
+    #   determined per group by defaults_pergram
+    kwargs = dict(norm=norm,nyq_stat=nyq_stat,chunksize=chunksize)
+    for name,value in zip(['f0','fn','df'],[f0,fn,df]):
+        if value is not None:
+            kwargs[name] = value
+
+    output = [None]*nstars
+    if verbose: Pmeter = progressMeter.ProgressMeter(total=nstars)
+    c0 = time.time()
+    for key in sorted(groups.keys()):
+        members = groups[key]
+        times = np.asarray(times_list[members[0]],float)
+        for bstart in xrange(0,len(members),batchsize):
+            batch = members[bstart:bstart+batchsize]
+            signals = np.column_stack([np.asarray(signals_list[i],float) for i in batch])
+            freqs,power = scargle_matrix(times,signals,**kwargs)
+            #-- stream the results per star
+            for j,i in enumerate(batch):
+                if outdir is not None:
+                    filename = os.path.join(outdir,'%s.pergram'%(names[i]))
+                    ascii.write_array([freqs,power[:,j]],filename,axis0='cols',
+                                      header=['freq','ampl'])
+                    output[i] = filename
+                else:
+                    output[i] = (freqs,power[:,j].copy())
+            if verbose: Pmeter.update(len(batch))
+
+    duration = time.time()-c0
+    logger.info('scargle_many: %d stars processed in %.2fs (%.1f stars/s)'%(nstars,duration,nstars/max(duration,1e-10)))
+    return output
+
+#}
+
 #{ Helper functions
 
 def windowfunction(time, freq):
@@ -1447,11 +1873,44 @@ def __spread__(y, yy, n, x, m):
             nden=(nden/(j+1-ilo))*(j-ihi)
             yy[j] = yy[j] + y*fac/(nden*(x-j))    
 
-def __ane__(n,e):
-    return 2.*np.sqrt(1-e**2)/e/n*jn(n,n*e)
+def __pdm_covers__(times,signal,freqs,Nbin,Ncover,D=0.,t_quad=None):
+    """
+    Bin the phase folded signal for a block of frequencies in all PDM bins.
+    
+    The phases are distributed over Nbin*Ncover small bins, using one
+    C{np.bincount} pass for all frequencies. Each of the Nbin*Ncover (shifted)
+    PDM bins consists of Ncover consecutive small bins (wrapping around phase
+    1), and its statistics are taken from cumulative sums of the small bins.
     
-def __bne__(n,e):
-    return 1./n*(jn(n-1,n*e)-jn(n+1,n*e))
+    The phase is computed as C{times*f + D/2*t_quad**2}, with C{t_quad}
+    defaulting to C{times}.
+    
+    @return: number of points, sum and sum of squares of the signal in each
+    PDM bin (frequency x bin)
+    @rtype: 3x2D array
+    """
+    if t_quad is None:
+        t_quad = times
+    nbc = Nbin*Ncover
+    nfb = len(freqs)
+    size = nfb*nbc
+    phase = np.outer(nbc*freqs,times)
+    if D:
+        phase += nbc*D/2.*t_quad**2
+    bins = np.floor(phase).astype(int) % nbc
+    bins += nbc*np.arange(nfb)[:,None]
+    bins = bins.ravel()
+    counts = np.bincount(bins,minlength=size)
+    sums = np.bincount(bins,weights=np.tile(signal,nfb),minlength=size)
+    sumsq = np.bincount(bins,weights=np.tile(signal**2,nfb),minlength=size)
+    output = []
+    for arr in [counts,sums,sumsq]:
+        arr = arr.reshape((nfb,nbc))
+        if Ncover>1:
+            wrapped = np.hstack([np.zeros((nfb,1)),arr,arr[:,:Ncover-1]]).cumsum(axis=1)
+            arr = wrapped[:,Ncover:] - wrapped[:,:nbc]
+        output.append(arr)
+    return output
 
     
 def getSignificance(wk1, wk2, nout, ofac):
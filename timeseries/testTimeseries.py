@@ -0,0 +1,133 @@
+"""
+Unit test covering timeseries.pergrams.py and timeseries.keplerorbit.py
+"""
+import numpy as np
+from scipy.special import jn
+from ivs.sigproc import funclib
+from ivs.timeseries import pergrams
+from ivs.timeseries import freqanalyse
+from ivs.timeseries import keplerorbit
+
+import unittest
+
+class ScargleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.times = np.sort(np.random.uniform(0, 50, 400))
+        self.signals = [np.sin(2*np.pi*0.7*self.times) + np.random.normal(size=400)*0.3,
+                        np.cos(2*np.pi*1.3*self.times) + 0.1*self.times]
+
+    def testScargleMany(self):
+        """ timeseries.pergrams.scargle_many against scargle """
+        times2 = np.sort(np.random.uniform(0, 30, 300))
+        times = [self.times, self.times, times2]
+        signals = self.signals + [np.sin(times2)]
+        output = pergrams.scargle_many(times, signals, f0=0.01, fn=3., df=0.001)
+        self.assertEqual(len(output), 3)
+        for t, y, (freqs, ampls) in zip(times, signals, output):
+            freqs_, ampls_ = pergrams.scargle(t, y, f0=0.01, fn=3., df=0.001)
+            self.assertTrue(np.allclose(freqs, freqs_, rtol=0, atol=1e-12))
+            self.assertTrue(np.allclose(ampls, ampls_, rtol=0, atol=1e-10))
+
+    def testScargleMatrix(self):
+        """ timeseries.pergrams.scargle_matrix against scargle """
+        freqs, ampls = pergrams.scargle_matrix(self.times, np.column_stack(self.signals),
+                                               f0=0.01, fn=3., df=0.001)
+        self.assertEqual(ampls.shape, (len(freqs), 2))
+        for i, y in enumerate(self.signals):
+            freqs_, ampls_ = pergrams.scargle(self.times, y, f0=0.01, fn=3., df=0.001)
+            self.assertTrue(np.allclose(freqs, freqs_, rtol=0, atol=1e-12))
+            self.assertTrue(np.allclose(ampls[:,i], ampls_, rtol=0, atol=1e-10))
+
+    def testSpectrum2D(self):
+        """ timeseries.freqanalyse.spectrum_2D vectorized and per wavelength """
+        times = np.linspace(0, 150, 100)
+        wavel = np.arange(4500., 4520.)
+        matrix = 1 - 0.5*np.exp(-(wavel-4510-5*np.sin(2*np.pi/10*times[:,None]))**2/10**2)
+        out1 = freqanalyse.spectrum_2D(times, wavel, matrix, method='scargle', model='sine',
+                                       f0=0.05, fn=0.3, full_output=True, vectorize=True)
+        out2 = freqanalyse.spectrum_2D(times, wavel, matrix, method='scargle', model='sine',
+                                       f0=0.05, fn=0.3, full_output=True, vectorize=False)
+        self.assertTrue(np.allclose(out1['model'], out2['model'], rtol=0, atol=1e-10))
+        self.assertTrue(np.allclose(out1['avprof'], out2['avprof'], rtol=0, atol=1e-10))
+        for name in out2['pars'].dtype.names:
+            self.assertTrue(np.allclose(out1['pars'][name], out2['pars'][name], rtol=1e-8, atol=1e-10),
+                            msg='parameter %s differs'%(name))
+        for pergram1, pergram2 in zip(out1['pergram'], out2['pergram']):
+            self.assertTrue(np.allclose(pergram1, pergram2, rtol=0, atol=1e-10))
+
+class BoxTestCase(unittest.TestCase):
+
+    def testEngines(self):
+        """ timeseries.pergrams.box numpy against fortran engine """
+        np.random.seed(1)
+        times = np.sort(np.random.uniform(0, 50, 400))
+        signal = np.ones(len(times)) + np.random.normal(size=len(times))*0.01
+        signal[np.mod(times*0.31, 1) < 0.05] -= 0.1
+        freqs1, power1 = pergrams.box(times, signal, f0=0.1, fn=0.5, df=0.001, engine='fortran')
+        freqs2, power2 = pergrams.box(times, signal, f0=0.1, fn=0.5, df=0.001, engine='numpy')
+        #-- the numpy engine includes the last frequency, the fortran one doesn't
+        power2 = power2[:len(power1)]
+        self.assertTrue(np.allclose(power1, power2, rtol=0, atol=1e-10))
+        self.assertAlmostEqual(freqs2[np.argmax(power2)], 0.31, places=2)
+
+class KeplerTestCase(unittest.TestCase):
+
+    def testEngines(self):
+        """ timeseries.pergrams.kepler numpy against fortran engine """
+        np.random.seed(1)
+        times = np.sort(np.random.uniform(0, 50, 400))
+        signal = np.sin(2*np.pi*0.7*times) + np.random.normal(size=len(times))*0.3
+        freqs1, power1 = pergrams.kepler(times, signal, f0=0.6, fn=0.8, df=0.002, engine='fortran')
+        freqs2, power2 = pergrams.kepler(times, signal, f0=0.6, fn=0.8, df=0.002, engine='numpy')
+        self.assertTrue(np.allclose(freqs1, freqs2, rtol=0, atol=1e-12))
+        self.assertTrue(np.allclose(power1, power2, rtol=0, atol=1e-4))
+
+    def testEccentricAnomaly(self):
+        """ timeseries.keplerorbit.eccentric_anomaly solves Kepler's equation """
+        M = np.linspace(-10, 10, 1001)
+        for e in [0., 0.3, 0.9, 0.99]:
+            E = keplerorbit.eccentric_anomaly(M, e)
+            self.assertTrue(np.allclose(E - e*np.sin(E), M, rtol=0, atol=1e-12), msg='e=%s'%(e))
+            table = keplerorbit.kepler_table(e)
+            E = keplerorbit.eccentric_anomaly(M, e, table=table)
+            self.assertTrue(np.allclose(E - e*np.sin(E), M, rtol=0, atol=1e-12), msg='e=%s (table)'%(e))
+        #-- eccentricities broadcast against the mean anomalies
+        e = np.array([0.1, 0.5, 0.8])[:,None]
+        E = keplerorbit.eccentric_anomaly(M, e)
+        self.assertEqual(E.shape, (3, len(M)))
+        self.assertTrue(np.allclose(E - e*np.sin(E), M, rtol=0, atol=1e-12))
+
+    def testBesselCoefficients(self):
+        """ timeseries.keplerorbit.bessel_coefficients against the series per order """
+        def ane(n,e): return 2.*np.sqrt(1-e**2)/e/n*jn(n,n*e)
+        def bne(n,e): return 1./n*(jn(n-1,n*e)-jn(n+1,n*e))
+        for e, omega in [(0.1, 2.), (0.4, 1.), (0.6, 4.)]:
+            ns, ksins, thns, tau = keplerorbit.bessel_coefficients(e, omega, nmax=10)
+            ans, bns = np.array([[ane(n,e),bne(n,e)] for n in range(1,11)]).T
+            self.assertTrue(np.allclose(ns, np.arange(1,11)))
+            self.assertTrue(np.allclose(ksins, np.sqrt(ans**2*np.cos(omega)**2+bns**2*np.sin(omega)**2)))
+            self.assertTrue(np.allclose(thns, np.arctan(bns/ans*np.tan(omega))))
+            self.assertAlmostEqual(tau, -np.sum(bns*np.sin(omega)))
+
+class PDMTestCase(unittest.TestCase):
+
+    def testOrbit(self):
+        """ timeseries.pergrams.pdm with binary orbit """
+        np.random.seed(3)
+        times = np.sort(np.random.uniform(0, 400, 3000))
+        for ecc in [None, 0.4]:
+            pars = [1., 5.2, 0.1, 0., 1/80., 20., 1.]
+            kwargs = dict(forbit=1/80., asini=20.)
+            if ecc is not None:
+                pars.append(ecc)
+                kwargs.update(e=ecc, omega=1.)
+            signal = funclib.sine_orbit().function(pars, times)
+
+            freqs, theta0 = pergrams.pdm(times, signal, f0=5.19, fn=5.21, df=1e-4, Nbin=10, Ncover=2)
+            freqs, theta = pergrams.pdm(times, signal, f0=5.19, fn=5.21, df=1e-4, Nbin=10, Ncover=2,
+                                        **kwargs)
+            msg = 'Light travel time is not corrected (e=%s)'%(ecc)
+            self.assertAlmostEqual(freqs[np.argmin(theta)], 5.2, places=6, msg=msg)
+            self.assertTrue(theta.min() < 0.1 < theta0.min(), msg=msg)
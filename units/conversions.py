@@ -526,9 +526,10 @@ except ImportError: print("Unable to load pyephem, stellar coordinate transforma
 #-- from IVS repository
 from ivs.units import constants
 from ivs.units.uncertainties import unumpy,AffineScalarFunc,ufloat
-from ivs.units.uncertainties.unumpy import log10,log,exp,sqrt
-from ivs.units.uncertainties.unumpy import sin,cos,tan
-from ivs.units.uncertainties.unumpy import arcsin,arccos,arctan
+from ivs.units.propagation import UArray
+from ivs.units.propagation import log10,log,exp,sqrt
+from ivs.units.propagation import sin,cos,tan
+from ivs.units.propagation import arcsin,arccos,arctan
 from ivs.sed import filters
 from ivs.io import ascii
 from ivs.aux import loggers
@@ -804,196 +805,319 @@ def convert(_from,_to,*args,**kwargs):
     @return: converted value
     @rtype: float
     """
-    #-- remember if user wants to unpack the results to have no trace of
-    #   uncertainties, or wants to get uncertainty objects back
-    unpack = kwargs.pop('unpack',True)
+    return compile_conversion(_from,_to)(*args,**kwargs)
+
+def compile_conversion(_from,_to,**context):
+    """
+    Compile the conversion from one unit to another.
     
-    #-- get the input arguments: if only one is given, it is either an
-    #   C{uncertainty} from the C{uncertainties} package, or it is just a float
-    if len(args)==1:
-        start_value = args[0]
-    #   if two arguments are given, we assume the first is the actual value and
-    #   the second is the error on the value
-    elif len(args)==2:
-        start_value = unumpy.uarray([args[0],args[1]])
-    else:
-        raise ValueError('illegal input')
+    Interpreting the unit strings is the expensive part of L{convert}. This
+    function does that once and returns a callable that only evaluates the
+    conversion. It takes the same arguments as L{convert}, without the units:
     
-    #-- (un)logarithmicize (denoted by '[]')
-    m_in = re.search(r'\[(.*)\]',_from)
-    m_out = re.search(r'\[(.*)\]',_to)
+    >>> to_cm = compile_conversion('km','cm')
+    >>> to_cm(1.)
+    100000.0
+    >>> to_cm(np.array([1.,2.]),np.array([0.1,0.1]))
+    (array([100000., 200000.]), array([10000., 10000.]))
     
-    if m_in is not None:
-        _from = m_in.group(1)
-        start_value = 10**start_value
-    if m_out is not None:
-        _to = m_out.group(1)
-        
-    #-- It is possible the user gave a convention for either the from or to
-    #   units (but not both!)
-    #-- break down the from and to units to their basic elements
-    if _from in _conventions:
-        _from = change_convention(_from,_to)
-    elif _to in _conventions:
-        _to = change_convention(_to,_from)
-    fac_from,uni_from = breakdown(_from)
-    fac_to,uni_to = breakdown(_to)
-    
-    #-- convert the kwargs to SI units if they are tuples (make a distinction
-    #   when uncertainties are given)
-    if uni_from!=uni_to and is_basic_unit(uni_from,'length') and not ('wave' in kwargs):# or 'freq' in kwargs_SI or 'photband' in kwargs_SI):
-        kwargs['wave'] = (start_value,_from)
-        logger.warning('Assumed input value to serve also for "wave" key')
-    elif uni_from!=uni_to and is_type(uni_from,'frequency') and not ('freq' in kwargs):# or 'freq' in kwargs_SI or 'photband' in kwargs_SI):
-        kwargs['freq'] = (start_value,_from)
-        logger.warning('Assumed input value to serve also for "freq" key')
-    kwargs_SI = {}
-    for key in kwargs:
-        if isinstance(kwargs[key],tuple):
-            kwargs_SI[key] = convert(kwargs[key][-1],'SI',*kwargs[key][:-1],unpack=False)
-        else:
-            kwargs_SI[key] = kwargs[key]
-    #-- add some default values if necessary
-    logger.debug('Convert %s to %s, fac_from-start_value %s/%s'%(uni_from,uni_to,fac_from,start_value))
+    The compiled conversions are cached per pair of units. Keyword arguments
+    that are the same for every call can be bound immediately:
     
-    #-- conversion is easy if same units
-    ret_value = 1.
+    >>> to_jy = compile_conversion('erg/s/cm2/AA','Jy',wave=(10000.,'AA'))
+    >>> print(to_jy(1e-10))
+    333.564095198
     
-    if uni_from==uni_to:
-        #-- if nonlinear conversions from or to:
-        if isinstance(fac_from,NonLinearConverter):
-            ret_value *= fac_from(start_value,**kwargs_SI)
-        else:
-            try:
-                ret_value *= fac_from*start_value
-            except TypeError:
-                raise TypeError('Cannot multiply value with a float; probably argument is a tuple (value,error), please expand with *(value,error)')
+    The cache is cleared when the convention changes (L{set_convention}). If
+    you alter the unit definitions by hand, call C{_compiled.clear()}.
     
-    #-- otherwise a little bit more complicated
-    else:
-        #-- first check where the unit differences are
-        uni_from_ = uni_from.split()
-        uni_to_ = uni_to.split()
-        only_from_c,only_to_c = sorted(list(set(uni_from_) - set(uni_to_))),sorted(list(set(uni_to_) - set(uni_from_)))
-        only_from_c,only_to_c = [list(components(i))[1:] for i in only_from_c],[list(components(i))[1:] for i in only_to_c]
-        #-- push them all bach to the left side (change sign of right hand side components)
-        left_over = " ".join(['%s%d'%(i,j) for i,j in only_from_c])
-        left_over+= " "+" ".join(['%s%d'%(i,-j) for i,j in only_to_c])
-        left_over = breakdown(left_over)[1]
-        #-- but be sure to convert everything to SI units so that the switch
-        #   can be interpreted.
-        left_over = [change_convention('SI',ilo) for ilo in left_over.split()]
-        only_from = "".join(left_over)
-        only_to = ''
-
-        #-- first we remove any differences concerning (ster)radians
-        #   we recently added fac_from* to all these things, maybe this needs to 
-        #   change?
-        #if 'rad2' in only_from:
-        #    start_value = fac_from*_switch['rad2_to_'](start_value,**kwargs_SI)
-        #    only_from = only_from.replace('rad2','')
-        #    logger.debug('Switching to /sr')
-        #    fac_from = 1.
-        #elif 'rad-2' in only_from:
-        #    start_value = fac_from*_switch['rad-2_to_'](start_value,**kwargs_SI)
-        #    only_from = only_from.replace('rad-2','')
-        #    logger.debug('Switching from /sr')
-        #    fac_from = 1.
-        #elif 'rad1' in only_from:
-        #    start_value = fac_from*_switch['rad1_to_'](start_value,**kwargs_SI)
-        #    only_from = only_from.replace('rad1','')
-        #    logger.debug('Switching to /rad')
-        #    fac_from = 1.
-        #elif 'rad-1' in only_from:
-        #    start_value = fac_from*_switch['rad-1_to_'](start_value,**kwargs_SI)
-        #    only_from = only_from.replace('rad-1','')
-        #    logger.debug('Switching from /rad')
-        #    fac_from = 1.
+    @param _from: units to convert from
+    @type _from: str
+    @param _to: units to convert to
+    @type _to: str
+    @return: conversion function
+    @rtype: callable
+    """
+    key = (_from,_to)
+    if not key in _compiled:
+        _compiled[key] = CompiledConversion(_from,_to)
+    conversion = _compiled[key]
+    if context:
+        conversion = functools.partial(conversion,**context)
+    return conversion
+
+class CompiledConversion(object):
+    """
+    Conversion between two units, with the unit strings already interpreted.
+    
+    Use L{compile_conversion} to get a cached instance.
+    """
+    def __init__(self,_from,_to):
+        self.units = (_from,_to)
+        #-- (un)logarithmicize (denoted by '[]')
+        m_in = re.search(r'\[(.*)\]',_from)
+        m_out = re.search(r'\[(.*)\]',_to)
+        self.log_in = m_in is not None
+        self.log_out = m_out is not None
+        if self.log_in:
+            _from = m_in.group(1)
+        if self.log_out:
+            _to = m_out.group(1)
+        
+        #-- It is possible the user gave a convention for either the from or to
+        #   units (but not both!)
+        #-- break down the from and to units to their basic elements
+        if _from in _conventions:
+            _from = change_convention(_from,_to)
+        elif _to in _conventions:
+            _to = change_convention(_to,_from)
+        self._from = _from
+        self.fac_from,uni_from = breakdown(_from)
+        self.fac_to,uni_to = breakdown(_to)
+        self.same_units = uni_from==uni_to
         
-        #-- then we do what is left over (if anything is left over)
-        if only_from or only_to:
-            logger.debug("Convert %s to %s"%(only_from,only_to))
+        #-- the input value can serve as the wavelength or frequency if none
+        #   is given
+        self.value_key = None
+        if not self.same_units and is_basic_unit(uni_from,'length'):
+            self.value_key = 'wave'
+        elif not self.same_units and is_type(uni_from,'frequency'):
+            self.value_key = 'freq'
+        logger.debug('Compile conversion %s to %s, fac_from=%s'%(uni_from,uni_to,self.fac_from))
+        
+        self.switch = None
+        self.inverse = False
+        if not self.same_units:
+            #-- first check where the unit differences are
+            uni_from_ = uni_from.split()
+            uni_to_ = uni_to.split()
+            only_from_c,only_to_c = sorted(list(set(uni_from_) - set(uni_to_))),sorted(list(set(uni_to_) - set(uni_from_)))
+            only_from_c,only_to_c = [list(components(i))[1:] for i in only_from_c],[list(components(i))[1:] for i in only_to_c]
+            #-- push them all bach to the left side (change sign of right hand side components)
+            left_over = " ".join(['%s%d'%(i,j) for i,j in only_from_c])
+            left_over+= " "+" ".join(['%s%d'%(i,-j) for i,j in only_to_c])
+            left_over = breakdown(left_over)[1]
+            #-- but be sure to convert everything to SI units so that the switch
+            #   can be interpreted.
+            left_over = [change_convention('SI',ilo) for ilo in left_over.split()]
+            only_from = "".join(left_over)
+            only_to = ''
+            self.key = '%s_to_%s'%(only_from,only_to)
             
+            #-- then we do what is left over (if anything is left over)
+            if only_from or only_to:
+                if self.key in _switch:
+                    self.switch = _switch[self.key]
+                    logger.debug('Switching from {} to {} via {:s}'.format(only_from,only_to,self.switch.__name__))
+                #-- try to be smart an reverse the units:
+                elif not (Unit(1.,uni_from)*Unit(1.,uni_to))[1]:
+                    self.switch = period2freq
+                    self.inverse = True
+                else:
+                    logger.critical('cannot convert %s to %s: no %s definition in dict _switch'%(_from,_to,self.key))
+                    raise KeyError(self.key)
+    
+    def __call__(self,*args,**kwargs):
+        """
+        Convert the value (and error).
+        
+        See L{convert} for the arguments.
+        """
+        #-- remember if user wants to unpack the results to have no trace of
+        #   uncertainties, or wants to get uncertainty objects back
+        unpack = kwargs.pop('unpack',True)
+        
+        #-- get the input arguments: if only one is given, it is either an
+        #   C{uncertainty} from the C{uncertainties} package, or it is just a float
+        if len(args)==1:
+            start_value = args[0]
+        #   if two arguments are given, we assume the first is the actual value and
+        #   the second is the error on the value. Errors on arrays are
+        #   propagated on the whole array at once, unless the uncertainty
+        #   objects are asked for.
+        elif len(args)==2 and np.ndim(args[0]) and unpack:
+            start_value = UArray(args[0],args[1])
+        elif len(args)==2:
+            start_value = unumpy.uarray([args[0],args[1]])
+        else:
+            raise ValueError('illegal input')
+        
+        if self.log_in:
+            start_value = 10**start_value
+        
+        #-- convert the kwargs to SI units if they are tuples (make a distinction
+        #   when uncertainties are given)
+        if self.value_key is not None and not (self.value_key in kwargs):
+            kwargs[self.value_key] = (start_value,self._from)
+            logger.warning('Assumed input value to serve also for "%s" key'%(self.value_key))
+        kwargs_SI = {}
+        for key in kwargs:
+            if isinstance(kwargs[key],tuple):
+                kwargs_SI[key] = convert(kwargs[key][-1],'SI',*kwargs[key][:-1],unpack=False)
+            else:
+                kwargs_SI[key] = kwargs[key]
+        
+        fac_from,fac_to = self.fac_from,self.fac_to
+        
+        #-- conversion is easy if same units
+        ret_value = 1.
+        
+        if self.same_units:
+            #-- if nonlinear conversions from or to:
+            if isinstance(fac_from,NonLinearConverter):
+                ret_value *= fac_from(start_value,**kwargs_SI)
+            else:
+                try:
+                    ret_value *= fac_from*start_value
+                except TypeError:
+                    raise TypeError('Cannot multiply value with a float; probably argument is a tuple (value,error), please expand with *(value,error)')
+        
+        #-- otherwise a little bit more complicated
+        elif self.inverse:
+            ret_value *= period2freq(fac_from*start_value,**kwargs_SI)
+            logger.warning('It is assumed that the "from" unit is the inverse of the "to" unit')
+        elif self.switch is not None:
             #-- nonlinear conversions need a little tweak
             try:
-                key = '%s_to_%s'%(only_from,only_to)
-                logger.debug('Switching from {} to {} via {:s}'.format(only_from,only_to,_switch[key].__name__))
                 if isinstance(fac_from,NonLinearConverter):
-                    ret_value *= _switch[key](fac_from(start_value,**kwargs_SI),**kwargs_SI)
+                    ret_value *= self.switch(fac_from(start_value,**kwargs_SI),**kwargs_SI)
                 #-- linear conversions are easy
                 else:
-                    logger.debug('fac_from=%s, start_value=%s with kwargs %s'%(fac_from,start_value,kwargs_SI))
-                    ret_value *= _switch[key](fac_from*start_value,**kwargs_SI)
+                    ret_value *= self.switch(fac_from*start_value,**kwargs_SI)
             except KeyError:
-                #-- try to be smart an reverse the units:
-                if not (Unit(1.,uni_from)*Unit(1.,uni_to))[1]:
-                    ret_value *= period2freq(fac_from*start_value,**kwargs_SI)
-                    logger.warning('It is assumed that the "from" unit is the inverse of the "to" unit')
-                else:
-                    logger.critical('cannot convert %s to %s: no %s definition in dict _switch'%(_from,_to,key))
-                    raise
+                logger.critical('cannot convert %s to %s: no %s definition in dict _switch'%(self.units[0],self.units[1],self.key))
+                raise
         else:
             ret_value *= start_value
-    #-- final step: convert to ... (again distinction between linear and
-    #   nonlinear converters)
-    if isinstance(fac_to,NonLinearConverter):
-        ret_value = fac_to(ret_value,inv=True,**kwargs_SI)
-    else:
-        ret_value /= fac_to
-    
-    #-- logarithmicize
-    if m_out is not None:
-        ret_value = log10(ret_value)
+        #-- final step: convert to ... (again distinction between linear and
+        #   nonlinear converters)
+        if isinstance(fac_to,NonLinearConverter):
+            ret_value = fac_to(ret_value,inv=True,**kwargs_SI)
+        else:
+            ret_value /= fac_to
+        
+        #-- logarithmicize
+        if self.log_out:
+            ret_value = log10(ret_value)
+            
+        #-- unpack the uncertainties if: 
+        #    1. the input was not given as an uncertainty
+        #    2. the input was without uncertainties, but extra keywords had uncertainties
+        #    3. the input was with uncertainties (float or array) and unpack==True
+        unpack_case1 = len(args)==2
+        unpack_case2 = len(args)==1 and isinstance(ret_value,(AffineScalarFunc,UArray))
+        if unpack and (unpack_case1 or unpack_case2) and isinstance(ret_value,UArray):
+            ret_value = ret_value.nominal_values(),ret_value.std_devs()
+        elif unpack and (unpack_case1 or unpack_case2):
+            ret_value = unumpy.nominal_values(ret_value),unumpy.std_devs(ret_value)
+            #-- convert to real floats if real floats were given
+            if not ret_value[0].shape:
+                ret_value = np.asscalar(ret_value[0]),np.asscalar(ret_value[1])    
         
-    #-- unpack the uncertainties if: 
-    #    1. the input was not given as an uncertainty
-    #    2. the input was without uncertainties, but extra keywords had uncertainties
-    #    3. the input was with uncertainties (float or array) and unpack==True
-    unpack_case1 = len(args)==2
-    unpack_case2 = len(args)==1 and isinstance(ret_value,AffineScalarFunc)
-    unpack_case3 = len(args)==1 and isinstance(ret_value,np.ndarray) and isinstance(ret_value[0],AffineScalarFunc)
-    if unpack and (unpack_case1 or unpack_case2):
-        ret_value = unumpy.nominal_values(ret_value),unumpy.std_devs(ret_value)
-        #-- convert to real floats if real floats were given
-        if not ret_value[0].shape:
-            ret_value = np.asscalar(ret_value[0]),np.asscalar(ret_value[1])    
-    
-    return ret_value
+        return ret_value
 
 
 def nconvert(_froms,_tos,*args,**kwargs):
     """
     Convert a list/array/tuple of values with different units to other units.
     
-    This silently catches some exceptions and replaces the value with nan!
-    
-    @rtype: array
-    """
-    if len(args)==1:
-        ret_value = np.zeros((len(args[0])))
-    elif len(args)==2:
-        ret_value = np.zeros((len(args[0]),2))
+    Values with the same units and the same non-numerical keyword arguments
+    (e.g. C{photband}) are converted together in one array operation. Numerical
+    keyword arguments (e.g. C{wave}) can be given per value as an array.
+    
+    >>> print(nconvert(['km','m','km'],'cm',np.array([1.,2.,3.])))
+    [1.e+05 2.e+02 3.e+05]
+    
+    If the conversion of a group fails with a C{ValueError} (e.g. no calibration
+    available), the values of that group are converted one by one, the ones
+    that fail are replaced with nan and a warning is logged. Values that are
+    finite but give a non-finite result (e.g. the errors of a negative flux in
+    magnitude) are reported as failed as well. Set C{full_output=True} to get
+    the reason for every failed index:
+    
+    >>> values,failed = nconvert('mag','Jy',np.array([1.,2.]),photband=['2MASS.J','FOO.BAR'],full_output=True)
+    >>> print(np.isnan(values))
+    [False  True]
+    >>> print(failed)
+    {1: 'No calibrations for FOO.BAR'}
+    >>> values,failed = nconvert('erg/s/cm2/AA','mag',np.array([1e-10,-1e-10]),photband='GENEVA.V',full_output=True)
+    >>> print(np.isnan(values))
+    [False  True]
+    >>> print(failed)
+    {1: 'math domain error'}
+    >>> values,failed = nconvert('erg/s/cm2/AA','mag',np.array([1e-10,-1e-10]),np.array([1e-12,1e-12]),photband='GENEVA.V',full_output=True)
+    >>> print(np.isnan(values))
+    [[False  True]
+     [False  True]]
+    >>> print(failed)
+    {1: 'result is not finite'}
+    
+    @keyword full_output: return the failed indices and reasons as well
+    @type full_output: bool
+    @return: converted values (and errors) (, failed indices and reasons)
+    @rtype: array (, dict)
+    """
+    full_output = kwargs.pop('full_output',False)
+    nvalues = len(args[0])
+    if isinstance(_froms,str):
+        _froms = [_froms]*nvalues
     if isinstance(_tos,str):
-        _tos = [_tos for i in _froms]
-    elif isinstance(_froms,str):
-        _froms = [_froms for i in _tos]
-    
-    for i,(_from,_to) in enumerate(list(zip(_froms,_tos))):
-        myargs = [iarg[i] for iarg in args]
-        mykwargs = {}
-        for key in kwargs:
-            if not isinstance(kwargs[key],str) and hasattr(kwargs[key],'__iter__'):
-                mykwargs[key] = kwargs[key][i]
-            else:
-                mykwargs[key] = kwargs[key]
+        _tos = [_tos]*nvalues
+    #-- separate the keywords given per value from the shared ones. Tuples are
+    #   (value,unit) specifications, and thus shared
+    shared,arrays,labels = {},{},{}
+    for key in kwargs:
+        if isinstance(kwargs[key],(str,tuple)) or not hasattr(kwargs[key],'__iter__'):
+            shared[key] = kwargs[key]
+        elif np.asarray(kwargs[key]).dtype.kind in 'SUO':
+            labels[key] = list(kwargs[key])
+        else:
+            arrays[key] = np.asarray(kwargs[key])
+    #-- group the values on units and labels
+    label_keys = sorted(labels.keys())
+    groups = collections.OrderedDict()
+    for i,group in enumerate(zip(_froms,_tos,*[labels[key] for key in label_keys])):
+        groups.setdefault(group,[]).append(i)
+    
+    args = [np.asarray(arg) for arg in args]
+    ret_value = np.zeros((len(args),nvalues))
+    failed = {}
+    for group,indices in groups.items():
+        indices = np.array(indices)
+        mykwargs = dict(shared)
+        mykwargs.update(zip(label_keys,group[2:]))
+        for key in arrays:
+            mykwargs[key] = arrays[key][indices]
         try:
-            ret_value[i] = convert(_from,_to,*myargs,**mykwargs)
-        except ValueError: #no calibration
-            ret_value[i] = np.nan
+            ret_value[:,indices] = compile_conversion(*group[:2])(*[arg[indices] for arg in args],**mykwargs)
+            continue
+        except ValueError: #no calibration, or only some values are invalid
+            pass
+        #-- retry the group value by value, so that only the failing ones are lost
+        messages = {}
+        for i in indices:
+            for key in arrays:
+                mykwargs[key] = arrays[key][i:i+1]
+            try:
+                ret_value[:,i:i+1] = compile_conversion(*group[:2])(*[arg[i:i+1] for arg in args],**mykwargs)
+            except ValueError as msg:
+                ret_value[:,i] = np.nan
+                messages[i] = str(msg)
+        failed.update(messages)
+        for msg in sorted(set(messages.values())):
+            logger.warning('Cannot convert {0:d} value(s) from {1} to {2} ({3}): {4}'.format(messages.values().count(msg),group[0],group[1],
+                            ', '.join(['%s=%s'%(key,val) for key,val in zip(label_keys,group[2:])]),msg))
+    
+    #-- finite input should give finite output, otherwise it failed silently
+    invalid = np.isfinite(np.array(args,float)).all(axis=0) & ~np.isfinite(ret_value).all(axis=0)
+    invalid = [int(i) for i in np.flatnonzero(invalid) if not i in failed]
+    if invalid:
+        failed.update([(i,'result is not finite') for i in invalid])
+        logger.warning('Conversion of {0:d} value(s) gave a non-finite result'.format(len(invalid)))
     
-    if len(args)==2:
-        ret_value = ret_value.T
-    return ret_value
+    if len(args)==1:
+        ret_value = ret_value[0]
+    return full_output and (ret_value,failed) or ret_value
 
 
 def change_convention(to_,units,origin=None):
@@ -1093,6 +1217,7 @@ def set_convention(units='SI',values='standard',frequency='rad'):
         _switch['rad-1_to_'] = do_nothing
         constants._current_frequency = frequency.lower()
         logger.debug('Changed frequency convention to {0}'.format(frequency))
+    _compiled.clear()
         
     if to_return[:2]==(units,values):
         return to_return
@@ -1174,6 +1299,7 @@ def set_convention(units='SI',values='standard',frequency='rad'):
     if units=='SI' and values=='standard' and frequency=='rad':
         reload(constants)
         logger.warning('Reloading of constants')
+    _compiled.clear()
     logger.info('Changed convention to {0} with values from {1} set'.format(units,values))
     return to_return
 
@@ -2991,6 +3117,7 @@ def set_exchange_rates():
             prefix,curr,interfix,rate,postfix = line.split("'")
             _factors[curr] = (1/float(rate),'EUR','currency','<some currency>')
     ff.close()
+    _compiled.clear()
     #-- now also retrieve the name of the currencies:
     myurl = 'http://www.ecb.europa.eu/stats/exchange/eurofxref/html/index.en.html'
     url = urllib.URLopener()
@@ -3732,6 +3859,9 @@ _switch = {'s1_to_':       distance2velocity, # switch from wavelength to veloci
            'cy2_to_':      do_nothing,
            'cy-2_to_':     do_nothing,
            }
+
+#-- Cache of compiled conversions, keyed by the pair of unit strings
+_compiled = {}
  
  
 if __name__=="__main__":
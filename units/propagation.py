@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+First-order propagation of uncertainties on whole arrays.
+
+The C{uncertainties} package represents an array of measurements with errors as
+an object array of L{AffineScalarFunc}, which propagates derivatives one
+element at a time. L{UArray} stores the nominal values and the error
+contributions of every independent variable as plain numpy arrays instead, so
+that arithmetic and the mathematical functions below run at array speed.
+
+Each element of an array built from values and errors is an independent
+variable, i.e. the Jacobian with respect to the input is diagonal. This holds
+as long as only element-wise operations are applied. Scalar numbers with
+uncertainties (C{ufloat}) can be mixed in, and their correlations are kept.
+
+>>> x = UArray([1.,2.],[0.1,0.2])
+>>> y = 10**(x/2.5)
+>>> print(std_devs(y/y))
+[0. 0.]
+>>> print(nominal_values(log10(y)*2.5))
+[1. 2.]
+
+Where the function is not defined, both the value and the error are nan:
+
+>>> print(std_devs(log10(UArray([1.,-1.],[0.1,0.1]))))
+[0.04342945        nan]
+
+The functions C{log10}, C{exp}, ... and L{nominal_values}, L{std_devs} fall
+back to their L{unumpy} equivalents when they are not given a L{UArray}.
+"""
+import logging
+import numpy as np
+
+from ivs.aux import loggers
+from ivs.units.uncertainties import AffineScalarFunc
+from ivs.units.uncertainties import unumpy
+
+logger = logging.getLogger("UNITS.PROP")
+logger.addHandler(loggers.NullHandler())
+
+#{ Arrays with uncertainties
+
+class UArray(object):
+    """
+    Array of nominal values with linearly propagated uncertainties.
+    
+    The uncertainty is stored per independent variable as an array of error
+    contributions (derivative times standard deviation), in the dictionary
+    C{derivatives}. The standard deviation is the quadratic sum of all
+    contributions.
+    """
+    #-- make sure numpy leaves binary operations to this class
+    __array_ufunc__ = None
+    __array_priority__ = 1000
+    
+    def __init__(self,nominal,std_devs=None,derivatives=None):
+        """
+        @param nominal: nominal values
+        @type nominal: array
+        @param std_devs: standard deviations, these define new independent
+        variables
+        @type std_devs: array
+        @param derivatives: error contributions per variable
+        @type derivatives: dict
+        """
+        self.nominal = np.asarray(nominal,float)
+        if derivatives is None:
+            derivatives = {}
+        if std_devs is not None:
+            derivatives[object()] = np.asarray(std_devs,float)
+        self.derivatives = derivatives
+    
+    def nominal_values(self):
+        return self.nominal
+    
+    def std_devs(self):
+        variance = np.zeros(self.nominal.shape)
+        for contribution in self.derivatives.values():
+            variance = variance + contribution**2
+        return np.sqrt(variance)
+    
+    @property
+    def shape(self):
+        return self.nominal.shape
+    
+    def __len__(self):
+        return len(self.nominal)
+    
+    def __getitem__(self,index):
+        shape = self.nominal.shape
+        derivatives = dict([(key,np.broadcast_to(contribution,shape)[index])\
+                             for key,contribution in self.derivatives.items()])
+        return UArray(self.nominal[index],derivatives=derivatives)
+    
+    def __repr__(self):
+        return 'UArray(%r, %r)'%(self.nominal,self.std_devs())
+    
+    def _apply(self,nominal,derivative):
+        """
+        Result of a function of this array with given derivative.
+        """
+        derivatives = dict([(key,derivative*contribution) for key,contribution in self.derivatives.items()])
+        return UArray(nominal,derivatives=derivatives)
+    
+    #-- arithmetic, the partial derivatives are given per argument
+    def __add__(self,other):
+        other = upcast(other)
+        return _combine(self.nominal+other.nominal,(self,1.),(other,1.))
+    
+    def __sub__(self,other):
+        other = upcast(other)
+        return _combine(self.nominal-other.nominal,(self,1.),(other,-1.))
+    
+    def __rsub__(self,other):
+        return upcast(other)-self
+    
+    def __mul__(self,other):
+        other = upcast(other)
+        return _combine(self.nominal*other.nominal,(self,other.nominal),(other,self.nominal))
+    
+    def __div__(self,other):
+        other = upcast(other)
+        nominal = self.nominal/other.nominal
+        return _combine(nominal,(self,1./other.nominal),(other,-nominal/other.nominal))
+    
+    def __rdiv__(self,other):
+        return upcast(other)/self
+    
+    def __pow__(self,other):
+        other = upcast(other)
+        nominal = self.nominal**other.nominal
+        terms = []
+        if self.derivatives:
+            terms.append((self,other.nominal*self.nominal**(other.nominal-1)))
+        if other.derivatives:
+            terms.append((other,nominal*np.log(self.nominal)))
+        return _combine(nominal,*terms)
+    
+    def __rpow__(self,other):
+        return upcast(other)**self
+    
+    def __neg__(self):
+        return self._apply(-self.nominal,-1.)
+    
+    def __pos__(self):
+        return self
+    
+    def __abs__(self):
+        return self._apply(np.abs(self.nominal),np.sign(self.nominal))
+    
+    __radd__ = __add__
+    __rmul__ = __mul__
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+
+def upcast(x):
+    """
+    Convert a constant, number with uncertainty or object array to a L{UArray}.
+    
+    @param x: input
+    @type x: float, array, AffineScalarFunc, UArray
+    @rtype: UArray
+    """
+    if isinstance(x,UArray):
+        return x
+    if isinstance(x,AffineScalarFunc):
+        derivatives = dict([(var,deriv*var.std_dev()) for var,deriv in x.derivatives.items()])
+        return UArray(x.nominal_value,derivatives=derivatives)
+    x = np.asarray(x)
+    if x.dtype==object:
+        #-- collect the contributions of all variables element by element
+        derivatives = {}
+        for i,element in enumerate(x.flat):
+            if not isinstance(element,AffineScalarFunc): continue
+            for var,deriv in element.derivatives.items():
+                if not var in derivatives:
+                    derivatives[var] = np.zeros(x.shape)
+                derivatives[var].flat[i] = deriv*var.std_dev()
+        return UArray(unumpy.nominal_values(x),derivatives=derivatives)
+    return UArray(x)
+
+def _combine(nominal,*terms):
+    """
+    Combine the error contributions of the arguments of a function.
+    
+    @param nominal: nominal value of the result
+    @type nominal: array
+    @param terms: (argument, partial derivative of the function to it)
+    @type terms: tuples
+    @rtype: UArray
+    """
+    derivatives = {}
+    for x,derivative in terms:
+        for key,contribution in x.derivatives.items():
+            if key in derivatives:
+                derivatives[key] = derivatives[key] + derivative*contribution
+            else:
+                derivatives[key] = derivative*contribution
+    return UArray(nominal,derivatives=derivatives)
+
+#}
+
+#{ Functions
+
+def nominal_values(x):
+    """
+    Nominal values of a L{UArray} or an array of numbers with uncertainties.
+    """
+    if isinstance(x,UArray):
+        return x.nominal_values()
+    return unumpy.nominal_values(x)
+
+def std_devs(x):
+    """
+    Standard deviations of a L{UArray} or an array of numbers with uncertainties.
+    """
+    if isinstance(x,UArray):
+        return x.std_devs()
+    return unumpy.std_devs(x)
+
+def _vectorized(name,func,derivative):
+    """
+    Make a version of C{unumpy.name} that is evaluated at once on a L{UArray}.
+    
+    Outside the domain of the function, the error is nan as well.
+    """
+    unumpy_func = getattr(unumpy,name)
+    def vectorized(x):
+        if isinstance(x,UArray):
+            nominal = func(x.nominal)
+            return x._apply(nominal,np.where(np.isfinite(nominal),derivative(x.nominal),np.nan))
+        return unumpy_func(x)
+    vectorized.__name__ = name
+    vectorized.__doc__ = "Version of unumpy.%s that also works on a UArray."%(name)
+    return vectorized
+
+log10 = _vectorized('log10',np.log10,lambda x: 1./(x*np.log(10.)))
+log = _vectorized('log',np.log,lambda x: 1./x)
+exp = _vectorized('exp',np.exp,np.exp)
+sqrt = _vectorized('sqrt',np.sqrt,lambda x: 0.5/np.sqrt(x))
+sin = _vectorized('sin',np.sin,np.cos)
+cos = _vectorized('cos',np.cos,lambda x: -np.sin(x))
+tan = _vectorized('tan',np.tan,lambda x: 1./np.cos(x)**2)
+arcsin = _vectorized('arcsin',np.arcsin,lambda x: 1./np.sqrt(1-x**2))
+arccos = _vectorized('arccos',np.arccos,lambda x: -1./np.sqrt(1-x**2))
+arctan = _vectorized('arctan',np.arctan,lambda x: 1./(1+x**2))
+
+#}
+
+if __name__=="__main__":
+    import doctest
+    doctest.testmod()